@@ -0,0 +1,99 @@
+# coding: utf-8
+"""Cost of messy search paths for the dynamic loader.
+
+Builds an LD_LIBRARY_PATH like the one of a shell that sourced `init`
+several times and switched MPIs: the shims repeated, directories that
+do not exist, the shims of another mpienv and empty entries. Then
+compares it with its normalized form (mpienv.envpath.normalize):
+
+* the number of files the loader tries, with LD_DEBUG=libs,
+* the time to spawn a dynamically linked program N times.
+
+Usage: python benchmarks/bench_envpath.py [--runs N] [--repeat K]
+                                          [--program PATH]
+"""
+
+import argparse
+import os
+import os.path
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+ProjDir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ProjDir)
+
+from mpienv import envpath  # NOQA
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def messy_paths(tmpdir, repeat):
+    """A search path with `repeat` rounds of clutter."""
+    vers = os.path.join(tmpdir, 'versions')
+    other = os.path.join(tmpdir, 'other')
+    for d in [vers, other]:
+        os.makedirs(os.path.join(d, 'mpi'))
+        os.makedirs(os.path.join(d, 'shims', 'lib'))
+    paths = []
+    for i in range(repeat):
+        paths += [
+            os.path.join(vers, 'shims', 'lib'),
+            os.path.join(vers, 'shims', 'lib64'),  # missing
+            os.path.join(other, 'shims', 'lib'),
+            os.path.join(tmpdir, 'gone-{}'.format(i), 'lib'),
+            '',
+        ]
+    return vers, paths
+
+
+def tried_files(program, llp):
+    """Number of files the loader tries to open for `program`."""
+    env = dict(os.environ, LD_LIBRARY_PATH=llp, LD_DEBUG='libs')
+    p = subprocess.Popen([program], env=env, stdout=subprocess.PIPE,
+                         stderr=subprocess.PIPE)
+    _, err = p.communicate()
+    return err.decode('utf-8', 'replace').count('trying file=')
+
+
+def spawn_msec(program, llp, runs):
+    env = dict(os.environ, LD_LIBRARY_PATH=llp)
+    with open(os.devnull, 'w') as devnull:
+        subprocess.check_call([program], env=env, stdout=devnull)
+        start = _clock()
+        for _ in range(runs):
+            subprocess.check_call([program], env=env, stdout=devnull)
+    return (_clock() - start) * 1000.0 / runs
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--runs', type=int, default=200,
+                        help='Number of spawns timed')
+    parser.add_argument('--repeat', type=int, default=10,
+                        help='Rounds of clutter in LD_LIBRARY_PATH')
+    parser.add_argument('--program', default='/bin/true',
+                        help='Dynamically linked program spawned')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        vers, paths = messy_paths(tmpdir, args.repeat)
+        cases = [
+            ('raw', ':'.join(paths)),
+            ('normalized', envpath.join(envpath.normalize(paths, vers))),
+        ]
+        print("{:<15} {:>8} {:>8} {:>12}".format(
+            'LD_LIBRARY_PATH', 'entries', 'tried', 'spawn msec'))
+        for name, llp in cases:
+            print("{:<15} {:>8} {:>8} {:>12.3f}".format(
+                name, len(llp.split(':')), tried_files(args.program, llp),
+                spawn_msec(args.program, llp, args.runs)))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
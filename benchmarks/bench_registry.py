@@ -0,0 +1,150 @@
+# coding: utf-8
+"""Stress benchmark of concurrent registry mutations.
+
+Runs hundreds of local processes against a single versions directory:
+
+* renamers keep renaming their own entry (`r<i>-<k>` -> `r<i>-<k+1>`),
+* churners add and remove entries,
+* switchers replace the shims directory (like `mpienv use`),
+* readers take lock-free snapshots and check that every renamer's entry
+  is seen exactly once and that the shims are always complete.
+
+Usage: python benchmarks/bench_registry.py [--procs N] [--ops N]
+"""
+
+import argparse
+import multiprocessing
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from mpienv.registry import Registry  # NOQA
+
+
+def _renamer(vers_dir, target, i, ops, q):
+    reg = Registry(vers_dir)
+    for k in range(ops):
+        reg.rename('r{}-{}'.format(i, k), 'r{}-{}'.format(i, k + 1))
+    q.put(('ops', ops, []))
+
+
+def _churner(vers_dir, target, i, ops, q):
+    reg = Registry(vers_dir)
+    for k in range(ops):
+        name = 'c{}-{}'.format(i, k)
+        reg.link(name, target)
+        if k % 2 == 0:
+            reg.remove(name)
+    q.put(('ops', ops + (ops + 1) // 2, []))
+
+
+def _switcher(vers_dir, target, i, ops, q):
+    reg = Registry(vers_dir)
+
+    def build(path):
+        os.mkdir(os.path.join(path, 'bin'))
+        os.symlink(os.path.join(target, 'bin', 'mpiexec'),
+                   os.path.join(path, 'bin', 'mpiexec'))
+        # Written last: a shims directory without it is incomplete
+        open(os.path.join(path, 'complete'), 'w').close()
+
+    for k in range(ops):
+        reg.replace_shims(build)
+    q.put(('ops', ops, []))
+
+
+def _reader(vers_dir, n_renamers, ops, q):
+    reg = Registry(vers_dir)
+    errors = []
+    shims = os.path.join(vers_dir, 'shims')
+    for _ in range(ops):
+        snap = reg.snapshot()
+        for i in range(n_renamers):
+            seen = [n for n in snap if n.startswith('r{}-'.format(i))]
+            if len(seen) != 1:
+                errors.append("renamer {}: saw {}".format(i, seen))
+        if (os.path.lexists(shims) and
+                not os.path.exists(os.path.join(shims, 'complete'))):
+            errors.append("incomplete shims")
+    q.put(('reads', ops, errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--procs', type=int, default=200,
+                        help='Total number of processes')
+    parser.add_argument('--ops', type=int, default=20,
+                        help='Operations per process')
+    parser.add_argument('--root', default=None,
+                        help='Directory to run in (default: a temporary '
+                        'directory; use a shared filesystem to test it)')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp(dir=args.root)
+    try:
+        vers_dir = os.path.join(tmpdir, 'versions')
+        target = os.path.join(tmpdir, 'mpich')
+        os.makedirs(os.path.join(target, 'bin'))
+        open(os.path.join(target, 'bin', 'mpiexec'), 'w').close()
+
+        n = max(args.procs // 4, 1)
+        reg = Registry(vers_dir)
+        for i in range(n):
+            reg.link('r{}-0'.format(i), target)
+
+        q = multiprocessing.Queue()
+        procs = []
+        for i in range(n):
+            procs.append(multiprocessing.Process(
+                target=_renamer, args=(vers_dir, target, i, args.ops, q)))
+            procs.append(multiprocessing.Process(
+                target=_churner, args=(vers_dir, target, i, args.ops, q)))
+            procs.append(multiprocessing.Process(
+                target=_reader, args=(vers_dir, n, args.ops, q)))
+        for i in range(max(args.procs - 3 * n, 1)):
+            procs.append(multiprocessing.Process(
+                target=_switcher, args=(vers_dir, target, i, args.ops, q)))
+
+        start = time.time()
+        for p in procs:
+            p.start()
+        results = [q.get() for _ in procs]
+        for p in procs:
+            p.join()
+        elapsed = time.time() - start
+
+        writes = sum(r[1] for r in results if r[0] == 'ops')
+        reads = sum(r[1] for r in results if r[0] == 'reads')
+        errors = [e for r in results for e in r[2]]
+
+        expected = set('r{}-{}'.format(i, args.ops) for i in range(n))
+        expected |= set('c{}-{}'.format(i, k)
+                        for i in range(n) for k in range(args.ops) if k % 2)
+        final = set(reg.snapshot())
+        if final != expected:
+            errors.append("final registry differs: missing={}, extra={}"
+                          .format(sorted(expected - final),
+                                  sorted(final - expected)))
+        if any(p.exitcode != 0 for p in procs):
+            errors.append("some processes failed")
+
+        print("processes:   {}".format(len(procs)))
+        print("elapsed:     {:.2f} sec".format(elapsed))
+        print("mutations:   {} ({:.1f} /sec)".format(
+            writes, writes / elapsed))
+        print("snapshots:   {} ({:.1f} /sec)".format(reads, reads / elapsed))
+        print("errors:      {}".format(len(errors)))
+        for e in errors[:20]:
+            print("  " + e)
+        return 1 if errors else 0
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# coding: utf-8
+"""Startup time benchmark of mpienv commands.
+
+Measures the wall-clock time of `mpienv list` against an empty registry
+and of `mpienv prefix NAME`, and fails if the median exceeds the budget.
+
+Usage: python benchmarks/bench_startup.py [--budget MSEC] [--runs N]
+"""
+
+import argparse
+import os
+import os.path
+import shutil
+from subprocess import check_call
+import sys
+import tempfile
+import time
+
+ProjDir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def _median_msec(cmd, env, runs):
+    with open(os.devnull, 'w') as devnull:
+        # Warm up the OS caches and write the byte code. A single cold
+        # run is not enough: the first few runs are much slower.
+        for _ in range(3):
+            check_call(cmd, env=env, stdout=devnull)
+        times = []
+        for _ in range(runs):
+            start = time.time()
+            check_call(cmd, env=env, stdout=devnull)
+            times.append((time.time() - start) * 1000.0)
+    times.sort()
+    return times[len(times) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--budget', type=float, default=50.0,
+                        help='Budget of the median time in msec')
+    parser.add_argument('--runs', type=int, default=20)
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    try:
+        env = os.environ.copy()
+        env['MPIENV_ROOT'] = os.path.join(tmpdir, 'root')
+        env['MPIENV_VERSIONS_DIR'] = os.path.join(tmpdir, 'empty')
+        env['PYTHONPATH'] = ProjDir
+
+        bin_dir = os.path.join(ProjDir, 'bin')
+        results = {}
+        results['list (empty)'] = _median_msec(
+            [sys.executable, os.path.join(bin_dir, 'list.py')],
+            env, args.runs)
+
+        # A registry with one installation for `prefix`
+        vers_dir = os.path.join(tmpdir, 'versions')
+        prefix = os.path.join(tmpdir, 'mpich-3.2')
+        os.makedirs(os.path.join(prefix, 'bin'))
+        os.makedirs(os.path.join(vers_dir, 'mpi'))
+        os.symlink(prefix, os.path.join(vers_dir, 'mpi', 'mpich-3.2'))
+        env['MPIENV_VERSIONS_DIR'] = vers_dir
+        results['prefix NAME'] = _median_msec(
+            [sys.executable, os.path.join(bin_dir, 'prefix.py'),
+             'mpich-3.2'],
+            env, args.runs)
+
+        env['PYTHONPATH'] = ''
+        results['(python itself)'] = _median_msec(
+            [sys.executable, '-c', 'pass'], env, args.runs)
+    finally:
+        shutil.rmtree(tmpdir)
+
+    over = False
+    for name in ['list (empty)', 'prefix NAME', '(python itself)']:
+        msec = results[name]
+        mark = ''
+        if not name.startswith('(') and msec > args.budget:
+            mark = '  *** over budget ({} msec) ***'.format(args.budget)
+            over = True
+        print("{:<16} {:8.1f} msec{}".format(name, msec, mark))
+
+    return 1 if over else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
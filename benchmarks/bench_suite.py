@@ -0,0 +1,267 @@
+# coding: utf-8
+"""Micro-benchmarks of mpienv's hot paths.
+
+* Manager construction and loading of 1, 10 and 100 registered
+  installations, with and without the records in registry.json,
+* parse_ompi_info on a small and a very large ompi_info output, and
+  loading the parsed result from the cache,
+* autodiscover over synthetic directory trees,
+* switching between two installations with `use`.
+
+Installations are stub prefixes made by tests/fakempi.py, so no MPI
+is needed. Results are saved as JSON with --output, and
+compared with a previous run with --compare.
+
+Usage: python benchmarks/bench_suite.py [--runs N] [--filter STR]
+                                        [--output FILE]
+                                        [--compare FILE [--threshold PCT]]
+"""
+
+import argparse
+import json
+import os
+import os.path
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+ProjDir = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, ProjDir)
+sys.path.insert(0, os.path.join(ProjDir, 'bin'))
+sys.path.insert(0, os.path.join(ProjDir, 'tests'))
+
+from fakempi import make_openmpi  # NOQA
+from fakempi import ompi_info_output  # NOQA
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def measure(func, runs, setup=None):
+    times = []
+    for _ in range(runs):
+        if setup is not None:
+            setup()
+        start = _clock()
+        func()
+        times.append((_clock() - start) * 1000.0)
+    times.sort()
+    return {
+        'median_ms': times[len(times) // 2],
+        'min_ms': times[0],
+        'max_ms': times[-1],
+        'runs': runs,
+    }
+
+
+class Suite(object):
+    def __init__(self, tmpdir, runs):
+        self.tmpdir = tmpdir
+        self.runs = runs
+        self.benchmarks = []  # (name, function returning a result)
+
+        os.environ['MPIENV_ROOT'] = os.path.join(tmpdir, 'root')
+        os.environ['MPIENV_VERSIONS_DIR'] = os.path.join(tmpdir, 'versions')
+        os.environ['MPIENV_CACHE_DIR'] = os.path.join(tmpdir, 'cache')
+
+        for n in [1, 10, 100]:
+            self.add('manager/{}'.format(n), self.bench_manager, n, True)
+        for n in [1, 10]:
+            self.add('manager-cold/{}'.format(n), self.bench_manager, n,
+                     False)
+        for nparams in [100, 100000]:
+            self.add('parse_ompi_info/{}'.format(nparams),
+                     self.bench_parse_ompi_info, nparams)
+        self.add('ompi_info-cache/100000', self.bench_ompi_info_cache, 100000)
+        for ndirs in [100, 1000, 10000]:
+            self.add('autodiscover/{}'.format(ndirs),
+                     self.bench_autodiscover, ndirs)
+        self.add('use', self.bench_use)
+
+    def add(self, name, func, *args):
+        self.benchmarks.append((name, lambda: func(*args)))
+
+    def _registry(self, name, n):
+        """A versions directory with `n` stub installations."""
+        import common
+
+        root = os.path.join(self.tmpdir, name)
+        vers_dir = os.path.join(root, 'versions')
+        os.environ['MPIENV_VERSIONS_DIR'] = vers_dir
+        manager = common.Manager(root)
+        for i in range(n):
+            prefix = make_openmpi(os.path.join(root, 'mpi', str(i)))
+            manager._registry.link('ompi-{}'.format(i), prefix)
+        return root
+
+    def bench_manager(self, n, warm):
+        import common
+
+        root = self._registry('manager-{}-{}'.format(n, warm), n)
+        records = os.path.join(root, 'versions', 'registry.json')
+
+        def load():
+            manager = common.Manager(root)
+            assert len(manager.items()) == n
+
+        def drop_records():
+            if os.path.exists(records):
+                os.remove(records)
+
+        if warm:
+            load()
+            return measure(load, self.runs)
+        return measure(load, min(self.runs, 5), setup=drop_records)
+
+    def bench_parse_ompi_info(self, nparams):
+        from mpienv.ompi import parse_ompi_info
+
+        out = ompi_info_output('/opt/openmpi', '4.1.4', nparams)
+        runs = self.runs if nparams < 10000 else min(self.runs, 5)
+        return measure(lambda: parse_ompi_info(out), runs)
+
+    def bench_ompi_info_cache(self, nparams):
+        from mpienv.ompi import OmpiInfoCache
+        from mpienv.ompi import parse_ompi_info
+
+        prefix = os.path.join(self.tmpdir, 'ompi-cache')
+        make_openmpi(prefix, nparams=0)
+        bin = os.path.join(prefix, 'bin', 'ompi_info')
+        cache = OmpiInfoCache(os.path.join(self.tmpdir, 'cache', 'ompi_info'))
+        cache.save(bin, parse_ompi_info(ompi_info_output(prefix, '4.1.4',
+                                                         nparams)))
+        return measure(lambda: cache.load(bin), min(self.runs, 5))
+
+    def bench_autodiscover(self, ndirs):
+        import autodiscover
+        import common
+
+        # A tree of `ndirs` directories, with a few installations in it
+        root = os.path.join(self.tmpdir, 'tree-{}'.format(ndirs))
+        fanout = 10
+        dirs = [root]
+        i = 0
+        while len(dirs) < ndirs:
+            parent = dirs[i]
+            for k in range(fanout):
+                dirs.append(os.path.join(parent, 'd{}'.format(k)))
+            i += 1
+        for d in dirs[:ndirs]:
+            if not os.path.exists(d):
+                os.makedirs(d)
+        for k in range(3):
+            make_openmpi(os.path.join(dirs[(k + 1) * ndirs // 4], 'mpi'))
+
+        autodiscover.manager = common.Manager(os.path.join(self.tmpdir,
+                                                           'root'))
+
+        def run():
+            argv = sys.argv
+            sys.argv = ['autodiscover', '-q', root]
+            try:
+                autodiscover.main()
+            finally:
+                sys.argv = argv
+
+        # Probe results are cached in the process; start from scratch
+        return measure(run, min(self.runs, 5),
+                       setup=autodiscover.manager.refresh)
+
+    def bench_use(self):
+        import common
+
+        root = self._registry('use', 2)
+        manager = common.Manager(root)
+        names = sorted(manager.keys())
+        manager.use(names[0])
+
+        state = [0]
+
+        def switch():
+            state[0] = 1 - state[0]
+            manager.use(names[state[0]])
+
+        return measure(switch, self.runs)
+
+    def run(self, pattern=None):
+        results = {}
+        for name, func in self.benchmarks:
+            if pattern and pattern not in name:
+                continue
+            results[name] = func()
+            print("{:<26} {:10.2f} ms (min {:.2f}, max {:.2f}, "
+                  "{} runs)".format(name, results[name]['median_ms'],
+                                    results[name]['min_ms'],
+                                    results[name]['max_ms'],
+                                    results[name]['runs']))
+            sys.stdout.flush()
+        return results
+
+
+def _meta():
+    return {
+        'time': time.time(),
+        'host': platform.node(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+    }
+
+
+def compare(results, baseline, threshold):
+    """Print the change of the medians. Returns the regressed names."""
+    regressed = []
+    print("\n{:<26} {:>10} {:>10} {:>8}".format(
+        'benchmark', 'base(ms)', 'now(ms)', 'change'))
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['median_ms']
+        new = results[name]['median_ms']
+        change = (new - old) / old * 100.0 if old > 0 else 0.0
+        mark = ''
+        if change > threshold:
+            mark = '  *** regression ***'
+            regressed.append(name)
+        print("{:<26} {:10.2f} {:10.2f} {:+7.1f}%{}".format(
+            name, old, new, change, mark))
+    return regressed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--filter', dest='pattern', default=None,
+                        help='Run only benchmarks whose name contains this')
+    parser.add_argument('--output', default=None,
+                        help='Save the results to this JSON file')
+    parser.add_argument('--compare', default=None,
+                        help='Compare with the results in this JSON file')
+    parser.add_argument('--threshold', type=float, default=20.0,
+                        help='Slowdown in percent reported as a regression')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    saved_env = os.environ.copy()
+    try:
+        results = Suite(tmpdir, args.runs).run(args.pattern)
+    finally:
+        os.environ.clear()
+        os.environ.update(saved_env)
+        shutil.rmtree(tmpdir)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'meta': _meta(), 'results': results}, f, indent=1,
+                      sort_keys=True)
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
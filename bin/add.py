@@ -1,8 +1,13 @@
 # coding: utf-8
 
 import argparse
+import os
+import os.path
+from subprocess import Popen
+import sys
 
 from common import manager
+from mpienv.profile import command
 
 
 parser = argparse.ArgumentParser(
@@ -10,15 +15,68 @@ parser = argparse.ArgumentParser(
     description='Add a MPI environment already installed in your host.')
 parser.add_argument('-n', '--name', metavar='name', dest='name', type=str,
                     help='Name of an MPI installation')
-parser.add_argument('path', metavar='path', type=str,
-                    help='Path in which an MPI is intalled')
+parser.add_argument('-p', '--mpi4py', action="store_true",
+                    dest="mpi4py", default=False,
+                    help="Build mpi4py for the MPI in background")
+parser.add_argument('-j', type=int, default=8, dest='npar',
+                    help='Number of paths probed in parallel')
+parser.add_argument('--skip-existing', action="store_true", default=False,
+                    help='Skip paths already registered instead of failing')
+parser.add_argument('paths', metavar='path', type=str, nargs='*',
+                    help='Paths in which MPIs are intalled. '
+                    'Read from the standard input, one per line, if '
+                    '"-" or omitted when it is not a terminal')
+
+
+def _read_paths(f):
+    paths = []
+    for line in f:
+        line = line.strip()
+        if line and not line.startswith('#'):
+            paths.append(line)
+    return paths
+
+
+def _prebuild_in_background(name):
+    script = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          'prebuild.py')
+    with open(os.devnull, 'w') as devnull:
+        # Detach from the shell so that `mpienv add` returns immediately
+        cmd = [sys.executable, script, name]
+        with command(cmd):
+            Popen(cmd, stdin=devnull, stdout=devnull, stderr=devnull,
+                  close_fds=True, preexec_fn=os.setsid)
+    sys.stderr.write("Building mpi4py for '{}' in background\n".format(name))
 
 
 def main():
     args = parser.parse_args()
 
-    # Create a link
-    manager.add(args.path, args.name)
+    paths = args.paths
+    if paths == ['-'] or (paths == [] and not sys.stdin.isatty()):
+        paths = _read_paths(sys.stdin)
+    if paths == []:
+        parser.error("no path given (pass '-' to read them from stdin)")
+
+    if len(paths) == 1 and not args.skip_existing:
+        # Create a link
+        names = [manager.add(paths[0], args.name)]
+    else:
+        if args.name is not None:
+            parser.error("-n/--name can only be used with a single path, "
+                         "without --skip-existing")
+        try:
+            added = manager.add_many(paths, args.npar, args.skip_existing)
+        except RuntimeError as e:
+            sys.stderr.write("Error: {}\nNothing was added.\n".format(e))
+            exit(-1)
+        for prefix, name in added:
+            print("Added {} as {}".format(prefix, name))
+        names = [name for _, name in added]
+
+    if args.mpi4py:
+        for name in names:
+            _prebuild_in_background(name)
 
 
 if __name__ == "__main__":
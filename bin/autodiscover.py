@@ -7,6 +7,7 @@ import pprint
 import sys
 
 from common import manager
+from mpienv import discovery
 
 
 parser = argparse.ArgumentParser(
@@ -18,7 +19,16 @@ parser.add_argument('-v', '--verbose', dest='verbose',
                     action="store_true", default=None)
 parser.add_argument('-q', '--quiet', dest='quiet',
                     action="store_true", default=None)
-parser.add_argument('paths', nargs='*')
+parser.add_argument('--sources', default=None,
+                    help='Comma-separated package databases to look up '
+                    '(default: {}), or "none"'.format(
+                        ','.join(discovery.source_names)))
+parser.add_argument('--walk', action="store_true", default=False,
+                    help='Also walk the default search paths when MPIs '
+                    'are found in the package databases')
+parser.add_argument('paths', nargs='*',
+                    help='Directories to walk instead of looking up the '
+                    'package databases')
 
 
 default_search_paths = [
@@ -56,6 +66,7 @@ def filter_valid_paths(paths, warn=True):
 
 
 def investigate_path(path, to_add):
+    """Report (and add) the MPI in `path`. Returns True if one is there."""
     mpiexec = os.path.join(path, 'bin', 'mpiexec')
     if os.path.isfile(mpiexec):
         printv("checking {}".format(mpiexec))
@@ -80,8 +91,21 @@ def investigate_path(path, to_add):
                            "adding {}".format(path))
                     prints(e)
                     prints()
+        return True
     else:
         printv("No such file '{}'".format(mpiexec))
+        return False
+
+
+def _source_names(arg):
+    if arg is None:
+        return discovery.source_names
+    names = [n for n in arg.split(',') if n and n != 'none']
+    for n in names:
+        if n not in discovery.source_names:
+            sys.stderr.write("Error: unknown source '{}'\n".format(n))
+            exit(-1)
+    return names
 
 
 def main():
@@ -100,7 +124,21 @@ def main():
                          "specified at the same time.\n")
         exit(-1)
 
+    checked = set()
+
     if len(search_paths) == 0:
+        # Candidates from the package databases first. Walking the
+        # default search paths is the fallback.
+        found = False
+        for source, prefix in discovery.candidates(
+                _source_names(args.sources)):
+            printv("{}: {}".format(source, prefix))
+            if prefix not in checked:
+                found = investigate_path(prefix, to_add) or found
+                checked.add(prefix)
+        if found and not args.walk:
+            return
+
         search_paths = default_search_paths
         using_default = True
     else:
@@ -109,8 +147,6 @@ def main():
     search_paths = filter_valid_paths(search_paths,
                                       warn=(not using_default))
 
-    checked = set()
-
     for path in search_paths:
         for (dirpath, dirs, files) in os.walk(path):
             if dirpath in checked:
@@ -0,0 +1,60 @@
+# coding: utf-8
+
+import argparse
+import json
+import sys
+import time
+
+from common import manager
+from mpienv.installer import list_build_records
+from mpienv.installer import load_build_record
+
+parser = argparse.ArgumentParser(
+    prog='mpienv build-stats',
+    description='Show timing and resource usage of MPI builds.')
+parser.add_argument('--json', action="store_true", default=None)
+parser.add_argument('-a', '--all', dest='all', action="store_true",
+                    default=False,
+                    help='Show all recorded runs, not only the latest one')
+parser.add_argument('names', nargs='*', metavar='name',
+                    help='Name of an MPI installation')
+
+
+def _print_run(run):
+    print("  {} at {} ({:.1f} sec)".format(
+        run['command'],
+        time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(run['started'])),
+        run['seconds']))
+    print("    {:<10} {:>10} {:>12} {:>12}".format(
+        'phase', 'seconds', 'peak RSS', 'output'))
+    for ph in run['phases']:
+        if ph.get('skipped'):
+            print("    {:<10} {:>10}".format(ph['phase'], 'skipped'))
+            continue
+        print("    {:<10} {:>10.1f} {:>9.1f} MB {:>9.1f} KB".format(
+            ph['phase'], ph['seconds'],
+            ph['max_rss_kb'] / 1024.0, ph['output_bytes'] / 1024.0))
+
+
+if __name__ == '__main__':
+    args = parser.parse_args()
+
+    names = args.names or list_build_records(manager)
+    records = {}
+    for name in names:
+        rec = load_build_record(manager, name)
+        if rec is None:
+            sys.stderr.write("Error: no build record for '{}'\n".format(name))
+            exit(-1)
+        records[name] = rec
+
+    if args.json:
+        json.dump(records, sys.stdout)
+    else:
+        for name in sorted(records):
+            rec = records[name]
+            print("{} ({})".format(name, rec['mpi']))
+            runs = rec['runs'] if args.all else rec['runs'][-1:]
+            for run in runs:
+                _print_run(run)
+            print("")
@@ -0,0 +1,160 @@
+# coding: utf-8
+
+import argparse
+import glob
+from multiprocessing.pool import ThreadPool
+import os
+import os.path
+import sys
+
+from common import is_broken_symlink
+from common import manager
+from mpienv import elf
+
+parser = argparse.ArgumentParser(
+    prog='mpienv doctor',
+    description='Check shared library dependencies of MPI installations.')
+parser.add_argument('--json', action="store_true", default=False,
+                    help='Print the results in JSON')
+parser.add_argument('--ignore-env', action="store_true", default=False,
+                    help='Ignore LD_LIBRARY_PATH of the current shell')
+parser.add_argument('-j', type=int, default=8, dest='npar',
+                    help='Number of installations checked in parallel')
+parser.add_argument('names', nargs='*', metavar='name',
+                    help='MPI names (default: all the registered MPIs)')
+
+_commands = ['mpiexec', 'mpirun', 'mpicc', 'mpicxx', 'mpic++', 'mpifort',
+             'mpif90', 'mpif77']
+
+
+def _targets(prefix):
+    """ELF files of an installation to check: commands and libmpi."""
+    paths = [os.path.join(prefix, 'bin', c) for c in _commands]
+    for libdir in ['lib', 'lib64']:
+        paths += sorted(glob.glob(os.path.join(prefix, libdir,
+                                               'libmpi*.so*')))
+
+    targets = []
+    for path in paths:
+        real = os.path.realpath(path)
+        # Compiler wrappers of MPICH are shell scripts
+        if real not in targets and elf.read_elf(real) is not None:
+            targets.append(real)
+    return targets
+
+
+def _own_libraries(prefix):
+    libs = {}
+    for libdir in ['lib', 'lib64']:
+        for path in glob.glob(os.path.join(prefix, libdir, '*.so*')):
+            libs[os.path.basename(path)] = os.path.realpath(path)
+    return libs
+
+
+def _ld_library_path(ignore_env):
+    if ignore_env:
+        return []
+    # The shims point to the MPI currently in use, not the one checked
+    shims = os.path.realpath(manager.shims_dir())
+    return [d for d in os.environ.get('LD_LIBRARY_PATH', '').split(':')
+            if d and not os.path.realpath(d).startswith(shims)]
+
+
+def check_installation(name, ld_library_path):
+    prefix = manager.prefix(name)
+    result = {
+        'name': name,
+        'prefix': os.path.realpath(prefix),
+        'checked': [],
+        'missing': [],
+        'conflicts': [],
+    }
+
+    if is_broken_symlink(prefix):
+        result['missing'].append((prefix, None))
+        return result
+
+    own = _own_libraries(prefix)
+    for target in _targets(prefix):
+        try:
+            deps = elf.check(target, ld_library_path)
+        except elf.ELFError as e:
+            result['missing'].append((str(e), target))
+            continue
+        result['checked'].append(target)
+        for m in deps['missing']:
+            if m not in result['missing']:
+                result['missing'].append(m)
+        for c in deps['conflicts']:
+            if c not in result['conflicts']:
+                result['conflicts'].append(c)
+
+        # A library of the installation that the loader would take
+        # from somewhere else
+        for lib, path in sorted(deps['libraries'].items()):
+            if lib in own and os.path.realpath(path) != own[lib]:
+                c = (lib, path, target, own[lib])
+                if c not in result['conflicts']:
+                    result['conflicts'].append(c)
+
+    return result
+
+
+def _print_result(r):
+    if not os.path.exists(r['prefix']):
+        print("{}: broken ({} does not exist)".format(r['name'],
+                                                      r['prefix']))
+        return
+
+    nprob = len(r['missing']) + len(r['conflicts'])
+    if nprob == 0:
+        print("{}: OK ({} files checked)".format(r['name'],
+                                                 len(r['checked'])))
+        return
+
+    print("{}: {} problem(s)".format(r['name'], nprob))
+    for lib, needed_by in r['missing']:
+        print("  missing: {} (needed by {})".format(lib, needed_by))
+    for lib, loaded, wanted_by, wanted in r['conflicts']:
+        if wanted_by is None:
+            print("  conflict: {} and {} are both loaded".format(
+                loaded, wanted))
+        else:
+            print("  conflict: {} is loaded from {}, but {} "
+                  "wants {}".format(lib, loaded, wanted_by, wanted))
+
+
+def main():
+    args = parser.parse_args()
+
+    names = args.names or sorted(manager.keys())
+    for name in names:
+        if name not in manager:
+            sys.stderr.write("Error: unknown MPI: '{}'\n".format(name))
+            exit(-1)
+
+    ld_library_path = _ld_library_path(args.ignore_env)
+
+    # Nothing is executed: installations are checked by reading files
+    pool = ThreadPool(max(1, args.npar))
+    try:
+        results = pool.map(lambda n: check_installation(n, ld_library_path),
+                           names)
+    finally:
+        pool.close()
+        pool.join()
+
+    if args.json:
+        import json
+        json.dump({r['name']: r for r in results}, sys.stdout, indent=2)
+        print("")
+    else:
+        for r in results:
+            _print_result(r)
+
+    if any(r['missing'] or r['conflicts'] for r in results):
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,7 @@
 # coding: utf-8
 
 import argparse
-import json
+import os.path
 import sys
 
 from common import manager
@@ -9,11 +9,23 @@ from common import manager
 parser = argparse.ArgumentParser(
     prog='mpienv list', description='List all available MPI environments.')
 parser.add_argument('--json', action="store_true",
-                    default=None)
+                    default=None,
+                    help='Print full information of the MPIs in JSON')
+parser.add_argument('-l', '--long', action="store_true", default=False,
+                    help='Show the type and the version of the MPIs')
+parser.add_argument('-j', type=int, default=8, dest='npar',
+                    help='Number of MPIs probed in parallel '
+                    '(with --long or --json)')
 
 
 def _print_info(info, max_label_len):
-    if info.get('broken'):
+    if info.get('quarantined'):
+        print(" {} {:<{width}} -> {} *** quarantined ***".format(
+            "*" if info.get('active') else " ",
+            info['name'],
+            info['prefix'],
+            width=max_label_len))
+    elif info.get('broken'):
         print("   {:<{width}} -> *** broken ***".format(
             info['name'],
             width=max_label_len
@@ -26,21 +38,69 @@ def _print_info(info, max_label_len):
             width=max_label_len))
 
 
-if __name__ == '__main__':
-    args = parser.parse_args()
+def _print_long(info, max_label_len):
+    if info.get('quarantined'):
+        # The error of the last probe, and when it is probed again
+        import time
+        print("   {:<{width}} {:<19} {}\n   {:<{width}} ({}, retried "
+              "after {})".format(
+                  info['name'], '*** quarantined ***', info['prefix'],
+                  '', info['error'],
+                  time.strftime('%Y-%m-%d %H:%M',
+                                time.localtime(info['retry_at'])),
+                  width=max_label_len))
+        return
+    if info.get('broken'):
+        _print_info(info, max_label_len)
+        return
+    print(" {} {:<{width}} {:<9} {:<9} {}".format(
+        "*" if info['active'] else " ",
+        info['name'],
+        info['type'],
+        info['version'],
+        info['prefix'],
+        width=max_label_len))
 
-    if len(manager.keys()) == 0:
-        exit(0)
 
-    max_label_len = max(len(name) for name in manager.keys())
+def main():
+    args = parser.parse_args()
 
-    lst = [info for name, info in manager.items()]
-    lst.sort(key=lambda x: x['name'])
     if args.json:
-        lst = {name: info for name, info in manager.items()}
+        import json
+        lst = {name: info for name, info in manager.items(args.npar)}
         json.dump(lst, sys.stdout)
+        return
+
+    # Only the registry and PATH are looked at, unless --long is given
+    prefixes = manager.registered()
+    if len(prefixes) == 0:
+        return
+
+    names = sorted(prefixes)
+    max_label_len = max(len(name) for name in names)
+    if args.long:
+        infos = dict(manager.items(args.npar))
+        printer = _print_long
     else:
-        print("\nInstalled MPIs:\n")
-        for info in lst:
-            _print_info(info, max_label_len)
-        print("")
+        active = manager.active_name()
+        quarantined = manager.quarantined()
+        printer = _print_info
+
+    print("\nInstalled MPIs:\n")
+    for name in names:
+        if args.long:
+            info = infos[name]
+        else:
+            info = {
+                'name': name,
+                'prefix': prefixes[name],
+                'active': name == active,
+                'broken': not os.path.exists(prefixes[name]),
+                'quarantined': name in quarantined,
+            }
+        printer(info, max_label_len)
+    print("")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,115 @@
+# coding: utf-8
+
+import argparse
+from fnmatch import fnmatchcase
+from multiprocessing.pool import ThreadPool
+import sys
+
+from common import manager
+
+parser = argparse.ArgumentParser(
+    prog='mpienv mca',
+    description='Show MCA parameters and components of Open MPI.')
+parser.add_argument('-a', '--all', action="store_true", default=False,
+                    help='Look at all the registered Open MPIs')
+parser.add_argument('-c', '--components', action="store_true",
+                    default=False,
+                    help='List the components of the frameworks '
+                    'matching PATTERN (e.g. "btl") instead')
+parser.add_argument('--json', action="store_true", default=False,
+                    help='Print the results in JSON')
+parser.add_argument('-j', type=int, default=8, dest='npar',
+                    help='Number of installations loaded in parallel')
+parser.add_argument('name', nargs='?', default=None,
+                    help='MPI name (omitted with --all)')
+parser.add_argument('pattern', nargs='?', default=None,
+                    help='Glob matched against parameter names '
+                    '(e.g. "btl_tcp_*", default: all)')
+
+
+def _targets(args):
+    if args.all:
+        if args.pattern is None:
+            args.pattern = args.name
+        names = []
+        for name in sorted(manager.keys()):
+            info = manager.get_info(name)
+            if not info.get('broken') and info.get('type') == 'Open MPI':
+                names.append(name)
+        return names
+
+    if args.name is None:
+        parser.error("Specify an MPI name or --all")
+    if args.name not in manager:
+        sys.stderr.write("Error: unknown MPI: '{}'\n".format(args.name))
+        exit(-1)
+    info = manager.get_info(args.name)
+    if info.get('broken') or info.get('type') != 'Open MPI':
+        sys.stderr.write("Error: '{}' is not Open MPI\n".format(args.name))
+        exit(-1)
+    return [args.name]
+
+
+def _format_value(val):
+    if val is True or val is False:
+        return str(val).lower()
+    if val is None:
+        return ''
+    return str(val)
+
+
+def _query(name, args):
+    ompi = manager.ompi_info(name)
+    if args.components:
+        return {fw: ompi.components(fw) for fw in ompi.frameworks()
+                if fnmatchcase(fw, args.pattern) and ompi.components(fw)}
+    return ompi.mca_params(args.pattern)
+
+
+def _print_params(name, params):
+    print("{}:".format(name))
+    width = max([len(p['name']) for p in params] + [0])
+    for p in params:
+        print("  {:<{width}} = {}  ({}/{}{})".format(
+            p['name'], _format_value(p.get('value')),
+            p['framework'], p['component'],
+            ', ' + p['source'] if p.get('source') else '',
+            width=width))
+
+
+def _print_components(name, frameworks):
+    print("{}:".format(name))
+    width = max([len(fw) for fw in frameworks] + [0])
+    for fw in sorted(frameworks):
+        print("  {:<{width}}  {}".format(fw, ' '.join(frameworks[fw]),
+                                         width=width))
+
+
+def main():
+    args = parser.parse_args()
+    names = _targets(args)
+    args.pattern = args.pattern or '*'
+
+    # ompi_info is run only for installations not in the cache yet
+    pool = ThreadPool(max(1, min(args.npar, len(names) or 1)))
+    try:
+        results = pool.map(lambda n: _query(n, args), names)
+    finally:
+        pool.close()
+        pool.join()
+
+    if args.json:
+        import json
+        json.dump(dict(zip(names, results)), sys.stdout, indent=2)
+        print("")
+        return
+
+    for name, result in zip(names, results):
+        if args.components:
+            _print_components(name, result)
+        else:
+            _print_params(name, result)
+
+
+if __name__ == '__main__':
+    main()
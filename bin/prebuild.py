@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import argparse
+from multiprocessing.pool import ThreadPool
+import os
+import os.path
+import sys
+import time
+import traceback
+
+from common import manager
+from common import mkdir_p
+from common import UnknownMPI
+from mpienv.py import MPI4Py
+
+parser = argparse.ArgumentParser(
+    prog='mpienv prebuild',
+    description='Build mpi4py for MPI installations in parallel.')
+parser.add_argument('-a', '--all', dest='all', action="store_true",
+                    default=False,
+                    help='Build for all the registered MPIs')
+parser.add_argument('-j', type=int, default=4, dest='npar',
+                    help='Number of parallel builds')
+parser.add_argument('names', nargs='*', metavar='name',
+                    help='MPI names (default: the current MPI)')
+
+
+def _log_dir():
+    return os.path.join(manager.cache_dir(), 'logs')
+
+
+def _log_path(name):
+    return os.path.join(_log_dir(), 'mpi4py-{}.log'.format(name))
+
+
+def _groups(names):
+    """Group the MPIs that share a wheel build, in the order of `names`.
+
+    Installations with the same fingerprint share one wheel directory.
+    An MPI whose wheel directory cannot be determined (e.g. it cannot be
+    probed) gets a group of its own, where its build fails.
+    """
+    groups = {}
+    order = []
+    for name in names:
+        try:
+            key = MPI4Py(manager, name).wheel_dir()
+        except Exception:
+            key = (None, name)
+        if key not in groups:
+            groups[key] = []
+            order.append(key)
+        groups[key].append(name)
+    return [groups[key] for key in order]
+
+
+def _build_group(names):
+    """Build mpi4py for MPIs sharing a wheel, and install it for each.
+
+    Returns [(name, status, seconds, log path)]. Any error is written to
+    the log of the MPI, and does not stop the other builds.
+    """
+    results = []
+    for name in names:
+        start = time.time()
+        log_path = _log_path(name)
+        with open(log_path, 'w') as log:
+            try:
+                MPI4Py(manager, name).install(log=log)
+                status = 'ok'
+            except Exception:
+                log.write("\n{}".format(traceback.format_exc()))
+                status = 'failed'
+        results.append((name, status, time.time() - start, log_path))
+    return results
+
+
+def _prebuild(args):
+    if args.all:
+        names = sorted(manager.keys())
+    elif args.names:
+        names = args.names
+    else:
+        try:
+            names = [manager.get_current_name()]
+        except UnknownMPI:
+            sys.stderr.write("Error: the current MPI is not under control\n")
+            exit(-1)
+
+    todo = []
+    for name in names:
+        if name not in manager:
+            sys.stderr.write("Error: unknown MPI: '{}'\n".format(name))
+            exit(-1)
+        if manager[name].get('broken'):
+            sys.stderr.write("Skipping broken MPI '{}'\n".format(name))
+            continue
+        if MPI4Py(manager, name).is_installed():
+            print("{}: mpi4py is already installed".format(name))
+            continue
+        todo.append(name)
+
+    # The groups are built in parallel, so the directory is made first
+    mkdir_p(_log_dir())
+    failed = False
+    pool = ThreadPool(max(1, args.npar))
+    try:
+        for results in pool.imap_unordered(_build_group, _groups(todo)):
+            for name, status, sec, log_path in results:
+                print("{}: {} ({:.1f} sec, log: {})".format(
+                    name, status, sec, log_path))
+                failed = failed or status != 'ok'
+    finally:
+        pool.close()
+        pool.join()
+
+    if failed:
+        exit(-1)
+
+
+def main():
+    args = parser.parse_args()
+    _prebuild(args)
+
+
+if __name__ == "__main__":
+    main()
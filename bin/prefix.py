@@ -1,6 +1,7 @@
 # coding: utf-8
 
 import argparse
+import os.path
 import sys
 
 from common import manager
@@ -16,7 +17,8 @@ if __name__ == "__main__":
     name = args.name or manager.get_current_name()
 
     if name in manager:
-        sys.stdout.write(manager[name]['prefix'])
+        # The prefix is resolved from the registry without probing
+        sys.stdout.write(os.path.realpath(manager.prefix(name)))
         if sys.stdout.isatty():
             sys.stdout.write("\n")
 
@@ -0,0 +1,50 @@
+# coding: utf-8
+
+import argparse
+import sys
+
+from common import manager
+from mpienv.stage import modes
+from mpienv.stage import stage
+from mpienv.stage import StageError
+
+parser = argparse.ArgumentParser(
+    prog='mpienv stage',
+    description='Copy an MPI installation to node-local storage.')
+parser.add_argument('--to', metavar='dir', dest='to', type=str,
+                    default=None,
+                    help='Node-local directory (default: $MPIENV_STAGE_DIR)')
+parser.add_argument('-m', '--mode', dest='mode', choices=modes,
+                    default='copy',
+                    help='How files are staged (default: copy)')
+parser.add_argument('name', type=str, nargs='?', default=None,
+                    help='MPI name (default: the current MPI)')
+
+
+def main():
+    args = parser.parse_args()
+
+    stage_dir = args.to or manager.stage_dir()
+    if stage_dir is None:
+        sys.stderr.write("Error: specify --to or set MPIENV_STAGE_DIR\n")
+        exit(-1)
+
+    name = args.name or manager.get_current_name()
+    if name not in manager:
+        sys.stderr.write("Error: unknown MPI: '{}'\n".format(name))
+        exit(-1)
+
+    info = manager[name]
+    if info.get('broken'):
+        sys.stderr.write("Error: '{}' is broken\n".format(name))
+        exit(-1)
+
+    try:
+        print(stage(stage_dir, name, info, mode=args.mode))
+    except StageError as e:
+        sys.stderr.write("Error: {}\n".format(e))
+        exit(-1)
+
+
+if __name__ == "__main__":
+    main()
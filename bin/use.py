@@ -1,9 +1,15 @@
 # coding: utf-8
 
 import argparse
+import os
 
 from common import manager
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
 parser = argparse.ArgumentParser(
     prog='mpienv use', description='Set the specific MPI environment.')
 parser.add_argument('-p', '--mpi4py', action="store_true",
@@ -18,6 +24,15 @@ def main():
     args = parser.parse_args()
     manager.use(args.name, mpi4py=args.mpi4py)
 
+    # Evaluated by the shell function in `init`. The search paths are
+    # the ones of the shell, which wrappers of `python` may have changed.
+    environ = dict(os.environ)
+    for var in ['PATH', 'LD_LIBRARY_PATH']:
+        if 'MPIENV_SHELL_' + var in environ:
+            environ[var] = environ.pop('MPIENV_SHELL_' + var)
+    for var, value in sorted(manager.shell_paths(environ).items()):
+        print("export {}={}".format(var, quote(value)))
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,76 @@
+# coding: utf-8
+
+import argparse
+import os
+import sys
+
+from common import manager
+from common import UnknownMPI
+from mpienv import hosts
+
+parser = argparse.ArgumentParser(
+    prog='mpienv verify-hosts',
+    description='Check that the hosts have the same MPI installation.')
+parser.add_argument('-n', '--name', default=None,
+                    help='MPI name (default: the active one)')
+parser.add_argument('-k', '--fanout', type=int, default=8,
+                    help='Number of hosts each host contacts in parallel')
+parser.add_argument('--transport', choices=sorted(hosts.transports),
+                    default='ssh',
+                    help='How to reach the hosts ("local" runs the checks '
+                    'on this machine)')
+parser.add_argument('--ssh', default=os.environ.get('MPIENV_SSH', 'ssh'),
+                    help='ssh command (default: $MPIENV_SSH or ssh)')
+parser.add_argument('--timeout', type=float, default=60,
+                    help='Seconds to wait for all the hosts')
+parser.add_argument('--json', action="store_true", default=False,
+                    help='Print the problems of each host in JSON')
+parser.add_argument('hostfile',
+                    help='Hostfile of the job (Open MPI or MPICH format)')
+
+
+def main():
+    args = parser.parse_args()
+
+    if args.name is None:
+        try:
+            args.name = manager.get_current_name()
+        except UnknownMPI:
+            sys.stderr.write("Error: the current MPI is not under control\n")
+            exit(-1)
+    if args.name not in manager:
+        sys.stderr.write("Error: unknown MPI: '{}'\n".format(args.name))
+        exit(-1)
+    info = manager.get_info(args.name)
+    if info.get('broken'):
+        sys.stderr.write("Error: '{}' is broken\n".format(args.name))
+        exit(-1)
+
+    if args.transport == 'ssh':
+        transport = hosts.SSHTransport(args.ssh)
+    else:
+        transport = hosts.transports[args.transport]()
+
+    # The installation that `mpienv exec` would launch on the hosts
+    prefix, _ = manager.launch_prefix(args.name, info)
+    host_list = hosts.read_hostfile(args.hostfile)
+    report = hosts.check_hosts(host_list, prefix, transport, args.fanout,
+                               args.timeout)
+    bad = [h for h in host_list if report[h]]
+
+    if args.json:
+        import json
+        json.dump(report, sys.stdout, indent=2, sort_keys=True)
+        print("")
+    else:
+        for host in bad:
+            for problem in report[host]:
+                print("{}: {}".format(host, problem))
+        print("{}: {} of {} host(s) OK ({})".format(
+            args.name, len(host_list) - len(bad), len(host_list), prefix))
+    if bad:
+        exit(1)
+
+
+if __name__ == '__main__':
+    main()
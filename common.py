@@ -1,25 +1,18 @@
 # coding: utf-8
 
-import distutils.spawn
-import glob
-import json
+# This module is imported by every mpienv command, so it only imports
+# what is needed to start up. Modules used by a few commands (subprocess,
+# glob, json, ...) are imported in the functions that use them.
+
+import os
 import os.path
 import re
-import shutil
-from subprocess import call
-from subprocess import check_output
-from subprocess import PIPE
-from subprocess import Popen
 import sys
 
-from mpienv.ompi import parse_ompi_info
-from mpienv.py import MPI4Py
-
-try:
-    from subprocess import DEVNULL  # py3k
-except ImportError:
-    import os
-    DEVNULL = open(os.devnull, 'wb')
+from mpienv.debug import count
+from mpienv.profile import command
+from mpienv.profile import span
+from mpienv.registry import Registry
 
 try:
     import __builtin__
@@ -31,6 +24,14 @@ class UnknownMPI(RuntimeError):
     pass
 
 
+class ProbeError(RuntimeError):
+    pass
+
+
+class ProbeTimeout(ProbeError):
+    pass
+
+
 def yes_no_input(msg):
     if hasattr(__builtin__, 'raw_input'):
         input = __builtin__.raw_input
@@ -71,8 +72,25 @@ def encode(s):
         return s
 
 
+def _devnull():
+    try:
+        from subprocess import DEVNULL  # py3k
+        return DEVNULL
+    except ImportError:
+        return open(os.devnull, 'wb')
+
+
+def find_executable(cmd):
+    """Find `cmd` in PATH, like the `which` command."""
+    for d in os.environ.get('PATH', os.defpath).split(os.pathsep):
+        exe = os.path.join(d, cmd)
+        if os.path.isfile(exe) and os.access(exe, os.X_OK):
+            return exe
+    return None
+
+
 def which(cmd):
-    exe = distutils.spawn.find_executable(cmd)
+    exe = find_executable(cmd)
     if exe is None:
         return None
 
@@ -85,31 +103,112 @@ def is_broken_symlink(path):
 
 
 def filter_path(proj_root, paths):
-    vers = glob.glob(os.path.join(proj_root, 'versions', '*'))
+    """Normalize a list of search paths of mpienv in `proj_root`.
+
+    See mpienv.envpath.normalize().
+    """
+    from mpienv import envpath
+    vers_dir = os.environ.get("MPIENV_VERSIONS_DIR") or \
+        os.path.join(proj_root, 'versions')
+    return envpath.normalize(paths, vers_dir)
+
 
-    llp = []
+def probe_timeout():
+    """Seconds a probe command may run (MPIENV_PROBE_TIMEOUT, 0: forever)."""
+    try:
+        return float(os.environ.get("MPIENV_PROBE_TIMEOUT", 30))
+    except ValueError:
+        return 30.0
+
+
+def _probe_output(cmd, check=True):
+    """Run a probe command and return its (stdout, stderr).
+
+    The command is killed, with the processes it started, after
+    probe_timeout() seconds: a launcher waiting for a dead resource
+    manager must not hang mpienv.
+    """
+    from mpienv.proc import communicate
+
+    timeout = probe_timeout()
+    ret, out, err, expired = communicate(cmd, timeout, stdin=_devnull())
+    if expired:
+        raise ProbeTimeout("'{}' did not finish in {:g} seconds".format(
+            " ".join(cmd), timeout))
+    if check and ret != 0:
+        raise ProbeError("'{}' exited with {}".format(" ".join(cmd), ret))
+    return out, err
+
+
+def _probe_search(pattern, out, what):
+    """re.search() in the output of a probe, raising ProbeError if absent."""
+    m = re.search(pattern, out, re.MULTILINE)
+    if m is None:
+        raise ProbeError("cannot find {} in the output of the probe".format(
+            what))
+    return m
+
+
+def file_id(path):
+    """Identify a file by (device, inode), following symlinks."""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (st.st_dev, st.st_ino)
+
+
+# Files whose change invalidates the recorded probe result of a prefix
+_stamp_files = ['bin/mpiexec', 'bin/ompi_info', 'include/mpi.h']
+
+
+def probe_stamp(prefix):
+    """Cheap stat-based fingerprint of the files a probe depends on."""
+    stamp = [os.path.realpath(prefix)]
+    for f in _stamp_files:
+        try:
+            st = os.stat(os.path.join(prefix, f))
+        except OSError:
+            stamp.append(None)
+            continue
+        stamp.append([st.st_ino, st.st_size, st.st_mtime])
+    return stamp
 
-    for p in paths:
-        root = re.sub(r'/(bin|lib|lib64)/?$', '', p)
-        if root not in vers:
-            llp.append(p)
 
-    return llp
+# Errors of a probe that quarantine a registered installation
+# (ProbeTimeout is a ProbeError). Other errors are bugs and propagate.
+_probe_errors = (ProbeError, IOError, OSError)
 
+# Seconds before a quarantined installation is probed again. The delay
+# doubles after each failure, up to a day.
+quarantine_backoff = 60
+quarantine_backoff_max = 24 * 3600
 
-def is_active(prefix):
-    mpiexec1 = os.path.realpath(os.path.join(prefix, 'bin', 'mpiexec'))
-    mpiexec2 = which('mpiexec')
-    return mpiexec1 == mpiexec2
+
+def _quarantine(previous, error):
+    """Quarantine state after a failed probe, following `previous`."""
+    import time
+
+    failures = previous['failures'] + 1 if previous else 1
+    delay = min(quarantine_backoff * 2 ** (failures - 1),
+                quarantine_backoff_max)
+    return {
+        'failures': failures,
+        'error': str(error) or error.__class__.__name__,
+        'until': time.time() + delay,
+    }
 
 
 def _glob_list(dire, pat_list):
     """Glob all patterns `pat` in `directory`"""
+    import glob
+
     if type(dire) is list or type(dire) is tuple:
         dire = os.path.join(*dire)
 
     # list of lists
-    lol = [glob.glob(os.path.join(dire, p)) for p in pat_list]
+    with span('glob', 'glob', dir=dire):
+        lol = [glob.glob(os.path.join(dire, p)) for p in pat_list]
 
     # return flattened list
     return [item for sublist in lol for item in sublist]
@@ -120,27 +219,26 @@ def _get_info_mpich(prefix):
 
     # Run mpiexec --version and extract some information
     mpiexec = os.path.join(prefix, 'bin', 'mpiexec')
-    out = decode(check_output([mpiexec, '--version']))
+    out = decode(_probe_output([mpiexec, '--version'])[0])
 
     # Parse 'Configure options' section
     # Config options are like this:
     # '--disable-option-checking' '--prefix=NONE' '--enable-cuda'
-    m = re.search(r'Configure options:\s+(.*)$', out, re.MULTILINE)
+    m = _probe_search(r'Configure options:\s+(.*)$', out,
+                      'the configure options')
     conf_str = m.group(1)
     conf_list = [s.replace("'", '') for s
                  in re.findall(r'\'[^\']+\'', conf_str)]
 
-    m = re.search(r'Version:\s+(\S+)', out, re.MULTILINE)
-    ver = m.group(1)
+    ver = _probe_search(r'Version:\s+(\S+)', out, 'the version').group(1)
 
     if os.path.islink(prefix):
         prefix = os.path.realpath(prefix)
 
     info['type'] = 'MPICH'
-    info['active'] = is_active(prefix)
     info['version'] = ver
     info['prefix'] = prefix
-    info['configure'] = conf_list[0]
+    info['configure'] = conf_list[0] if conf_list else ""
     info['conf_params'] = conf_list
     info['default_name'] = "mpich-{}".format(ver)
 
@@ -153,18 +251,20 @@ def _get_info_mvapich(prefix):
     # Parse mvapich version
     mpi_h = os.path.join(prefix, 'include', 'mpi.h')
     if not os.path.exists(mpi_h):
-        raise RuntimeError("Error: Cannot find {}".format(mpi_h))
+        raise ProbeError("Cannot find {}".format(mpi_h))
 
-    mv_ver = check_output(['grep', '-E', 'define *MVAPICH2_VERSION', mpi_h],
-                          stderr=DEVNULL)
-    mch_ver = check_output(['grep', '-E', 'define *MPICH_VERSION', mpi_h],
-                           stderr=DEVNULL)
+    mv_ver = _probe_output(['grep', '-E', 'define *MVAPICH2_VERSION',
+                            mpi_h])[0]
+    mch_ver = _probe_output(['grep', '-E', 'define *MPICH_VERSION',
+                             mpi_h])[0]
 
     mv_ver = decode(mv_ver)
     mch_ver = decode(mch_ver)
 
-    mv_ver = re.search(r'"([.0-9]+)"', mv_ver).group(1)
-    mch_ver = re.search(r'"([.0-9]+)"', mch_ver).group(1)
+    mv_ver = _probe_search(r'"([.0-9]+)"', mv_ver,
+                           'MVAPICH2_VERSION').group(1)
+    mch_ver = _probe_search(r'"([.0-9]+)"', mch_ver,
+                            'MPICH_VERSION').group(1)
 
     info['version'] = mv_ver
     info['type'] = 'MVAPICH'
@@ -174,26 +274,47 @@ def _get_info_mvapich(prefix):
     return info
 
 
-def _call_ompi_info(bin):
-    out = check_output([bin, '--all', '--parsable'], stderr=DEVNULL)
-    out = decode(out)
+def _call_ompi_info(bin, cache_dir=None):
+    from mpienv.ompi import OmpiInfoCache
+    from mpienv.ompi import parse_ompi_info
+
+    cache = None
+    if cache_dir is not None:
+        cache = OmpiInfoCache(os.path.join(cache_dir, 'ompi_info'))
+        with span('load ompi_info', 'probe'):
+            ompi = cache.load(bin)
+        if ompi is not None:
+            return ompi
 
-    return parse_ompi_info(out)
+    out = decode(_probe_output([bin, '--all', '--parsable'])[0])
 
+    with span('parse_ompi_info', 'probe'):
+        ompi = parse_ompi_info(out)
 
-def _get_info_ompi(prefix):
+    if cache is not None:
+        try:
+            cache.save(bin, ompi)
+        except (IOError, OSError):
+            pass  # The cache is just an optimization
+    return ompi
+
+
+def _get_info_ompi(prefix, cache_dir=None):
     info = {}
 
-    ompi = _call_ompi_info(os.path.join(prefix, 'bin', 'ompi_info'))
+    ompi = _call_ompi_info(os.path.join(prefix, 'bin', 'ompi_info'),
+                           cache_dir)
 
     ver = ompi.get('ompi:version:full')
     mpi_ver = ompi.get('mpi-api:version:full')
+    if ver is None:
+        raise ProbeError("cannot find ompi:version:full in the output "
+                         "of ompi_info")
 
     if os.path.islink(prefix):
         prefix = os.path.realpath(prefix)
 
     info['type'] = 'Open MPI'
-    info['active'] = is_active(prefix)
     info['version'] = ver
     info['mpi_version'] = mpi_ver
     info['prefix'] = prefix
@@ -210,6 +331,16 @@ def _get_info_ompi(prefix):
     return info
 
 
+def _free_name(name, taken):
+    """`name`, or `name` with the first suffix not in `taken`."""
+    if name not in taken:
+        return name
+    i = 2
+    while "{}-{}".format(name, i) in taken:
+        i += 1
+    return "{}-{}".format(name, i)
+
+
 def mkdir_p(path):
     if not os.path.exists(path):
         os.makedirs(path)
@@ -240,15 +371,20 @@ class Manager(object):
                                          os.path.join(root_dir, 'cache'))
         self._build_dir = os.environ.get("MPIENV_BUILD_DIR",
                                          os.path.join(root_dir, 'builds'))
+        self._registry = Registry(self._vers_dir)
 
-        mkdir_p(self._vers_dir)
-        mkdir_p(self._mpi_dir)
-        mkdir_p(self._pylib_dir)
-        mkdir_p(self._cache_dir)
-        mkdir_p(self._build_dir)
-
-        self._load_mpi_info()
-        self._load_config()
+        # Everything below is loaded on demand. Directories are created
+        # by the commands that write into them.
+        self._snapshot = None
+        self._installed = {}
+        self._probes = {}  # real path of a prefix -> probe result
+        self._probe_locks = {}
+        self._records = None  # metadata records in versions/registry.json
+        self._new_records = {}  # records to be written back
+        self._conf = None
+        self._active_mpiexec = False  # not resolved yet
+        self._active_name = False  # not resolved yet
+        self._index = None
 
     def root_dir(self):
         return self._root_dir
@@ -265,16 +401,94 @@ class Manager(object):
     def pylib_dir(self):
         return self._pylib_dir
 
-    def _load_mpi_info(self):
-        # Get the current status of the MPI environment.
-        self._installed = {}
-        for prefix in glob.glob(os.path.join(self._mpi_dir, '*')):
-            name = os.path.split(prefix)[-1]
-            info = self.get_info(prefix)
+    def shims_dir(self):
+        return self._shims_dir
+
+    def stage_dir(self):
+        # Node-local directory for staged installations (if any)
+        return os.environ.get("MPIENV_STAGE_DIR")
+
+    def _names(self):
+        # Registered names and their link targets (no probing)
+        if self._snapshot is None:
+            self._snapshot = self._registry.snapshot()
+        return self._snapshot
+
+    def _invalidate(self, *names):
+        self._snapshot = None
+        self._records = None
+        self._active_name = False
+        for name in names:
+            self._installed.pop(name, None)
+
+    def _load_info(self, name, save=True):
+        if name not in self._installed:
+            info = self.get_info(name)
             info['name'] = name
             self._installed[name] = info
+            if save:
+                self._save_records()
+        return self._installed[name]
+
+    def _load_mpi_info(self, npar=1):
+        # Get the current status of the MPI environment.
+        names = [n for n in self._names() if n not in self._installed]
+        if npar > 1 and len(names) > 1:
+            from multiprocessing.pool import ThreadPool
+
+            # Resolve the active MPI before sharing it among threads
+            self.active_mpiexec()
+            pool = ThreadPool(min(npar, len(names)))
+            try:
+                with span('load all', npar=npar):
+                    pool.map(lambda n: self._load_info(n, save=False),
+                             names)
+            finally:
+                pool.close()
+                pool.join()
+        else:
+            with span('load all'):
+                for name in names:
+                    self._load_info(name, save=False)
+        self._save_records()
+
+    def _load_records(self):
+        if self._records is None:
+            self._records = self._registry.records()
+        return self._records
+
+    def _make_record(self, prefix, info, added_at):
+        # 'active' depends on the environment, and the others on the
+        # registry entry rather than the installation
+        info = {k: v for k, v in info.items()
+                if k not in ('active', 'broken', 'symlink', 'name')}
+        return {
+            'added_at': added_at,
+            'stamp': probe_stamp(prefix),
+            'info': info,
+        }
+
+    def _save_records(self):
+        # Write back the records of entries probed in this process,
+        # e.g. those of a registry created before records existed.
+        # This is best-effort: the registry may be read-only for us.
+        if not self._new_records:
+            return
+        try:
+            with span('save records'):
+                self._registry.update_records(self._new_records)
+        except (IOError, OSError):
+            pass
+        self._new_records = {}
+
+    def conf(self):
+        if self._conf is None:
+            self._load_config()
+        return self._conf
 
     def _load_config(self):
+        import json
+
         conf_json = os.path.join(self._root_dir, "config.json")
         if os.path.exists(conf_json):
             with open(conf_json) as f:
@@ -287,16 +501,22 @@ class Manager(object):
         self._conf.update(conf)
 
     def get_info_from_prefix(self, prefix):
+        count('probe')
+        with span('probe', 'probe', prefix=prefix):
+            return self._get_info_from_prefix(prefix)
+
+    def _get_info_from_prefix(self, prefix):
+        from subprocess import call
+
         info = {}
         mpiexec = os.path.join(prefix, 'bin', 'mpiexec')
         mpi_h = os.path.join(prefix, 'include', 'mpi.h')
 
-        p = Popen([mpiexec, '--version'], stderr=PIPE, stdout=PIPE)
-        out, err = p.communicate()
+        out, err = _probe_output([mpiexec, '--version'], check=False)
         ver_str = decode(out + err)
 
         if re.search(r'OpenRTE', ver_str, re.MULTILINE):
-            info.update(_get_info_ompi(prefix))
+            info.update(_get_info_ompi(prefix, self._cache_dir))
 
         if re.search(r'HYDRA', ver_str, re.MULTILINE):
             # MPICH or MVAPICH
@@ -304,8 +524,9 @@ class Manager(object):
             # the MPI type.
             # This is because MVAPCIH uses MPICH's mpiexec,
             # so we cannot distinguish them only from mpiexec.
-            ret = call(['grep', 'MVAPICH2_VERSION', '-q', mpi_h],
-                       stderr=DEVNULL)
+            cmd = ['grep', 'MVAPICH2_VERSION', '-q', mpi_h]
+            with command(cmd):
+                ret = call(cmd, stderr=_devnull())
             if ret == 0:
                 # MVAPICH
                 info.update(_get_info_mvapich(prefix))
@@ -317,9 +538,11 @@ class Manager(object):
                 # In this case, we assume it's mpich.
                 info.update(_get_info_mpich(prefix))
 
-        if info is None:
+        if not info:
             sys.stderr.write("ver_str = {}\n".format(ver_str))
-            raise RuntimeError("Unknown MPI type '{}'".format(mpiexec))
+            raise ProbeError("Unknown MPI type '{}'".format(mpiexec))
+
+        info['active'] = self.is_active_prefix(prefix)
 
         for bin in ['mpiexec', 'mpicc', 'mpicxx']:
             info[bin] = os.path.realpath(os.path.join(prefix, 'bin', bin))
@@ -329,6 +552,11 @@ class Manager(object):
     def prefix(self, name):
         return os.path.join(self._mpi_dir, name)
 
+    def ompi_info(self, name):
+        """Parsed `ompi_info --all` of an Open MPI installation."""
+        return _call_ompi_info(os.path.join(self.prefix(name), 'bin',
+                                            'ompi_info'), self._cache_dir)
+
     def get_info(self, name):
         """Obtain information of the MPI installed under prefix."""
         info = {}
@@ -351,78 +579,299 @@ class Manager(object):
 
         info['symlink'] = os.path.islink(self.prefix(name))
 
-        info.update(self.get_info_from_prefix(self.prefix(name)))
+        if name in self._names():
+            info.update(self._recorded_info(name))
+        else:
+            info.update(self._probe(self.prefix(name)))
+        return info
+
+    def _recorded_info(self, name):
+        # Use the record of `name` unless the installation has changed
+        import time
+
+        prefix = self.prefix(name)
+        record = self._load_records().get(name)
+        quarantine = None
+        if record is not None and record.get('stamp') == probe_stamp(prefix):
+            quarantine = record.get('quarantine')
+            if quarantine is None:
+                count('probe_recorded')
+                info = dict(record['info'])
+                info['active'] = self.is_active_prefix(prefix)
+                return info
+            if time.time() < quarantine['until']:
+                count('probe_quarantined')
+                return self._quarantined_info(prefix, quarantine)
+
+        if record is not None:
+            added_at = record.get('added_at')
+        else:
+            # Migrated from a registry without records
+            added_at = os.lstat(prefix).st_mtime
+
+        # A registered installation that fails to probe is quarantined,
+        # so that it does not slow down or break every command
+        try:
+            info = self._probe(prefix)
+        except _probe_errors as e:
+            quarantine = _quarantine(quarantine, e)
+            self._new_records[name] = {
+                'added_at': added_at,
+                'stamp': probe_stamp(prefix),
+                'quarantine': quarantine,
+            }
+            return self._quarantined_info(prefix, quarantine)
+
+        self._new_records[name] = self._make_record(prefix, info, added_at)
         return info
 
-    def items(self):
+    def _quarantined_info(self, prefix, quarantine):
+        # Commands treat a quarantined installation as a broken one
+        return {
+            'broken': True,
+            'quarantined': True,
+            'prefix': os.path.realpath(prefix),
+            'error': quarantine['error'],
+            'failures': quarantine['failures'],
+            'retry_at': quarantine['until'],
+        }
+
+    def quarantined(self):
+        """Return {name: quarantine} of the quarantined installations.
+
+        Only the records are read. An entry whose backoff has expired
+        is probed again when it is next loaded.
+        """
+        return {name: record['quarantine']
+                for name, record in self._load_records().items()
+                if 'quarantine' in record and name in self._names()}
+
+    def _probe(self, prefix):
+        # Each installation is probed at most once in a process, even
+        # if it is registered under several names probed in parallel.
+        import threading
+
+        key = os.path.realpath(prefix)
+        with self._probe_locks.setdefault(key, threading.Lock()):
+            if key in self._probes:
+                count('probe_cached')
+            else:
+                self._probes[key] = self.get_info_from_prefix(prefix)
+        return dict(self._probes[key])
+
+    def refresh(self, name=None):
+        """Discard the cached information of `name` (or of all MPIs).
+
+        The next access re-reads the registry and probes again.
+        """
+        # Records are not trusted either, and rewritten after probing
+        if name is None:
+            self._probes = {}
+            self._installed = {}
+            self._records = {}
+        else:
+            self._probes.pop(os.path.realpath(self.prefix(name)), None)
+            self._installed.pop(name, None)
+            self._load_records().pop(name, None)
+        self._snapshot = None
+        self._index = None
+        self._active_name = False
+
+    def items(self, npar=1):
+        """Information of all the MPIs, probing `npar` ones at a time."""
+        self._load_mpi_info(npar)
         return self._installed.items()
 
+    def registered(self):
+        """Return {name: prefix} of the MPIs, without probing them."""
+        return {name: os.path.realpath(self.prefix(name))
+                for name in self._names()}
+
     def keys(self):
-        return self._installed.keys()
+        return self._names().keys()
 
     def __getitem__(self, key):
-        return self._installed[key]
+        if key not in self._names():
+            raise KeyError(key)
+        return self._load_info(key)
 
     def __contains__(self, key):
-        return key in self._installed
+        return key in self._names()
 
     def mpiexec(self, name):
         return os.path.realpath(os.path.join(
             self._mpi_dir, name, 'bin', 'mpiexec'))
 
+    def _identity_keys(self, path):
+        """Keys identifying an installation in the identity index.
+
+        They are the real paths and the (device, inode) of the prefix
+        and of its mpiexec, so that a prefix reached through any symlink
+        or bind mount is recognized without probing it.
+        """
+        mpiexec = os.path.join(path, 'bin', 'mpiexec')
+        keys = [os.path.realpath(path), os.path.realpath(mpiexec),
+                file_id(path), file_id(mpiexec)]
+        return [k for k in keys if k is not None]
+
+    def _identity_index(self):
+        if self._index is None:
+            self._index = {}
+            for name in sorted(self.keys()):
+                self._index_add(name)
+        return self._index
+
+    def _index_add(self, name):
+        for key in self._identity_keys(self.prefix(name)):
+            self._index.setdefault(key, name)
+
+    def _index_remove(self, name):
+        self._index = {k: n for k, n in self._index.items() if n != name}
+
     def is_installed(self, path):
         # Find mpiexec in the path or something and check if it is already
         # under our control.
         assert type(path) == str or type(path) == bytes
-        mpiexec = None
         path = os.path.realpath(path)
-        if os.path.isdir(path):
-            mpiexec = os.path.realpath(os.path.join(path, 'bin', 'mpiexec'))
-        else:
+        if not os.path.isdir(path):
             raise RuntimeError("todo: path={}".format(path))
 
-        for name, info in self.items():
-            if info.get('mpiexec', None) == mpiexec:
-                return name
+        index = self._identity_index()
+        for key in self._identity_keys(path):
+            if key in index:
+                return index[key]
 
         return None
 
+    def active_mpiexec(self):
+        """Identity of the mpiexec found in PATH.
+
+        PATH is searched only once per process. Returns (device, inode)
+        of the command, or None if mpiexec is not in PATH.
+        """
+        if self._active_mpiexec is False:
+            exe = find_executable('mpiexec')
+            self._active_mpiexec = file_id(exe) if exe else None
+        return self._active_mpiexec
+
+    def is_active_prefix(self, prefix):
+        active = self.active_mpiexec()
+        if active is None:
+            return False
+        return file_id(os.path.join(prefix, 'bin', 'mpiexec')) == active
+
+    def active_name(self):
+        """Name of the active MPI installation, or None."""
+        if self._active_name is False:
+            self._active_name = None
+            if self.active_mpiexec() is not None:
+                for name in sorted(self.keys()):
+                    if self.is_active_prefix(self.prefix(name)):
+                        self._active_name = name
+                        break
+        return self._active_name
+
     def get_current_name(self):
-        try:
-            return next(name for name, info in self.items() if info['active'])
-        except StopIteration:
+        name = self.active_name()
+        if name is None:
             raise UnknownMPI()
+        return name
 
     def add(self, prefix, name=None):
+        prefix = os.path.abspath(prefix)
+
+        # Check the identity index before probing the prefix
+        n = self.is_installed(prefix) if os.path.isdir(prefix) else None
+        if n is not None:
+            raise RuntimeError("{} is already managed "
+                               "as '{}'".format(prefix, n))
+
         info = self.get_info(prefix)
 
         if info is None:
             sys.stderr.write("Cannot find MPI in {}\n".format(prefix))
             exit(-1)
 
-        n = self.is_installed(prefix)
-        if n is not None:
-            raise RuntimeError("{} is already managed "
-                               "as '{}'".format(prefix, n))
-
-        if self._installed.get(name) is not None:
+        if name in self:
             raise RuntimeError("Specifed name '{}' is "
                                "already taken".format(name))
-        else:
+        elif name is None:
             name = info['default_name']
             if name in self:
                 raise RuntimeError("Recommended name for {} is {}, "
                                    "but the name is "
                                    "already used.".format(prefix, name))
 
-        # dst -> src
-        dst = os.path.join(self._mpi_dir, name)
-        src = prefix
-
-        os.symlink(src, dst)
+        import time
+        self._registry.link(name, prefix,
+                            self._make_record(prefix, info, time.time()))
+        self._invalidate(name)
+        if self._index is not None:
+            self._index_add(name)
 
         return name
 
+    def add_many(self, prefixes, npar=8, skip_existing=False):
+        """Register many prefixes at once.
+
+        The prefixes are probed in parallel. A default name that is
+        already taken gets the first free suffix ("-2", "-3", ...), in the
+        order of `prefixes`. Either all of them are registered, or none.
+        Returns [(prefix, name)] of the registered prefixes.
+        """
+        import time
+
+        todo = []
+        seen = set()
+        for prefix in prefixes:
+            prefix = os.path.abspath(prefix)
+            if os.path.realpath(prefix) in seen:
+                continue
+            seen.add(os.path.realpath(prefix))
+            if not os.path.isdir(prefix):
+                raise RuntimeError("{} is not a directory".format(prefix))
+            n = self.is_installed(prefix)
+            if n is not None:
+                if skip_existing:
+                    continue
+                raise RuntimeError("{} is already managed "
+                                   "as '{}'".format(prefix, n))
+            todo.append(prefix)
+
+        with span('probe all'):
+            if npar > 1 and len(todo) > 1:
+                from multiprocessing.pool import ThreadPool
+                pool = ThreadPool(min(npar, len(todo)))
+                try:
+                    infos = pool.map(self.get_info, todo)
+                finally:
+                    pool.close()
+                    pool.join()
+            else:
+                infos = [self.get_info(p) for p in todo]
+
+        missing = [p for p, info in zip(todo, infos) if info is None]
+        if missing:
+            raise RuntimeError("Cannot find MPI in {}".format(
+                ", ".join(missing)))
+
+        taken = set(self.keys())
+        entries = []
+        now = time.time()
+        for prefix, info in zip(todo, infos):
+            name = _free_name(info['default_name'], taken)
+            taken.add(name)
+            entries.append((name, prefix,
+                            self._make_record(prefix, info, now)))
+
+        self._registry.link_many(entries)
+        self._invalidate(*[name for name, _, _ in entries])
+        if self._index is not None:
+            for name, _, _ in entries:
+                self._index_add(name)
+
+        return [(prefix, name) for name, prefix, _ in entries]
+
     def rm(self, name, prompt=False):
         if name not in self:
             raise RuntimeError("No such MPI: '{}'".format(name))
@@ -434,13 +883,11 @@ class Manager(object):
                              "'{}'\n".format(name))
             exit(-1)
 
-        path = os.path.join(self._mpi_dir, name)
-
         if (not prompt) or yes_no_input("Remove '{}' ?".format(name)):
-            if info['symlink']:
-                os.remove(path)
-            else:
-                shutil.rmtree(path)
+            self._registry.remove(name)
+            self._invalidate(name)
+            if self._index is not None:
+                self._index_remove(name)
 
     def rename(self, name_from, name_to):
         if name_from not in self:
@@ -449,10 +896,11 @@ class Manager(object):
         if name_to in self:
             raise RuntimeError("Name '{}' already exists".format(name_to))
 
-        path_from = os.path.join(self._mpi_dir, name_from)
-        path_to = os.path.join(self._mpi_dir, name_to)
-
-        shutil.move(path_from, path_to)
+        self._registry.rename(name_from, name_to)
+        self._invalidate(name_from, name_to)
+        if self._index is not None:
+            self._index_remove(name_from)
+            self._index_add(name_to)
 
     def use(self, name, mpi4py=False):
         if name not in self:
@@ -461,18 +909,13 @@ class Manager(object):
                              "'{}'\n".format(name))
             exit(-1)
 
-        if os.path.exists(self._shims_dir):
-            shutil.rmtree(self._shims_dir)
-
-        os.mkdir(self._shims_dir)
-
-        for d in ['bin', 'lib', 'include', 'libexec']:
-            dr = os.path.join(self._shims_dir, d)
-            if not os.path.exists(dr):
-                os.mkdir(dr)
-
         info = self.get_info(name)
 
+        if info.get('quarantined'):
+            sys.stderr.write("mpienv-use: Error: "
+                             "'{}' is quarantined: {}\n"
+                             "".format(name, info['error']))
+            exit(-1)
         if info.get('broken'):
             sys.stderr.write("mpienv-use: Error: "
                              "'{}' seems to be broken. Maybe it is removed.\n"
@@ -480,23 +923,68 @@ class Manager(object):
             exit(-1)
 
         if info['type'] == 'MPICH':
-            self._use_mpich(info['prefix'])
+            use_func = self._use_mpich
         elif info['type'] == 'Open MPI':
-            self._use_openmpi(info['prefix'])
+            use_func = self._use_openmpi
         elif info['type'] == 'MVAPICH':
-            self._use_mvapich(info['prefix'])
+            use_func = self._use_mvapich
         else:
             raise RuntimeError('Internal Error: '
                                'unknown MPI type: "{}"'.format(info['type']))
 
+        def build(shims_dir):
+            with span('build shims', prefix=info['prefix']):
+                for d in ['bin', 'lib', 'include', 'libexec']:
+                    os.mkdir(os.path.join(shims_dir, d))
+                use_func(info['prefix'], shims_dir)
+
+        with span('replace shims'):
+            self._registry.replace_shims(build)
+
         if mpi4py:
+            from mpienv.py import MPI4Py
             mpi4py = MPI4Py(self, name)
             if not mpi4py.is_installed():
                 mpi4py.install()
             mpi4py.use()
 
-    def exec_(self, cmds):
-        envs = os.environ.copy()
+    def shell_paths(self, environ=None):
+        """Normalized PATH and LD_LIBRARY_PATH, with the shims first."""
+        from mpienv import envpath
+        envs = dict(os.environ if environ is None else environ)
+        return envpath.normalize_environ(
+            envs, self._vers_dir, envpath.shims_paths(self._shims_dir))
+
+    def launch_prefix(self, name, info):
+        """Return (prefix, staged) of `name` as seen by mpiexec.
+
+        `prefix` is what `mpienv exec` gives to the hosts of a job: the
+        node-local copy made by `mpienv stage` if there is one (then also
+        returned as `staged`), or else the registered prefix.
+        """
+        from mpienv.stage import staged_prefix
+
+        staged = None
+        if self.stage_dir():
+            staged = staged_prefix(self.stage_dir(), name, info)
+        if staged:
+            return staged, staged
+
+        pref = self.prefix(name)
+        if os.path.islink(pref):
+            pref = os.readlink(pref)
+        return pref, None
+
+    def exec_args(self, cmds, environ=None):
+        """Build the command line and the environment of `mpienv exec`.
+
+        Returns (argv, env, prefix), where `prefix` is the installation
+        (or its staged copy) running `cmds`. Nothing is executed.
+        """
+        from mpienv import envpath
+        from mpienv.py import MPI4Py
+
+        envs = dict(os.environ if environ is None else environ)
 
         try:
             name = self.get_current_name()
@@ -516,50 +1004,105 @@ class Manager(object):
             sys.stderr.write("Error: the current MPI is broken\n")
             exit(-1)
 
+        pref, staged = self.launch_prefix(name, info)
+        # The search paths are forwarded to every process: no duplicates,
+        # no missing directories, no other mpienv's shims
+        first = {}
+        if staged:
+            # (lib64 is dropped if it does not exist)
+            first = {'PATH': [os.path.join(staged, 'bin')],
+                     'LD_LIBRARY_PATH': [os.path.join(staged, 'lib'),
+                                         os.path.join(staged, 'lib64')]}
+            if info['type'] == 'Open MPI':
+                # Open MPI locates its files from OPAL_PREFIX when relocated
+                envs['OPAL_PREFIX'] = staged
+        envpath.normalize_environ(envs, self._vers_dir, first)
+
+        args = list(cmds)
         if info['type'] == 'Open MPI':
-            pref = self.prefix(name)
-            if os.path.islink(pref):
-                pref = os.readlink(pref)
-
-            cmds[:0] = ['--prefix', pref]
-            cmds[:0] = ['-x', 'PYTHONPATH']
+            args[:0] = ['--prefix', pref]
+            args[:0] = ['-x', 'PYTHONPATH']
             # Transfer some environ vars
             vars = ['PATH', 'LD_LIBRARY_PATH']  # vars to be transferred
-            vars += [v for v in os.environ if v.startswith('OMPI_')]
+            vars += [v for v in envs if v.startswith('OMPI_')]
+            vars += ['OPAL_PREFIX'] if staged else []
             for var in vars:
                 if var in envs:
-                    cmds[:0] = ['-x', var]
+                    args[:0] = ['-x', var]
 
         elif info['type'] in ['MPICH', 'MVAPICH']:
-            cmds[:0] = ['-genvlist', 'PATH,LD_LIBRARY_PATH,PYTHONPATH']
-
-        # sys.stderr.write("{}\n".format(info['type']))
+            args[:0] = ['-genvlist', 'PATH,LD_LIBRARY_PATH,PYTHONPATH']
 
         mpiexec = os.path.realpath(
-            os.path.join(self.prefix(name), 'bin', 'mpiexec'))
+            os.path.join(staged or self.prefix(name), 'bin', 'mpiexec'))
+
+        return [mpiexec] + args, envs, pref
+
+    def exec_(self, cmds):
+        from subprocess import Popen
+
+        argv, envs, prefix = self.exec_args(cmds)
 
-        cmds[:0] = [mpiexec]
+        with span('abi check'):
+            info = self.get_info(self.get_current_name())
+            self._check_abi(cmds, prefix, info, envs)
 
-        # sys.stderr.write(' '.join(cmds) + "\n")
-        p = Popen(cmds, env=envs)
-        p.wait()
+        # sys.stderr.write(' '.join(argv) + "\n")
+        with command(argv):
+            p = Popen(argv, env=envs)
+            p.wait()
         exit(p.returncode)
 
+    def _check_abi(self, args, prefix, info, envs):
+        """Check that the program in `args` can run with the MPI."""
+        from mpienv import abi
+
+        policy = os.environ.get('MPIENV_ABI_CHECK', 'warn')
+        if policy not in abi.policies:
+            sys.stderr.write("Warning: unknown MPIENV_ABI_CHECK value: "
+                             "'{}'\n".format(policy))
+            policy = 'warn'
+        if policy == 'off':
+            return
+
+        program = abi.find_program(args, envs.get('PATH'))
+        if program is None:
+            return
+
+        ld_path = [p for p in envs.get('LD_LIBRARY_PATH', '').split(':')
+                   if p]
+        if info['type'] == 'Open MPI':
+            # mpiexec --prefix puts the libraries first
+            ld_path[:0] = [os.path.join(prefix, d) for d in ['lib', 'lib64']]
+
+        cache = abi.ABICache(os.path.join(self._cache_dir, 'abi-check.json'))
+        problems = abi.check(program, prefix, ld_path, cache)
+
+        refuse = policy == 'error' and \
+            any(level == 'error' for level, _ in problems)
+        for level, msg in problems:
+            sys.stderr.write("mpienv: {}: {}\n".format(
+                "Error" if refuse and level == 'error' else "Warning", msg))
+        if refuse:
+            sys.stderr.write("mpienv: Not launching {} "
+                             "(MPIENV_ABI_CHECK=error)\n".format(program))
+            exit(-1)
+
     def _mirror_file(self, f, dst_dir):
         dst = os.path.join(dst_dir, os.path.basename(f))
 
         if os.path.islink(f):
             src = os.path.realpath(f)
-            os.symlink(src, dst)
         elif os.path.isdir(f):
             src = f
-            os.symlink(src, dst)
         else:
             # ordinary files
             src = f
+
+        with span('symlink', 'symlink', path=dst):
             os.symlink(src, dst)
 
-    def _use_mpich(self, prefix):
+    def _use_mpich(self, prefix, shims_dir):
         bin_files = _glob_list([prefix, 'bin'],
                                ['hydra_*',
                                 'mpi*',
@@ -577,22 +1120,22 @@ class Manager(object):
                                 'primitives'])
 
         for f in bin_files:
-            self._mirror_file(f, os.path.join(self._shims_dir, 'bin'))
+            self._mirror_file(f, os.path.join(shims_dir, 'bin'))
 
         for f in lib_files:
-            self._mirror_file(f, os.path.join(self._shims_dir, 'lib'))
+            self._mirror_file(f, os.path.join(shims_dir, 'lib'))
 
         for f in inc_files:
-            self._mirror_file(f, os.path.join(self._shims_dir, 'include'))
+            self._mirror_file(f, os.path.join(shims_dir, 'include'))
 
-    def _use_mvapich(self, prefix):
-        self._use_mpich(prefix)
+    def _use_mvapich(self, prefix, shims_dir):
+        self._use_mpich(prefix, shims_dir)
         libexec_files = _glob_list([prefix, 'libexec'],
                                    ['osu-micro-benchmarks'])
         for f in libexec_files:
-            self._mirror_file(f, os.path.join(self._shims_dir, 'libexec'))
+            self._mirror_file(f, os.path.join(shims_dir, 'libexec'))
 
-    def _use_openmpi(self, prefix):
+    def _use_openmpi(self, prefix, shims_dir):
         bin_files = _glob_list([prefix, 'bin'],
                                ['mpi*',
                                 'ompi-*',
@@ -600,7 +1143,7 @@ class Manager(object):
                                 'orte*',
                                 'opal_'])
 
-        lib_files = _glob_list([prefix, 'bin'],
+        lib_files = _glob_list([prefix, 'lib'],
                                ['libmpi*',
                                 'libmca*',
                                 'libompi*',
@@ -613,13 +1156,13 @@ class Manager(object):
                                ['mpi*.h', 'openmpi'])
 
         for f in bin_files:
-            self._mirror_file(f, os.path.join(self._shims_dir, 'bin'))
+            self._mirror_file(f, os.path.join(shims_dir, 'bin'))
 
         for f in lib_files:
-            self._mirror_file(f, os.path.join(self._shims_dir, 'lib'))
+            self._mirror_file(f, os.path.join(shims_dir, 'lib'))
 
         for f in inc_files:
-            self._mirror_file(f, os.path.join(self._shims_dir, 'include'))
+            self._mirror_file(f, os.path.join(shims_dir, 'include'))
 
 
 _root_dir = (os.environ.get("MPIENV_ROOT", None) or
@@ -0,0 +1,151 @@
+# coding: utf-8
+"""Check that a program is linked against the MPI it is launched with."""
+
+import errno
+import json
+import os
+import os.path
+import time
+
+from mpienv import elf
+from mpienv.fingerprint import find_libmpi
+
+policies = ['warn', 'error', 'off']
+
+# Names of the MPI library itself (but not e.g. libmpi_cxx)
+_libmpi_stems = ['libmpi', 'libmpich']
+
+# Number of binaries remembered in the cache file
+_cache_size = 256
+
+
+def find_program(args, path=None):
+    """Find the program in the arguments of mpiexec.
+
+    The program is the first argument that names an ELF executable;
+    option values like '-n 4' or a hostfile never do.
+    """
+    if path is None:
+        path = os.environ.get('PATH', os.defpath)
+    for arg in args:
+        if arg.startswith('-'):
+            continue
+        if '/' in arg:
+            cands = [arg]
+        else:
+            cands = [os.path.join(d, arg) for d in path.split(os.pathsep)]
+        for cand in cands:
+            if os.path.isfile(cand) and os.access(cand, os.X_OK) and \
+               elf.read_elf(cand) is not None:
+                return os.path.abspath(cand)
+    return None
+
+
+def _is_libmpi(name):
+    return name.split('.so', 1)[0] in _libmpi_stems
+
+
+def linked_libmpi(program, ld_library_path=()):
+    """List (soname, resolved path or None) of libmpi used by `program`."""
+    deps = elf.check(program, ld_library_path)
+    found = [(n, p) for n, p in sorted(deps['libraries'].items())
+             if _is_libmpi(n)]
+    found += [(n, None) for n, _ in deps['missing'] if _is_libmpi(n)]
+    return found
+
+
+class ABICache(object):
+    """Results of linked_libmpi() kept in a file, per (path, mtime).
+
+    The file is rewritten atomically; concurrent launches may lose each
+    other's updates, which only costs a rescan.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._data = None
+
+    def _load(self):
+        if self._data is None:
+            try:
+                with open(self._path) as f:
+                    self._data = json.load(f)
+            except (IOError, OSError, ValueError):
+                self._data = {}
+        return self._data
+
+    def _save(self):
+        d = os.path.dirname(self._path)
+        if not os.path.exists(d):
+            os.makedirs(d)
+        data = self._load()
+        if len(data) > _cache_size:
+            old = sorted(data, key=lambda k: data[k]['checked_at'])
+            for k in old[:len(data) - _cache_size]:
+                del data[k]
+        tmp = "{}.{}".format(self._path, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(data, f)
+        os.rename(tmp, self._path)
+
+    def linked_libmpi(self, program, ld_library_path=()):
+        st = os.stat(program)
+        key = "{}:{}".format(os.path.realpath(program),
+                             ':'.join(ld_library_path))
+        entry = self._load().get(key)
+        if entry is not None and entry['mtime'] == st.st_mtime and \
+           entry['size'] == st.st_size:
+            return [tuple(x) for x in entry['libmpi']]
+
+        found = linked_libmpi(program, ld_library_path)
+        self._load()[key] = {
+            'mtime': st.st_mtime,
+            'size': st.st_size,
+            'checked_at': time.time(),
+            'libmpi': found,
+        }
+        try:
+            self._save()
+        except (IOError, OSError) as e:
+            if e.errno not in (errno.EACCES, errno.EROFS, errno.ENOSPC):
+                raise
+        return found
+
+
+def check(program, prefix, ld_library_path=(), cache=None):
+    """Compare the libmpi of `program` with the one under `prefix`.
+
+    Returns a list of (level, message), where level is 'error' if the
+    program would fail to run with the MPI, or 'warn' if it would load
+    the same libmpi from another location.
+    """
+    libmpi = find_libmpi(prefix)
+    if libmpi is None:
+        return []
+    ours = elf.read_elf(libmpi)
+    soname = (ours and ours.soname) or os.path.basename(libmpi)
+
+    if cache is not None:
+        used = cache.linked_libmpi(program, ld_library_path)
+    else:
+        used = linked_libmpi(program, ld_library_path)
+    if not used:
+        # Not an MPI program, or it loads MPI with dlopen()
+        return []
+
+    names = [name for name, _ in used]
+    if soname not in names:
+        return [('error', "{} is linked against {}, but the MPI provides "
+                 "{}".format(program, ', '.join(names), soname))]
+
+    problems = []
+    for name, path in used:
+        if name != soname:
+            continue
+        if path is None:
+            problems.append(('error', "{} needs {}, which is not "
+                             "found".format(program, name)))
+        elif os.path.realpath(path) != libmpi:
+            problems.append(('warn', "{} would load {}, not the one in "
+                             "{}".format(program, path, prefix)))
+    return problems
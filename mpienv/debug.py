@@ -0,0 +1,38 @@
+# coding: utf-8
+"""Per-process counters, reported on exit when MPIENV_DEBUG is set."""
+
+import atexit
+import os
+import os.path
+import sys
+
+counters = {}
+
+
+def enabled():
+    return bool(os.environ.get('MPIENV_DEBUG'))
+
+
+def count(key, n=1):
+    counters[key] = counters.get(key, 0) + n
+
+
+def spawned(cmd):
+    """Count a subprocess launched to run `cmd`."""
+    count('subprocess')
+    count('subprocess:' + os.path.basename(cmd[0]))
+
+
+def report(out=sys.stderr):
+    cmds = sorted((k.split(':', 1)[1], v) for k, v in counters.items()
+                  if k.startswith('subprocess:'))
+    out.write("mpienv: {} subprocess(es) spawned{}{}\n".format(
+        counters.get('subprocess', 0),
+        ': ' if cmds else '',
+        ' '.join('{}={}'.format(k, v) for k, v in cmds)))
+    out.write("mpienv: probes: {} run, {} cached\n".format(
+        counters.get('probe', 0), counters.get('probe_cached', 0)))
+
+
+if enabled():
+    atexit.register(report)
@@ -0,0 +1,232 @@
+# coding: utf-8
+"""Candidate MPI installations found in local package databases.
+
+Package managers, Spack, environment modules and Conda already know
+where MPIs are installed. Each source below reads its database (or
+metadata files) directly, without running the tool, and returns the
+prefixes that may hold an MPI. They are only candidates: the caller
+checks each of them, like a directory found by walking the filesystem.
+
+The locations of the databases are module variables, so they can be
+pointed elsewhere (e.g. in tests).
+"""
+
+import glob
+import json
+import os
+import os.path
+import re
+
+from mpienv.profile import span
+
+dpkg_info_dir = '/var/lib/dpkg/info'
+rpm_dbs = ['/var/lib/rpm/rpmdb.sqlite', '/usr/lib/sysimage/rpm/rpmdb.sqlite']
+alternatives_dirs = ['/var/lib/dpkg/alternatives', '/var/lib/alternatives',
+                     '/etc/alternatives']
+spack_roots = [os.environ.get('SPACK_ROOT', ''),
+               os.path.expanduser('~/spack')]
+conda_environments = os.path.expanduser('~/.conda/environments.txt')
+
+_commands = ['mpiexec', 'mpirun']
+
+# A file of an MPI launcher in a file list, e.g. /usr/bin/mpiexec.hydra
+_launcher_re = re.compile(r'^(/.*)/bin/(mpiexec|mpirun)(\.[\w-]+)?$')
+
+# Package, Spack and Conda names of MPI implementations
+_mpi_name_re = re.compile(r'mpi|mpich|mvapich', re.I)
+
+
+def _prefix_of_launcher(path):
+    m = _launcher_re.match(path.strip())
+    return m.group(1) if m else None
+
+
+def from_dpkg():
+    """Prefixes of the launchers in the file lists of MPI packages."""
+    prefixes = []
+    for path in glob.glob(os.path.join(dpkg_info_dir, '*.list')):
+        pkg = os.path.basename(path)
+        if not _mpi_name_re.search(pkg):
+            continue
+        with open(path) as f:
+            for line in f:
+                prefix = _prefix_of_launcher(line)
+                if prefix:
+                    prefixes.append(prefix)
+    return prefixes
+
+
+def from_rpm():
+    """Directories of the packages providing a launcher.
+
+    The sqlite database of rpm >= 4.16 has an index from base names of
+    files to packages, and from packages to directory names. The older
+    Berkeley DB format is not read.
+    """
+    import sqlite3
+
+    prefixes = []
+    for db in rpm_dbs:
+        if not os.path.exists(db):
+            continue
+        try:
+            conn = sqlite3.connect('file:{}?mode=ro'.format(db), uri=True)
+        except TypeError:
+            conn = sqlite3.connect(db)  # Python 2
+        try:
+            rows = conn.execute(
+                "SELECT key FROM Dirnames WHERE hnum IN "
+                "(SELECT hnum FROM Basenames WHERE key IN (?, ?))",
+                _commands).fetchall()
+        except sqlite3.Error:
+            continue  # e.g. locked, or not the schema we know
+        finally:
+            conn.close()
+        for (d,) in rows:
+            d = d.rstrip('/')
+            if os.path.basename(d) == 'bin':
+                prefixes.append(os.path.dirname(d))
+    return prefixes
+
+
+def from_alternatives():
+    """Prefixes of the alternatives of mpirun and mpiexec."""
+    prefixes = []
+    for d in alternatives_dirs:
+        for cmd in _commands:
+            path = os.path.join(d, cmd)
+            if not os.path.isfile(path):
+                continue
+            # The file lists the link, the slaves, and then each
+            # alternative with its priority and slaves.
+            with open(path) as f:
+                for line in f:
+                    prefix = _prefix_of_launcher(line)
+                    if prefix:
+                        prefixes.append(prefix)
+    return prefixes
+
+
+def from_spack():
+    """Prefixes of MPI packages installed by Spack."""
+    prefixes = []
+    for root in spack_roots:
+        if not root:
+            continue
+        index = os.path.join(root, 'opt', 'spack', '.spack-db',
+                             'index.json')
+        if not os.path.isfile(index):
+            continue
+        with open(index) as f:
+            db = json.load(f)
+        for rec in db.get('database', {}).get('installs', {}).values():
+            spec = rec.get('spec', {})
+            # Before Spack 0.17, a spec is {name: {...}}
+            name = spec.get('name') or next(iter(spec), '')
+            if rec.get('installed') and rec.get('path') and \
+               _mpi_name_re.search(name):
+                prefixes.append(rec['path'])
+    return prefixes
+
+
+# `local root = "/sw/OpenMPI/4.1.1"` (EasyBuild), `set root /sw/...`
+_module_root_re = re.compile(
+    r'^\s*(?:local\s+root\s*=|set\s+root\s)\s*"?([^"\s]+)"?', re.M)
+# prepend_path("PATH", "/sw/mpich/bin") (Lua), prepend-path PATH ... (Tcl)
+_module_path_re = re.compile(
+    r'prepend[-_]path\s*\(?\s*"?PATH"?\s*,?\s*"?([^"\s)]+)/bin"?', re.M)
+
+
+def from_modules():
+    """Prefixes in the modulefiles of MPIs in MODULEPATH.
+
+    Lmod (Lua) and environment modules (Tcl) files are read, including
+    the ones generated by EasyBuild.
+    """
+    prefixes = []
+    for top in os.environ.get('MODULEPATH', '').split(':'):
+        if not top or not os.path.isdir(top):
+            continue
+        for dirpath, dirs, files in os.walk(top):
+            rel = os.path.relpath(dirpath, top)
+            for fname in files:
+                if not _mpi_name_re.search(os.path.join(rel, fname)):
+                    continue
+                with open(os.path.join(dirpath, fname)) as f:
+                    text = f.read()
+                found = _module_root_re.findall(text) or \
+                    _module_path_re.findall(text)
+                prefixes.extend(p for p in found if p.startswith('/'))
+    return prefixes
+
+
+def _conda_envs():
+    envs = []
+    if os.path.isfile(conda_environments):
+        with open(conda_environments) as f:
+            envs += [ln.strip() for ln in f if ln.strip()]
+    for var in ['CONDA_PREFIX', 'CONDA_EXE']:
+        path = os.environ.get(var)
+        if not path:
+            continue
+        if var == 'CONDA_EXE':
+            # <root>/bin/conda
+            path = os.path.dirname(os.path.dirname(path))
+        envs.append(path)
+        envs += glob.glob(os.path.join(path, 'envs', '*'))
+    return envs
+
+
+def from_conda():
+    """Conda environments with an MPI package installed."""
+    prefixes = []
+    for env in _conda_envs():
+        try:
+            metas = os.listdir(os.path.join(env, 'conda-meta'))
+        except OSError:
+            continue
+        for meta in metas:
+            # <name>-<version>-<build>.json
+            name = meta.rsplit('-', 2)[0]
+            if name in ['openmpi', 'mpich', 'mvapich', 'mvapich2',
+                        'impi_rt']:
+                prefixes.append(env)
+                break
+    return prefixes
+
+
+sources = [
+    ('dpkg', from_dpkg),
+    ('rpm', from_rpm),
+    ('alternatives', from_alternatives),
+    ('spack', from_spack),
+    ('modules', from_modules),
+    ('conda', from_conda),
+]
+
+source_names = [name for name, _ in sources]
+
+
+def candidates(names=None):
+    """Return (source, prefix) of the candidate installations.
+
+    `names` selects the sources (default: all). A prefix is returned
+    once, for the first source that knows it. Unreadable databases are
+    skipped.
+    """
+    found = []
+    seen = set()
+    for name, func in sources:
+        if names is not None and name not in names:
+            continue
+        with span(name, 'discovery'):
+            try:
+                prefixes = func()
+            except (IOError, OSError, ValueError, ImportError):
+                prefixes = []
+        for prefix in prefixes:
+            key = os.path.realpath(prefix)
+            if key not in seen:
+                seen.add(key)
+                found.append((name, prefix))
+    return found
@@ -0,0 +1,324 @@
+# coding: utf-8
+"""Read the dynamic section of ELF files and resolve shared libraries.
+
+Everything here is done by reading files: nothing is executed, not even
+the dynamic loader. The search follows the rules of the GNU loader:
+DT_RPATH (of the object and the objects that loaded it, unless the
+object has DT_RUNPATH), LD_LIBRARY_PATH, DT_RUNPATH, the directories in
+/etc/ld.so.conf and the default directories.
+"""
+
+import glob
+import os
+import os.path
+import platform
+import struct
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+_ld_so_conf = '/etc/ld.so.conf'
+
+# Parsed files: real path -> (mtime, ELFFile)
+_cache = {}
+_system_dirs = None
+
+
+class ELFError(RuntimeError):
+    pass
+
+
+class ELFFile(object):
+    """The dynamic linking information of an ELF file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.elf_class = None  # 32 or 64
+        self.byteorder = None  # '<' or '>'
+        self.machine = None
+        self.interp = None
+        self.soname = None
+        self.needed = []
+        self.rpath = []
+        self.runpath = []
+
+        with open(path, 'rb') as f:
+            self._parse(f)
+
+    def compatible(self, other):
+        """True if the loader may link `other` into the same process."""
+        return (self.elf_class == other.elf_class and
+                self.byteorder == other.byteorder and
+                self.machine == other.machine)
+
+    def _parse(self, f):
+        ident = f.read(16)
+        if len(ident) < 16 or ident[:4] != b'\x7fELF':
+            raise ELFError("{}: not an ELF file".format(self.path))
+
+        ei_class = ident[4:5]
+        ei_data = ident[5:6]
+        if ei_class not in (b'\x01', b'\x02') or \
+           ei_data not in (b'\x01', b'\x02'):
+            raise ELFError("{}: unsupported ELF file".format(self.path))
+        self.elf_class = 32 if ei_class == b'\x01' else 64
+        self.byteorder = '<' if ei_data == b'\x01' else '>'
+
+        if self.elf_class == 64:
+            ehdr, phdr, dyn = 'HHIQQQIHHHHHH', 'IIQQQQQQ', 'qQ'
+        else:
+            ehdr, phdr, dyn = 'HHIIIIIHHHHHH', 'IIIIIIII', 'iI'
+
+        hdr = self._unpack(f, ehdr)
+        self.machine = hdr[1]
+        phoff, phentsize, phnum = hdr[4], hdr[8], hdr[9]
+
+        # Program headers as (type, offset, vaddr, filesz)
+        segments = []
+        for i in range(phnum):
+            f.seek(phoff + i * phentsize)
+            ph = self._unpack(f, phdr)
+            if self.elf_class == 64:
+                segments.append((ph[0], ph[2], ph[3], ph[5]))
+            else:
+                segments.append((ph[0], ph[1], ph[2], ph[4]))
+
+        dynamic = None
+        for p_type, offset, vaddr, filesz in segments:
+            if p_type == PT_INTERP:
+                f.seek(offset)
+                self.interp = self._cstr(f.read(filesz))
+            elif p_type == PT_DYNAMIC:
+                dynamic = (offset, filesz)
+
+        if dynamic is None:
+            # Statically linked
+            return
+
+        entries = []
+        size = struct.calcsize(self.byteorder + dyn)
+        f.seek(dynamic[0])
+        for _ in range(dynamic[1] // size):
+            tag, val = self._unpack(f, dyn)
+            if tag == DT_NULL:
+                break
+            entries.append((tag, val))
+
+        tags = dict(entries)
+        if DT_STRTAB not in tags:
+            raise ELFError("{}: no string table".format(self.path))
+
+        # DT_STRTAB is an address in memory; map it to a file offset
+        strtab = None
+        for p_type, offset, vaddr, filesz in segments:
+            if p_type == PT_LOAD and \
+               vaddr <= tags[DT_STRTAB] < vaddr + filesz:
+                strtab = tags[DT_STRTAB] - vaddr + offset
+        if strtab is None:
+            raise ELFError("{}: broken string table".format(self.path))
+        f.seek(strtab)
+        strings = f.read(tags.get(DT_STRSZ, 1 << 16))
+
+        for tag, val in entries:
+            if tag == DT_NEEDED:
+                self.needed.append(self._cstr(strings[val:]))
+            elif tag == DT_SONAME:
+                self.soname = self._cstr(strings[val:])
+            elif tag == DT_RPATH:
+                self.rpath += self._cstr(strings[val:]).split(':')
+            elif tag == DT_RUNPATH:
+                self.runpath += self._cstr(strings[val:]).split(':')
+
+    def _unpack(self, f, fmt):
+        fmt = self.byteorder + fmt
+        buf = f.read(struct.calcsize(fmt))
+        if len(buf) < struct.calcsize(fmt):
+            raise ELFError("{}: truncated ELF file".format(self.path))
+        return struct.unpack(fmt, buf)
+
+    @staticmethod
+    def _cstr(buf):
+        return buf.split(b'\0', 1)[0].decode('utf-8', 'replace')
+
+
+def read_elf(path):
+    """Parse `path`, or return None if it is not an ELF file.
+
+    The results are cached by the real path and the mtime of the file.
+    """
+    real = os.path.realpath(path)
+    try:
+        mtime = os.stat(real).st_mtime
+    except OSError:
+        return None
+
+    cached = _cache.get(real)
+    if cached is not None and cached[0] == mtime:
+        return cached[1]
+
+    try:
+        elf = ELFFile(real)
+    except (ELFError, IOError, OSError):
+        elf = None
+    _cache[real] = (mtime, elf)
+    return elf
+
+
+def _read_ld_so_conf(path, seen):
+    dirs = []
+    if path in seen:
+        return dirs
+    seen.add(path)
+    try:
+        with open(path) as f:
+            lines = f.readlines()
+    except (IOError, OSError):
+        return dirs
+
+    for line in lines:
+        line = line.split('#', 1)[0].strip()
+        if not line or line.startswith('hwcap '):
+            continue
+        if line.startswith('include '):
+            for pat in line.split()[1:]:
+                if not os.path.isabs(pat):
+                    pat = os.path.join(os.path.dirname(path), pat)
+                for conf in sorted(glob.glob(pat)):
+                    dirs += _read_ld_so_conf(conf, seen)
+        else:
+            dirs += [d for d in line.replace(',', ' ').split() if d]
+    return dirs
+
+
+def system_dirs():
+    """Directories searched after LD_LIBRARY_PATH and DT_RUNPATH."""
+    global _system_dirs
+    if _system_dirs is None:
+        dirs = _read_ld_so_conf(_ld_so_conf, set())
+        # Incompatible libraries (e.g. 32bit ones) are skipped while
+        # searching, so both lib and lib64 can be listed here.
+        dirs += ['/lib64', '/usr/lib64', '/lib', '/usr/lib']
+        _system_dirs = []
+        for d in dirs:
+            if d not in _system_dirs:
+                _system_dirs.append(d)
+    return _system_dirs
+
+
+def _expand(path, elf):
+    # Dynamic string tokens
+    origin = os.path.dirname(elf.path)
+    lib = 'lib64' if elf.elf_class == 64 else 'lib'
+    for token, value in [('ORIGIN', origin), ('LIB', lib),
+                         ('PLATFORM', platform.machine())]:
+        path = path.replace('${' + token + '}', value)
+        path = path.replace('$' + token, value)
+    return path
+
+
+def search_dirs(elf, loaders=(), ld_library_path=()):
+    """List the directories searched for the libraries `elf` needs.
+
+    `loaders` are the objects that caused `elf` to be loaded, from the
+    nearest one.
+    """
+    dirs = []
+    if not elf.runpath:
+        for obj in [elf] + list(loaders):
+            if obj.runpath:
+                break
+            dirs += [_expand(d, obj) for d in obj.rpath]
+    dirs += list(ld_library_path)
+    dirs += [_expand(d, elf) for d in elf.runpath]
+    dirs += system_dirs()
+    return [d for d in dirs if d]
+
+
+def find_library(name, elf, loaders=(), ld_library_path=()):
+    """Return the path the loader would load `name` from, or None."""
+    if '/' in name:
+        cands = [_expand(name, elf)]
+    else:
+        cands = [os.path.join(d, name)
+                 for d in search_dirs(elf, loaders, ld_library_path)]
+    for path in cands:
+        lib = read_elf(path)
+        if lib is not None and elf.compatible(lib):
+            return os.path.normpath(path)
+    return None
+
+
+def _stem(name):
+    # 'libmpi.so.40' -> 'libmpi'
+    return name.split('.so', 1)[0]
+
+
+def check(path, ld_library_path=()):
+    """Resolve all the libraries `path` depends on, like the loader.
+
+    Returns a dict with:
+      'libraries': {name: path} of the libraries that would be loaded,
+      'missing': [(name, needed_by)] of libraries not found,
+      'conflicts': [(name, loaded, wanted_by, wanted)] of libraries an
+        object would find elsewhere than the one already loaded, and of
+        different versions of a library loaded together
+        (e.g. libmpi.so.12 and libmpi.so.40).
+    """
+    root = read_elf(path)
+    if root is None:
+        raise ELFError("{}: not an ELF file".format(path))
+
+    libraries = {}
+    missing = []
+    conflicts = []
+    sonames = {}
+
+    if root.interp is not None and not os.path.exists(root.interp):
+        missing.append((root.interp, root.path))
+
+    # Breadth first, which is the order the loader loads libraries in.
+    queue = [(root, ())]
+    loaded = set([os.path.realpath(root.path)])
+    while queue:
+        elf, loaders = queue.pop(0)
+        for name in elf.needed:
+            found = find_library(name, elf, loaders, ld_library_path)
+            if name in libraries:
+                # The loader reuses the library loaded first
+                if found is not None and \
+                   os.path.realpath(found) != \
+                   os.path.realpath(libraries[name]):
+                    conflicts.append((name, libraries[name],
+                                      elf.path, found))
+                continue
+            if found is None:
+                missing.append((name, elf.path))
+                continue
+
+            libraries[name] = found
+            sonames.setdefault(_stem(name), set()).add(name)
+            real = os.path.realpath(found)
+            if real not in loaded:
+                loaded.add(real)
+                queue.append((read_elf(found), (elf,) + loaders))
+
+    for stem, names in sorted(sonames.items()):
+        names = sorted(names)
+        for other in names[1:]:
+            conflicts.append((names[0], libraries[names[0]],
+                              None, libraries[other]))
+
+    return {
+        'libraries': libraries,
+        'missing': missing,
+        'conflicts': conflicts,
+    }
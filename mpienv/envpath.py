@@ -0,0 +1,90 @@
+# coding: utf-8
+"""Normalization of search paths (PATH, LD_LIBRARY_PATH).
+
+Sourcing `init` in nested shells and job scripts, switching MPIs and
+loading modules leave search paths with duplicated entries, directories
+that no longer exist and the shims of other mpienv installations. The
+dynamic loader of every MPI process walks all of them, for every
+library, which is slow on NFS.
+
+normalize() keeps the first occurrence of each directory (compared by
+real path), drops the directories that do not exist and the shims of
+other versions directories, and puts given entries first. Empty entries
+are dropped as well: they stand for the current directory.
+"""
+
+import os
+import os.path
+import re
+
+_shims_re = re.compile(r'^(.*)/(shims|\.shims-[^/]+)/(bin|lib|lib64)/?$')
+
+
+def split(value):
+    return [p for p in (value or '').split(':') if p]
+
+
+def join(paths):
+    return ':'.join(paths)
+
+
+def versions_dir_of(path):
+    """The versions directory whose shims `path` is in, or None."""
+    m = _shims_re.match(path)
+    if m is None:
+        return None
+    vers_dir = m.group(1)
+    # A versions directory has the registry under mpi/
+    if os.path.isdir(os.path.join(vers_dir, 'mpi')):
+        return vers_dir
+    return None
+
+
+def normalize(paths, vers_dir, first=(), drop_missing=True):
+    """Return the normalized list of directories `first` + `paths`.
+
+    Shims of versions directories other than `vers_dir` are dropped.
+    """
+    own = os.path.realpath(vers_dir)
+    seen = set()
+    out = []
+    for p in list(first) + list(paths):
+        if not p:
+            continue
+        real = os.path.realpath(p)
+        if real in seen:
+            continue
+        seen.add(real)
+        if drop_missing and not os.path.isdir(p):
+            continue
+        other = versions_dir_of(os.path.normpath(p))
+        if other is not None and os.path.realpath(other) != own:
+            continue
+        out.append(p)
+    return out
+
+
+def shims_paths(shims_dir):
+    """Entries of the shims directory, by search path variable."""
+    return {
+        'PATH': [os.path.join(shims_dir, 'bin')],
+        'LD_LIBRARY_PATH': [os.path.join(shims_dir, 'lib'),
+                            os.path.join(shims_dir, 'lib64')],
+    }
+
+
+def normalize_environ(environ, vers_dir, first=None, drop_missing=True):
+    """Normalize PATH and LD_LIBRARY_PATH in the dict `environ`.
+
+    `first` gives the entries to put first, by variable. Returns the
+    normalized variables.
+    """
+    first = first or {}
+    changed = {}
+    for var in ['PATH', 'LD_LIBRARY_PATH']:
+        if var not in environ and var not in first:
+            continue
+        paths = normalize(split(environ.get(var)), vers_dir,
+                          first.get(var, ()), drop_missing)
+        changed[var] = environ[var] = join(paths)
+    return changed
@@ -0,0 +1,103 @@
+# coding: utf-8
+
+import glob
+import hashlib
+import os.path
+import platform
+import sys
+import sysconfig
+
+from mpienv.elf import read_elf
+from mpienv.profile import span
+
+
+def file_digest(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def find_libmpi(prefix):
+    """Find the shared libmpi library of an MPI installation.
+
+    Returns the real path of the library, or None if not found.
+    """
+    with span('find_libmpi', 'glob', prefix=prefix):
+        for libdir in ['lib', 'lib64']:
+            for pat in ['libmpi.so', 'libmpi.so.*', 'libmpi.dylib',
+                        'libmpi.*.dylib']:
+                found = sorted(glob.glob(os.path.join(prefix, libdir, pat)))
+                if found:
+                    return os.path.realpath(found[0])
+    return None
+
+
+def python_abi():
+    """Identify the ABI of the running Python interpreter."""
+    soabi = sysconfig.get_config_var('SOABI')
+    if soabi is None:
+        # Python 2 does not have SOABI
+        soabi = "cp{}{}-{}".format(sys.version_info[0], sys.version_info[1],
+                                   'ucs4' if sys.maxunicode > 0xffff
+                                   else 'ucs2')
+    return "{}-{}".format(soabi, platform.machine())
+
+
+def _digest(values):
+    h = hashlib.sha256()
+    for v in values:
+        h.update(v.encode('utf-8'))
+        h.update(b'\0')
+    return h.hexdigest()[:16]
+
+
+def libmpi_soname(libmpi):
+    """SONAME of the library `libmpi`, or its file name if it has none."""
+    elf = read_elf(libmpi)
+    if elf is not None and elf.soname:
+        return elf.soname
+    return os.path.basename(libmpi)
+
+
+def _installation_values(info):
+    libmpi = find_libmpi(info['prefix'])
+    return [info['type'],
+            info['version'],
+            libmpi_soname(libmpi) if libmpi else '',
+            file_digest(libmpi) if libmpi else '']
+
+
+def installation_stamp(info):
+    """Identify an installation by the stats of its mpiexec and libmpi.
+
+    Unlike installation_fingerprint(), nothing is read but the metadata
+    of the files, so it is cheap on a shared file system.
+    """
+    values = [info['type'], info['version']]
+    libmpi = find_libmpi(info['prefix'])
+    for path in [os.path.join(info['prefix'], 'bin', 'mpiexec'), libmpi]:
+        try:
+            st = os.stat(path)
+        except (OSError, TypeError):
+            values.append('')
+            continue
+        values.append("{}:{}:{}:{}".format(os.path.basename(path),
+                                           st.st_ino, st.st_size,
+                                           st.st_mtime))
+    return _digest(values)
+
+
+def installation_fingerprint(info):
+    """Compute a fingerprint of the binaries of an MPI installation."""
+    return _digest(_installation_values(info))
+
+
+def mpi_fingerprint(info):
+    """Compute a fingerprint of an MPI installation and the Python ABI.
+
+    Two installations with the same fingerprint are binary compatible
+    as far as compiled Python extensions (e.g. mpi4py) are concerned.
+    """
+    return _digest(_installation_values(info) + [python_abi()])
@@ -0,0 +1,211 @@
+# coding: utf-8
+"""Check that the hosts of a job have the same MPI installation.
+
+`mpiexec --prefix` (Open MPI) and the forwarded PATH/LD_LIBRARY_PATH
+assume that the installation exists at the same place on every host.
+check_hosts() compares the digests of its launcher and shared libraries
+on each host with the local ones.
+
+The check fans out in a tree: the local host contacts up to `fanout`
+hosts, each of which checks itself and contacts up to `fanout` others,
+and so on. Each node runs a POSIX shell script received on its standard
+input, which embeds the scripts of its subtree as here-documents, so
+nothing has to be installed on the hosts. A transport gives the command
+running a script on a host: ssh, or a local shell to test on a single
+machine.
+"""
+
+import glob
+import itertools
+import os
+import os.path
+
+from mpienv.fingerprint import file_digest
+from mpienv.proc import communicate
+
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+
+def read_hostfile(path):
+    """Return the host names in a hostfile, in order, without duplicates.
+
+    Open MPI ("node1 slots=4") and MPICH ("node1:4") formats are read.
+    """
+    hosts = []
+    with open(path) as f:
+        for line in f:
+            line = line.split('#', 1)[0].strip()
+            if not line:
+                continue
+            host = line.split()[0].split(':')[0]
+            if host not in hosts:
+                hosts.append(host)
+    return hosts
+
+
+class SSHTransport(object):
+    """Run the scripts on the hosts with ssh (or `ssh` command)."""
+
+    def __init__(self, ssh='ssh'):
+        self.ssh = ssh
+
+    def shell(self, host):
+        return "{} -o BatchMode=yes -o ConnectTimeout=10 {} sh -s".format(
+            self.ssh, quote(host))
+
+
+class LocalTransport(object):
+    """Run the scripts of all hosts on this machine.
+
+    `roots` maps some hosts to a directory where their file system is
+    seen to be, e.g. {'node2': '/tmp/node2'} to check /tmp/node2/<prefix>
+    for node2.
+    """
+
+    def __init__(self, roots=None):
+        self.roots = roots or {}
+
+    def shell(self, host):
+        return "MPIENV_HOST_ROOT={} sh -s".format(
+            quote(self.roots.get(host, '')))
+
+
+transports = {
+    'ssh': SSHTransport,
+    'local': LocalTransport,
+}
+
+
+def fingerprint_files(prefix):
+    """Files of an installation whose digests are compared.
+
+    They are bin/mpiexec and the shared libraries (not their symlinks),
+    relative to `prefix`.
+    """
+    files = ['bin/mpiexec']
+    for libdir in ['lib', 'lib64']:
+        for pat in ['lib*.so*', 'lib*.dylib']:
+            for path in sorted(glob.glob(os.path.join(prefix, libdir, pat))):
+                if os.path.isfile(path) and not os.path.islink(path):
+                    files.append(os.path.relpath(path, prefix))
+    return files
+
+
+def local_digests(prefix, files):
+    digests = {}
+    for f in files:
+        try:
+            digests[f] = file_digest(os.path.join(prefix, f))
+        except (IOError, OSError):
+            digests[f] = None
+    return digests
+
+
+def tree(hosts, fanout):
+    """Split `hosts` into at most `fanout` subtrees, as [(host, tree)]."""
+    fanout = max(1, fanout)
+    size, extra = divmod(len(hosts), fanout)
+    children = []
+    start = 0
+    for i in range(min(fanout, len(hosts))):
+        end = start + size + (1 if i < extra else 0)
+        group = hosts[start:end]
+        children.append((group[0], tree(group[1:], fanout)))
+        start = end
+    return children
+
+
+# check HOST PREFIX FILE... prints one line per file, with its digest,
+# or "-" if it is missing. MPIENV_HOST_ROOT is set by LocalTransport.
+_check = r"""check() {
+  host=$1; prefix=$2; shift 2
+  if ! cd "${MPIENV_HOST_ROOT:-}$prefix" 2>/dev/null; then
+    printf '%s\terror\t%s: no such directory\n' "$host" "$prefix"
+    return
+  fi
+  for f in "$@"; do
+    if [ -r "$f" ]; then
+      d=$( (sha256sum || shasum -a 256) <"$f" 2>/dev/null)
+      printf '%s\tfile\t%s\t%s\n' "$host" "$f" "${d%% *}"
+    else
+      printf '%s\tfile\t%s\t-\n' "$host" "$f"
+    fi
+  done
+}
+"""
+
+
+def script(children, prefix, files, transport, host=None, _ids=None):
+    """Shell script checking `host` and contacting its `children`."""
+    ids = _ids or itertools.count()
+    lines = [_check]
+    if host is not None:
+        lines.append("(check {} {} {})".format(
+            quote(host), quote(prefix), " ".join(quote(f) for f in files)))
+    for child, subtree in children:
+        # The here-document delimiter is unique in the whole tree
+        eof = "__mpienv_{}__".format(next(ids))
+        lines += [
+            "( {} <<'{}' || printf '%s\\terror\\tunreachable (exit %s)\\n' "
+            "{} $? ) &".format(transport.shell(child), eof, quote(child)),
+            script(subtree, prefix, files, transport, child,
+                   ids).rstrip('\n'),
+            eof,
+        ]
+    lines.append("wait")
+    return "\n".join(lines) + "\n"
+
+
+def parse(output):
+    """Return {host: {'files': {file: digest}, 'errors': [...]}}."""
+    results = {}
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) < 3:
+            continue
+        res = results.setdefault(fields[0], {'files': {}, 'errors': []})
+        if fields[1] == 'file' and len(fields) == 4:
+            res['files'][fields[2]] = None if fields[3] == '-' \
+                else fields[3]
+        elif fields[1] == 'error':
+            res['errors'].append(fields[2])
+    return results
+
+
+def check_hosts(hosts, prefix, transport, fanout=8, timeout=60):
+    """Compare the installation at `prefix` on `hosts` with the local one.
+
+    Returns {host: [problem, ...]}, with an empty list for the hosts
+    that have the same files.
+    """
+    files = fingerprint_files(prefix)
+    expected = local_digests(prefix, files)
+    text = script(tree(list(hosts), fanout), prefix, files, transport)
+    # The local host runs the root of the tree
+    _, out, _, expired = communicate(['sh', '-s'], timeout,
+                                     input=text.encode('utf-8'))
+    results = parse(out.decode('utf-8', 'replace'))
+
+    report = {}
+    for host in hosts:
+        res = results.get(host)
+        if res is None:
+            report[host] = ["no answer{}".format(
+                " (timed out)" if expired else "")]
+            continue
+        problems = list(res['errors'])
+        if not problems:
+            for f in files:
+                if f not in res['files']:
+                    problems.append("{}: no answer".format(f))
+                elif res['files'][f] == expected[f]:
+                    continue
+                elif res['files'][f] is None:
+                    problems.append("{}: missing".format(f))
+                else:
+                    problems.append("{}: differs".format(f))
+        report[host] = problems
+    return report
@@ -1,12 +1,21 @@
 # coding: utf-8
 
+import hashlib
 import json
 import os
 import os.path
 import re
 import shutil
-from subprocess import check_call
+from subprocess import CalledProcessError
+from subprocess import check_output
+from subprocess import PIPE
+from subprocess import Popen
+from subprocess import STDOUT
 import sys
+import time
+
+from mpienv.profile import command
+from mpienv.profile import span
 
 _ompi_url = ('https://www.open-mpi.org/software/ompi/'
              'v{}/downloads/openmpi-{}.tar.bz2')
@@ -61,11 +70,142 @@ _list = {
 }
 
 
+# Name of the per-installation build record, stored in the build directory
+_build_record = 'mpienv-build.json'
+
+# Number of past runs kept in a build record
+_max_runs = 20
+
+# Environment variables that affect the result of configure/make.
+# They are recorded in the phase stamps.
+_build_env_vars = [
+    'CC', 'CXX', 'FC', 'F77', 'CPP',
+    'CFLAGS', 'CXXFLAGS', 'FCFLAGS', 'FFLAGS', 'CPPFLAGS',
+    'LDFLAGS', 'LIBS',
+    'CPATH', 'LIBRARY_PATH', 'LD_LIBRARY_PATH', 'PKG_CONFIG_PATH',
+]
+
+# Compilers whose versions are recorded in the phase stamps:
+# (environment variable, default command)
+_build_compilers = [
+    ('CC', 'cc'),
+    ('CXX', 'c++'),
+    ('FC', 'gfortran'),
+]
+
+# Order of the stamped phases. A phase is re-run when any earlier phase
+# re-ran.
+_stamped_phases = ['extract', 'configure', 'build', 'install']
+
+
+def _max_rss_kb(ru):
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    if sys.platform == 'darwin':
+        return ru.ru_maxrss // 1024
+    return ru.ru_maxrss
+
+
+def _sha256(path):
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _compiler_version(cmd):
+    try:
+        with command([cmd, '--version']):
+            out = check_output([cmd, '--version'], stderr=STDOUT)
+    except (OSError, CalledProcessError):
+        return None
+    lines = out.decode('utf-8', 'replace').strip().split("\n")
+    return lines[0].strip()
+
+
+def _flatten(d, prefix=''):
+    flat = {}
+    for k, v in d.items():
+        if isinstance(v, dict):
+            flat.update(_flatten(v, prefix + k + '.'))
+        else:
+            flat[prefix + k] = v
+    return flat
+
+
+def _stamp_diff(old, new):
+    """Explain why the inputs `new` differ from the stamped inputs `old`."""
+    old = _flatten(old)
+    new = _flatten(new)
+    reasons = []
+    for key in sorted(set(old) | set(new)):
+        if old.get(key) == new.get(key):
+            continue
+        if key.startswith('after.'):
+            reasons.append("{} re-ran".format(key[len('after.'):]))
+        elif key == 'tarball':
+            reasons.append("the source tarball changed")
+        else:
+            reasons.append("{} changed: {!r} -> {!r}".format(
+                key, old.get(key), new.get(key)))
+    return reasons
+
+
+class _Phase(object):
+    """Timer and resource accounting of a single installer phase."""
+
+    def __init__(self, name):
+        self.name = name
+        self.seconds = 0.0
+        self.max_rss_kb = 0
+        self.output_bytes = 0
+        self.commands = 0
+        self.skipped = False
+        self.reasons = []
+
+    def add_child(self, ru, output_bytes):
+        self.commands += 1
+        self.max_rss_kb = max(self.max_rss_kb, _max_rss_kb(ru))
+        self.output_bytes += output_bytes
+
+    def to_dict(self):
+        return {
+            'phase': self.name,
+            'seconds': round(self.seconds, 3),
+            'max_rss_kb': self.max_rss_kb,
+            'output_bytes': self.output_bytes,
+            'commands': self.commands,
+            'skipped': self.skipped,
+            'reasons': self.reasons,
+        }
+
+
+def load_build_record(manager, name):
+    path = os.path.join(manager.build_dir(), name, _build_record)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        try:
+            return json.load(f)
+        except ValueError:
+            return None
+
+
+def list_build_records(manager):
+    build_dir = manager.build_dir()
+    if not os.path.isdir(build_dir):
+        return []
+    return sorted(n for n in os.listdir(build_dir)
+                  if os.path.exists(os.path.join(build_dir, n,
+                                                 _build_record)))
+
+
 class BaseInstaller(object):
     def __init__(self, manager, mpi, name, verbose):
         self.mpi = mpi
         self.manager = manager
         self.name = name
+        self.verbose = verbose
 
         self.url = _list[mpi]['url']
 
@@ -88,6 +228,172 @@ class BaseInstaller(object):
         if not os.path.exists(self.ext_path):
             os.makedirs(self.ext_path)
 
+        self.stamp_dir = os.path.join(self.ext_path, 'stamps')
+
+        self._phases = []
+        self._current = None
+        self._forced = {}
+
+    def _run_phase(self, name, func, *args):
+        phase = _Phase(name)
+        self._current = phase
+        start = time.time()
+        try:
+            with span(name, 'phase'):
+                func(*args)
+        finally:
+            phase.seconds = time.time() - start
+            self._current = None
+            self._phases.append(phase)
+        return phase
+
+    def _stamp_path(self, phase):
+        return os.path.join(self.stamp_dir, phase + '.json')
+
+    def _read_stamp(self, phase):
+        path = self._stamp_path(phase)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            try:
+                return json.load(f)
+            except ValueError:
+                return None
+
+    def _write_stamp(self, phase, inputs):
+        if not os.path.exists(self.stamp_dir):
+            os.makedirs(self.stamp_dir)
+        path = self._stamp_path(phase)
+        with open(path + '.tmp', 'w') as f:
+            json.dump({'inputs': inputs, 'time': time.time()}, f,
+                      indent=2, sort_keys=True)
+        os.rename(path + '.tmp', path)
+
+    def _remove_stamp(self, phase):
+        # The later phases are invalidated through their 'after' input
+        if os.path.exists(self._stamp_path(phase)):
+            os.remove(self._stamp_path(phase))
+
+    def _stamp_inputs(self, phase, inputs):
+        # A phase depends on the stamp of the phase before it, so that
+        # it is re-run whenever the previous phase re-ran.
+        idx = _stamped_phases.index(phase)
+        if idx > 0:
+            prev = _stamped_phases[idx - 1]
+            stamp = self._read_stamp(prev)
+            inputs = dict(inputs)
+            inputs['after'] = {prev: stamp['time'] if stamp else None}
+        return inputs
+
+    def _outdated(self, phase, inputs):
+        """Return the reasons why `phase` needs to be run."""
+        if phase in self._forced:
+            return [self._forced[phase]]
+        stamp = self._read_stamp(phase)
+        if stamp is None:
+            return ["no stamp from a previous run"]
+        return _stamp_diff(stamp['inputs'], inputs)
+
+    def _run_stamped(self, name, inputs, func, *args):
+        """Run a phase unless its stamped inputs are unchanged."""
+        inputs = self._stamp_inputs(name, inputs)
+        reasons = self._outdated(name, inputs)
+        if not reasons:
+            print("{}: up to date, skipping".format(name))
+            phase = _Phase(name)
+            phase.skipped = True
+            self._phases.append(phase)
+            return
+
+        print("{}: running because {}".format(name, '; '.join(reasons)))
+        self._remove_stamp(name)
+        phase = self._run_phase(name, func, *args)
+        phase.reasons = reasons
+        self._write_stamp(name, inputs)
+
+    def _build_inputs(self, conf_args):
+        """Inputs of the configure phase."""
+        env = {v: os.environ.get(v) for v in _build_env_vars}
+        compilers = {}
+        for var, default in _build_compilers:
+            cmd = os.environ.get(var) or default
+            compilers[cmd] = _compiler_version(cmd)
+
+        return {
+            'conf_args': conf_args,
+            'env': env,
+            'compilers': compilers,
+        }
+
+    def _check_call(self, cmd, cwd=None, stdout=None):
+        """Run `cmd` like check_call(), accounting it to the current phase.
+
+        The output of the command is passed through to our stdout and
+        its size is recorded. If `stdout` is given, the standard output
+        of the command is written there and only stderr is passed through.
+        """
+        with command(cmd):
+            if stdout is None:
+                p = Popen(cmd, cwd=cwd, stdout=PIPE, stderr=STDOUT)
+                pipe = p.stdout
+            else:
+                p = Popen(cmd, cwd=cwd, stdout=stdout, stderr=PIPE)
+                pipe = p.stderr
+
+            out = getattr(sys.stdout, 'buffer', sys.stdout)
+            read = getattr(pipe, 'read1', pipe.readline)
+            nbytes = 0
+            for chunk in iter(lambda: read(4096), b''):
+                nbytes += len(chunk)
+                out.write(chunk)
+                out.flush()
+            pipe.close()
+
+            # Reap the child ourselves to obtain its own resource usage
+            _, status, ru = os.wait4(p.pid, 0)
+            if os.WIFSIGNALED(status):
+                p.returncode = -os.WTERMSIG(status)
+            else:
+                p.returncode = os.WEXITSTATUS(status)
+
+            if self._current is not None:
+                self._current.add_child(ru, nbytes)
+
+        if p.returncode != 0:
+            raise CalledProcessError(p.returncode, cmd)
+
+    def _write_record(self, command, start):
+        path = os.path.join(self.ext_path, _build_record)
+        record = load_build_record(self.manager, self.name) or {}
+        record.update({
+            'name': self.name,
+            'mpi': self.mpi,
+            'url': self.url,
+            'prefix': self.prefix,
+        })
+        runs = record.get('runs', [])
+        runs.append({
+            'command': command,
+            'started': start,
+            'seconds': round(time.time() - start, 3),
+            'phases': [ph.to_dict() for ph in self._phases],
+        })
+        record['runs'] = runs[-_max_runs:]
+
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(record, f, indent=2, sort_keys=True)
+        os.rename(tmp, path)
+
+    def _record(self, command, func, *args):
+        self._phases = []
+        self._forced = {}
+        start = time.time()
+        try:
+            func(*args)
+        finally:
+            self._write_record(command, start)
+
     def clean(self):
         if os.path.exists(self.dir_path):
             print("Deleting the build directory...")
@@ -96,25 +402,56 @@ class BaseInstaller(object):
     def download(self):
         # TODO(keisukefukuda): check the checksum
         if not os.path.exists(self.local_file):
+            if not os.path.exists(self.manager.cache_dir()):
+                os.makedirs(self.manager.cache_dir())
             with open(self.local_file, 'w') as f:
-                check_call(['curl', self.url], stdout=f)
+                self._check_call(['curl', self.url], stdout=f)
+
+    def extract(self):
+        # Extract the archive files, replacing a stale source tree
+        if os.path.exists(self.dir_path):
+            shutil.rmtree(self.dir_path)
+        try:
+            self._check_call(['tar', '-xf', self.local_file],
+                             cwd=self.ext_path)
+        except BaseException:
+            # A tree without a stamp is taken as complete (see _configure)
+            if os.path.exists(self.dir_path):
+                shutil.rmtree(self.dir_path)
+            raise
 
     def configure(self):
-        # TODO(keisukefukuda): check configure options and
-        #                      re-run ./configure only when necessary
+        self._record('configure', self._configure)
+
+    def _configure(self):
         # TODO(keisukefukuda): Support multiple verbosity level
         #                      Level 0: silent
         #                      Level 1: only prints "Installing..."
         #                      Level 2: prints everything
-        self.download()
+        self._run_phase('download', self.download)
         print('Configuring in {}'.format(self.dir_path))
 
         print("ext_path={}".format(self.ext_path))
-        # Extract the archive files
+        inputs = {'tarball': _sha256(self.local_file)}
         if not os.path.exists(self.dir_path):
-            check_call(['tar', '-xf', self.local_file],
-                       cwd=self.ext_path)
+            self._forced['extract'] = "{} does not exist".format(
+                self.dir_path)
+        elif self._read_stamp('extract') is None:
+            # The tree was extracted before phases were stamped
+            print("extract: recording the stamp of {}".format(
+                self.dir_path))
+            self._write_stamp('extract', self._stamp_inputs('extract',
+                                                            inputs))
+        self._run_stamped('extract', inputs, self.extract)
+
+        conf_args = self._conf_args()
+        if conf_args == ['--help']:
+            self._run_phase('configure', self._run_configure, conf_args)
+        else:
+            self._run_stamped('configure', self._build_inputs(conf_args),
+                              self._run_configure, conf_args)
 
+    def _conf_args(self):
         opts = os.environ.get("MPIENV_CONFIGURE_OPTS")
         if opts:
             conf_args = opts.split()
@@ -145,45 +482,38 @@ class BaseInstaller(object):
             # if --help is not found
             conf_args += ['--prefix', self.prefix]
 
-        print(' '.join(['./configure'] + conf_args))
+        return conf_args
 
-        # Check cache
-        cache = os.path.join(self.dir_path, 'mpienv.conf')
-        if os.path.exists(cache):
-            with open(cache, 'r') as f:
-                try:
-                    loaded = json.load(f)
-                    cached = (loaded == conf_args)
-                    print("loaded = {}".format(loaded))
-                    print("conf_args = {}".format(conf_args))
-                except ValueError:
-                    cached = False
-        else:
-            cached = False
-        print("cached = {}".format(cached))
-
-        if cached is False:
-            # run configure scripts
-            assert(os.path.exists(self.dir_path))
-            print(' '.join(['./configure'] + conf_args))
-            check_call(['./configure'] + conf_args,
-                       cwd=self.dir_path)
-            with open(cache, 'w') as f:
-                json.dump(conf_args, f)
+    def _run_configure(self, conf_args):
+        # run configure scripts
+        assert(os.path.exists(self.dir_path))
+        print(' '.join(['./configure'] + conf_args))
+        self._check_call(['./configure'] + conf_args,
+                         cwd=self.dir_path)
 
     def build(self, npar=1):
-        self.configure()
+        self._record('build', self._build, npar)
+
+    def _build(self, npar):
+        self._configure()
         print('Building in {}'.format(self.dir_path))
-        # run make
-        print(' '.join(['make', '-j', str(npar)]))
-        check_call(['make', '-j', str(npar)],
-                   shell=True, cwd=self.dir_path)
+        self._run_stamped('build', {}, self._run_make,
+                          ['-j', str(npar)])
 
     def install(self, npar=1):
-        self.configure()
-        print(' '.join(['make', 'install', '-j', str(npar)]))
-        check_call(['make', 'install', '-j', str(npar)],
-                   cwd=self.dir_path)
+        self._record('install', self._install, npar)
+
+    def _install(self, npar):
+        self._build(npar)
+        if not os.path.exists(os.path.join(self.prefix, 'bin', 'mpiexec')):
+            self._forced['install'] = "{} is not installed".format(
+                self.prefix)
+        self._run_stamped('install', {'prefix': self.prefix},
+                          self._run_make, ['install', '-j', str(npar)])
+
+    def _run_make(self, args):
+        print(' '.join(['make'] + args))
+        self._check_call(['make'] + args, cwd=self.dir_path)
 
 
 class OmpiInstaller(BaseInstaller):
@@ -1,45 +1,268 @@
 # coding: utf-8
+"""Parsed output of `ompi_info --all --parsable`.
 
+The output has tens of thousands of lines like
+`mca:btl:tcp:param:btl_tcp_if_include:value:eth0`, so keys are kept as
+tuples of interned segments (`mca`, `btl`, `tcp`, ... are shared by all
+the lines and all the installations) and values are converted to
+bool, int or None where possible.
+
+Subtrees of keys (e.g. all the parameters of the tcp BTL) are queried
+through a tree of the key segments, which is built on the first query.
+
+Parsing a large output takes a noticeable time, so OmpiInfoCache keeps
+the parsed result on disk, in marshal format, per ompi_info command.
+"""
+
+from fnmatch import fnmatchcase
+import hashlib
+import marshal
+import os
+import os.path
 import re
+import sys
+
+try:
+    from sys import intern
+except ImportError:
+    intern = intern  # NOQA (a builtin on Python 2)
+
+_int_re = re.compile(r'^-?(0|[1-9][0-9]*)$')
+
+
+# The value of a key is stored under this key in the node of the tree
+_leaf = None
 
 
 class OmpiInfo(object):
-    def __init__(self):
-        self._dict = {}
+    __slots__ = ['_dict', '_tree']
 
-    def get(self, prop):
-        if prop not in self._dict:
-            return None
+    def __init__(self, items=None):
+        self._dict = dict(items or {})
+        self._tree = None
 
-        return self._dict[prop]
+    def get(self, prop):
+        return self._dict.get(_key(prop))
 
     def set(self, prop, value):
-        self._dict[prop] = value
+        self._dict[_key(prop)] = value
+        self._tree = None
+
+    def items(self):
+        """(key, value) pairs, where key is a tuple of segments."""
+        return self._dict.items()
+
+    def __len__(self):
+        return len(self._dict)
+
+    def _node(self, prefix):
+        if self._tree is None:
+            tree = {}
+            for key, val in self._dict.items():
+                node = tree
+                for seg in key:
+                    node = node.setdefault(seg, {})
+                node[_leaf] = val
+            self._tree = tree
+
+        node = self._tree
+        for seg in _key(prefix) if prefix else ():
+            node = node.get(seg)
+            if node is None:
+                return {}
+        return node
+
+    def children(self, prefix=()):
+        """Sorted segments following `prefix` in the keys."""
+        return sorted(k for k in self._node(prefix) if k is not _leaf)
+
+    def subtree(self, prefix=()):
+        """Sorted (key, value) pairs of the keys starting with `prefix`."""
+        prefix = _key(prefix) if prefix else ()
+        out = []
+        stack = [(prefix, self._node(prefix))]
+        while stack:
+            key, node = stack.pop()
+            for seg, child in node.items():
+                if seg is _leaf:
+                    out.append((key, child))
+                else:
+                    stack.append((key + (seg,), child))
+        return sorted(out)
+
+    def frameworks(self):
+        """Names of the MCA frameworks (btl, pml, ...)."""
+        return self.children('mca')
+
+    def components(self, framework):
+        """Names of the components of an MCA framework."""
+        return [c for c in self.children(('mca', framework)) if c != 'base']
+
+    def mca_params(self, pattern='*'):
+        """MCA parameters whose name matches the glob `pattern`.
+
+        Returns a sorted list of dicts with the framework, the component,
+        the name and the attributes of the parameters (value, source,
+        type, help, ...).
+        """
+        params = []
+        mca = self._node('mca')
+        for fw, fw_node in mca.items():
+            if fw is _leaf:
+                continue
+            for comp, comp_node in fw_node.items():
+                if comp is _leaf:
+                    continue
+                for name, node in comp_node.get('param', {}).items():
+                    if name is _leaf or not fnmatchcase(name, pattern):
+                        continue
+                    param = {'framework': fw, 'component': comp,
+                             'name': name}
+                    for attr, child in node.items():
+                        if attr is not _leaf and _leaf in child:
+                            param[attr] = child[_leaf]
+                    params.append(param)
+        return sorted(params, key=lambda p: p['name'])
+
+    def dumps(self):
+        return marshal.dumps(self._dict)
+
+    @classmethod
+    def loads(cls, data):
+        info = cls()
+        info._dict = marshal.loads(data)
+        return info
+
+
+def _key(prop):
+    if isinstance(prop, tuple):
+        return prop
+    return tuple(map(intern, prop.split(':')))
+
+
+_constants = {
+    'true': True, 'yes': True,
+    'false': False, 'no': False,
+    'none': None, '': None,
+}
 
 
 def _parse_single_val(val):
-    if val in ['true', 'yes']:
-        val = True
-    if val in ['false', 'no']:
-        val = False
-    if val in ['none']:
-        val = None
+    if val in _constants:
+        return _constants[val]
+    if val[-1] in '0123456789' and _int_re.match(val):
+        return int(val)
 
-    return val
+    return intern(val) if len(val) < 32 else val
 
 
 def parse_ompi_info(out):
     info = OmpiInfo()
-    lines = out.split("\n")
+    d = info._dict
 
-    for line in lines:
+    for line in out.split("\n"):
         line = line.strip()
         if len(line) == 0:
             continue
-        m = re.search(r'^(.*):([^:]+)?$', line)
 
-        key, val = m.group(1), _parse_single_val(m.group(2))
+        if line.endswith('"') and ':"' in line:
+            # A quoted value, which may contain colons
+            i = line.index(':"')
+            key, val = line[:i], line[i + 2:-1]
+        else:
+            key, sep, val = line.rpartition(':')
+            if not sep:
+                continue
+            val = _parse_single_val(val)
 
-        info.set(key, val)
+        d[tuple(map(intern, key.split(':')))] = val
 
     return info
+
+
+# Bumped when the cached data is not compatible with the current code
+_cache_version = 2
+
+
+def _real_path(ompi_info):
+    # The same installation is reached through versions/mpi/<name>, but
+    # ompi_info itself may be a symlink out of the installation.
+    return os.path.join(os.path.realpath(os.path.dirname(ompi_info)),
+                        os.path.basename(ompi_info))
+
+
+def _param_files(prefix):
+    # Files of MCA parameters read by ompi_info, in addition to the
+    # ones named in OMPI_MCA_mca_base_param_files
+    files = [os.path.join(prefix, 'etc', 'openmpi-mca-params.conf'),
+             os.path.expanduser(os.path.join('~', '.openmpi',
+                                             'mca-params.conf'))]
+    extra = os.environ.get('OMPI_MCA_mca_base_param_files')
+    if extra:
+        files += [f for f in extra.split(':') if f]
+    return files
+
+
+def _mca_environ_digest():
+    h = hashlib.sha1()
+    for k, v in sorted(os.environ.items()):
+        if k.startswith('OMPI_MCA_'):
+            h.update("{}={}\0".format(k, v).encode('utf-8'))
+    return h.hexdigest()
+
+
+class OmpiInfoCache(object):
+    """Parsed ompi_info outputs saved in `cache_dir`.
+
+    An entry is valid as long as the ompi_info command, the component
+    directory (lib/openmpi) of the installation, the files of MCA
+    parameters and the OMPI_MCA_* environment variables do not change:
+    the values of the parameters and their sources depend on them.
+    """
+
+    def __init__(self, cache_dir):
+        self._cache_dir = cache_dir
+
+    def path(self, ompi_info):
+        h = hashlib.sha1(_real_path(ompi_info).encode('utf-8'))
+        return os.path.join(self._cache_dir,
+                            h.hexdigest()[:16] + '.marshal')
+
+    @staticmethod
+    def stamp(ompi_info):
+        prefix = os.path.dirname(os.path.dirname(ompi_info))
+        stamp = []
+        for f in [ompi_info, os.path.join(prefix, 'lib', 'openmpi')] + \
+                _param_files(prefix):
+            try:
+                st = os.stat(f)
+                stamp.append((st.st_ino, st.st_size, st.st_mtime))
+            except OSError:
+                stamp.append(None)
+        stamp.append(_mca_environ_digest())
+        return tuple(stamp)
+
+    def _header(self, ompi_info):
+        return (_cache_version, tuple(sys.version_info[:2]),
+                _real_path(ompi_info), self.stamp(ompi_info))
+
+    def load(self, ompi_info):
+        """Return the cached OmpiInfo of `ompi_info`, or None."""
+        try:
+            with open(self.path(ompi_info), 'rb') as f:
+                header = marshal.load(f)
+                if header != self._header(ompi_info):
+                    return None
+                return OmpiInfo.loads(f.read())
+        except (IOError, OSError, EOFError, ValueError, TypeError):
+            return None
+
+    def save(self, ompi_info, info):
+        path = self.path(ompi_info)
+        if not os.path.exists(self._cache_dir):
+            os.makedirs(self._cache_dir)
+        tmp = "{}.{}".format(path, os.getpid())
+        with open(tmp, 'wb') as f:
+            marshal.dump(self._header(ompi_info), f)
+            f.write(info.dumps())
+        os.rename(tmp, path)
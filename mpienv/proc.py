@@ -0,0 +1,48 @@
+# coding: utf-8
+"""Subprocesses with a time limit."""
+
+import os
+import signal
+import subprocess
+import sys
+import threading
+
+from mpienv.profile import command
+
+
+def communicate(cmd, timeout, input=None, stdin=None):
+    """Run `cmd` and return (returncode, stdout, stderr, expired).
+
+    The command runs in its own session. After `timeout` seconds (if
+    positive), it is killed with all the processes it started, and
+    `expired` is True. Python 2's Popen has no timeout.
+    """
+    if sys.version_info >= (3, 2):
+        kwargs = {'start_new_session': True}
+    else:
+        kwargs = {'preexec_fn': os.setsid}
+    if input is not None:
+        stdin = subprocess.PIPE
+    expired = []
+
+    def kill():
+        expired.append(True)
+        try:
+            os.killpg(p.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    with command(cmd):
+        p = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE,
+                             stderr=subprocess.PIPE, **kwargs)
+        timer = None
+        if timeout > 0:
+            timer = threading.Timer(timeout, kill)
+            timer.daemon = True
+            timer.start()
+        try:
+            out, err = p.communicate(input)
+        finally:
+            if timer is not None:
+                timer.cancel()
+    return p.returncode, out, err, bool(expired)
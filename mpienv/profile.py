@@ -0,0 +1,142 @@
+# coding: utf-8
+"""Tracing of where the time of a command goes.
+
+Set MPIENV_PROFILE=path to record spans of subprocesses, probes, globs,
+symlink operations and the phases of a command. At exit, they are
+written to `path` in the Chrome trace event format (chrome://tracing,
+Perfetto) and summarized in `path`.txt. If `path` is a directory, the
+files are named after the command and the process ID.
+
+When MPIENV_PROFILE is not set, span() returns a shared no-op object.
+"""
+
+import atexit
+import os
+import os.path
+import sys
+import time
+
+from mpienv.debug import spawned
+
+_path = os.environ.get('MPIENV_PROFILE')
+enabled = bool(_path)
+
+_clock = getattr(time, 'perf_counter', time.time)
+_start = _clock()
+_events = []
+
+
+class _NullSpan(object):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_null_span = _NullSpan()
+
+
+class _Span(object):
+    __slots__ = ['name', 'cat', 'args', 'begin']
+
+    def __init__(self, name, cat, args):
+        self.name = name
+        self.cat = cat
+        self.args = args
+
+    def __enter__(self):
+        self.begin = _clock()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        import threading
+        end = _clock()
+        if exc_type is not None:
+            self.args['error'] = exc_type.__name__
+        _events.append({
+            'name': self.name,
+            'cat': self.cat,
+            'ph': 'X',
+            'ts': (self.begin - _start) * 1e6,
+            'dur': (end - self.begin) * 1e6,
+            'pid': os.getpid(),
+            'tid': threading.current_thread().ident,
+            'args': self.args,
+        })
+        return False
+
+
+def span(name, cat='phase', **args):
+    """Return a context manager recording a span of `name`."""
+    if not enabled:
+        return _null_span
+    return _Span(name, cat, args)
+
+
+def command(cmd):
+    """Account a subprocess running `cmd` until the block exits."""
+    spawned(cmd)
+    if not enabled:
+        return _null_span
+    return _Span(os.path.basename(cmd[0]), 'subprocess',
+                 {'cmd': ' '.join(cmd)})
+
+
+def _command_name():
+    script = os.path.splitext(os.path.basename(sys.argv[0] or 'python'))[0]
+    return script or 'python'
+
+
+def summary(events, total):
+    """Summarize `events` as text lines, by category and name."""
+    groups = {}
+    for e in events:
+        g = groups.setdefault((e['cat'], e['name']), [0, 0.0, 0.0])
+        g[0] += 1
+        g[1] += e['dur'] / 1e3
+        g[2] = max(g[2], e['dur'] / 1e3)
+
+    lines = ["mpienv {} (pid {}): {:.1f} ms in total".format(
+        ' '.join([_command_name()] + sys.argv[1:]), os.getpid(),
+        total * 1e3), "(times include nested spans)", ""]
+    lines.append("{:<11} {:<24} {:>6} {:>11} {:>10}".format(
+        'category', 'name', 'count', 'total(ms)', 'max(ms)'))
+    for (cat, name), (n, tot, mx) in sorted(groups.items(),
+                                            key=lambda x: -x[1][1]):
+        lines.append("{:<11} {:<24} {:>6} {:>11.1f} {:>10.1f}".format(
+            cat, name, n, tot, mx))
+    return lines
+
+
+def write(path):
+    import json
+
+    total = _clock() - _start
+    events = list(_events)
+    command_event = {
+        'name': _command_name(), 'cat': 'command', 'ph': 'X',
+        'ts': 0, 'dur': total * 1e6, 'pid': os.getpid(), 'tid': 0,
+        'args': {'argv': sys.argv},
+    }
+
+    if os.path.isdir(path):
+        path = os.path.join(path, 'mpienv-{}-{}.json'.format(
+            _command_name(), os.getpid()))
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': [command_event] + events,
+                   'displayTimeUnit': 'ms'}, f)
+    with open(path + '.txt', 'w') as f:
+        f.write("\n".join(summary(events, total)) + "\n")
+
+
+def _write_at_exit():
+    try:
+        write(_path)
+    except (IOError, OSError) as e:
+        sys.stderr.write("mpienv: cannot write profile to {}: {}\n".format(
+            _path, e))
+
+
+if enabled:
+    atexit.register(_write_at_exit)
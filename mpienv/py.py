@@ -5,8 +5,13 @@ import errno
 import glob
 import os
 import os.path
+import shutil
 from subprocess import check_call
 import sys
+import tempfile
+
+from mpienv.fingerprint import mpi_fingerprint
+from mpienv.profile import command
 
 
 def mkdir_p(path):
@@ -29,16 +34,20 @@ class PyModule(object):
         self._pylib_dir = os.path.join(manager.pylib_dir(), name)
         self._name = name
 
-        if not os.path.exists(self._pylib_dir):
-            mkdir_p(self._pylib_dir)
-
     def is_installed(self):
         libs = glob.glob(os.path.join(self._pylib_dir, self._libname, '*.so'))
         return len(libs) > 0
 
-    def install(self):
-        PATH = os.path.join(self._mpi_dir, 'bin')
-        LD = os.path.join(self._mpi_dir, 'lib')
+    def wheel_dir(self):
+        """Directory of the cached wheels built against this MPI."""
+        info = self._manager.get_info(self._name)
+        return os.path.join(self._manager.cache_dir(), 'wheels',
+                            self._libname, mpi_fingerprint(info))
+
+    def _env(self):
+        prefix = os.path.join(self._mpi_dir, self._name)
+        PATH = os.path.join(prefix, 'bin')
+        LD = os.path.join(prefix, 'lib')
 
         env = os.environ.copy()
         env['PATH'] = "{}:{}".format(PATH, env['PATH'])
@@ -49,13 +58,54 @@ class PyModule(object):
         else:
             env['LD_LIBRARY_PATH'] = "{}".format(LD)
 
+        return env
+
+    def build_wheel(self, stdout=None, stderr=None):
+        """Build a wheel of the module into the wheel cache, if missing."""
+        wheel_dir = self.wheel_dir()
+        if glob.glob(os.path.join(wheel_dir, '*.whl')):
+            return wheel_dir
+
+        parent = os.path.dirname(wheel_dir)
+        mkdir_p(parent)
+        tmp_dir = tempfile.mkdtemp(dir=parent)
+        try:
+            # Always compile against this MPI, not a wheel cached by pip
+            cmd = [sys.executable, '-m', 'pip', 'wheel', '--no-deps',
+                   '--no-cache-dir', '-w', tmp_dir, self._libname]
+            with command(cmd):
+                check_call(cmd, stdout=stdout, stderr=stderr,
+                           env=self._env())
+            try:
+                os.rename(tmp_dir, wheel_dir)
+            except OSError:
+                # Another process has built the same wheel meanwhile
+                if not glob.glob(os.path.join(wheel_dir, '*.whl')):
+                    raise
+        finally:
+            if os.path.exists(tmp_dir):
+                shutil.rmtree(tmp_dir)
+
+        return wheel_dir
+
+    def install(self, log=None):
+        """Install the module into the pylib directory.
+
+        If `log` is given, both stdout and stderr of pip are written to it.
+        """
         if False:
             sys.stderr.write("Installing {} for {} ...\n".format(self._libname,
                                                                  self._name))
+        mkdir_p(self._pylib_dir)
         with open(os.devnull, 'w') as devnull:
-            check_call(['pip', 'install', '-t', self._pylib_dir,
-                        '--no-cache-dir', self._libname],
-                       stdout=devnull, env=env)
+            stdout = log or devnull
+            wheel_dir = self.build_wheel(stdout=stdout, stderr=log)
+            # Installing from the wheel cache only unpacks the wheel
+            cmd = [sys.executable, '-m', 'pip', 'install', '-t',
+                   self._pylib_dir, '--no-index', '--no-deps',
+                   '--find-links', wheel_dir, self._libname]
+            with command(cmd):
+                check_call(cmd, stdout=stdout, stderr=log, env=self._env())
 
     def use(self):
         pypath = os.environ.get('PYTHONPATH', None)
@@ -0,0 +1,323 @@
+# coding: utf-8
+
+import contextlib
+import errno
+import fcntl
+import os
+import os.path
+import time
+
+from mpienv.profile import span
+
+# Number of attempts of a lock-free snapshot before falling back to
+# taking the registry lock.
+_snapshot_retries = 50
+
+# Format version of versions/registry.json
+_records_version = 1
+
+
+class RegistryError(RuntimeError):
+    pass
+
+
+def _remove_path(path):
+    if os.path.islink(path) or not os.path.isdir(path):
+        with span('unlink', 'symlink', path=path):
+            os.remove(path)
+    else:
+        import shutil  # only needed by writers
+        with span('rmtree', 'remove', path=path):
+            shutil.rmtree(path)
+
+
+class Registry(object):
+    """The on-disk registry of MPI installations under `versions/`.
+
+    Mutations take an exclusive lock on `versions/.lock` and bump a
+    generation counter around the change (like a seqlock): the counter
+    is odd while a mutation is in progress. Readers never take the lock;
+    they read the counter before and after listing the registry and
+    retry if it changed.
+
+    Every single change to `versions/mpi` and `versions/shims` is an
+    atomic rename, symlink creation or unlink, so that the registry is
+    consistent even on a filesystem shared by many nodes.
+
+    Metadata of the installations (probe results and the time they were
+    added) is kept in `versions/registry.json`, which is replaced as a
+    whole under the lock and read with a single read.
+    """
+
+    def __init__(self, vers_dir):
+        self._vers_dir = vers_dir
+        self._mpi_dir = os.path.join(vers_dir, 'mpi')
+        self._shims_dir = os.path.join(vers_dir, 'shims')
+        self._lock_file = os.path.join(vers_dir, '.lock')
+        self._gen_file = os.path.join(vers_dir, '.generation')
+        self._records_file = os.path.join(vers_dir, 'registry.json')
+        self._lock_fd = None
+        self._lock_depth = 0
+
+    def _tmp_path(self, base):
+        # Temporary names start with '.' and are ignored by readers
+        return os.path.join(os.path.dirname(base), '.{}.{}.{}'.format(
+            os.path.basename(base), os.uname()[1], os.getpid()))
+
+    def generation(self):
+        try:
+            with open(self._gen_file) as f:
+                return int(f.read().strip() or 0)
+        except (IOError, OSError, ValueError):
+            return 0
+
+    def _set_generation(self, gen):
+        tmp = self._tmp_path(self._gen_file)
+        with open(tmp, 'w') as f:
+            f.write(str(gen))
+        os.rename(tmp, self._gen_file)
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Take the registry lock. The lock is reentrant in a process."""
+        if self._lock_depth == 0:
+            try:
+                os.makedirs(self._mpi_dir)
+            except OSError as e:
+                # Another process may have created it in the meantime
+                if e.errno != errno.EEXIST:
+                    raise
+            fd = os.open(self._lock_file, os.O_RDWR | os.O_CREAT, 0o644)
+            # POSIX record locks also work on NFS
+            fcntl.lockf(fd, fcntl.LOCK_EX)
+            self._lock_fd = fd
+        self._lock_depth += 1
+        try:
+            yield
+        finally:
+            self._lock_depth -= 1
+            if self._lock_depth == 0:
+                fcntl.lockf(self._lock_fd, fcntl.LOCK_UN)
+                os.close(self._lock_fd)
+                self._lock_fd = None
+
+    @contextlib.contextmanager
+    def transaction(self):
+        """Lock the registry and mark a mutation in progress."""
+        with self.lock():
+            gen = self.generation()
+            if gen % 2 == 1:
+                # A previous writer died in the middle of a transaction.
+                gen += 1
+            self._set_generation(gen + 1)
+            try:
+                yield
+            finally:
+                self._set_generation(gen + 2)
+
+    def _list(self):
+        try:
+            names = os.listdir(self._mpi_dir)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+
+        entries = {}
+        for name in names:
+            if name.startswith('.'):
+                continue
+            path = os.path.join(self._mpi_dir, name)
+            try:
+                entries[name] = os.readlink(path)
+            except OSError as e:
+                if e.errno == errno.EINVAL:
+                    # Not a symlink: installed by `mpienv install`
+                    entries[name] = path
+                elif e.errno != errno.ENOENT:
+                    raise
+        return entries
+
+    def snapshot(self):
+        """Return a consistent {name: target} map without locking."""
+        with span('snapshot', 'symlink'):
+            return self._snapshot()
+
+    def _snapshot(self):
+        for _ in range(_snapshot_retries):
+            gen1 = self.generation()
+            if gen1 % 2 == 0:
+                entries = self._list()
+                if self.generation() == gen1:
+                    return entries
+            time.sleep(0.001)
+
+        # A writer is slow or died in the middle of a transaction.
+        with self.lock():
+            return self._list()
+
+    def path(self, name):
+        return os.path.join(self._mpi_dir, name)
+
+    def records(self):
+        """Return the metadata records as {name: record}.
+
+        Records of an unknown format version are ignored, as if the
+        registry had only symlinks (they are recreated on demand).
+        """
+        try:
+            with open(self._records_file) as f:
+                data = f.read()
+        except (IOError, OSError) as e:
+            if e.errno == errno.ENOENT:
+                return {}
+            raise
+
+        import json
+        try:
+            data = json.loads(data)
+        except ValueError:
+            return {}
+        if not isinstance(data, dict) or \
+           data.get('version') != _records_version:
+            return {}
+        return data.get('mpi', {})
+
+    def _write_records(self, records):
+        import json
+        tmp = self._tmp_path(self._records_file)
+        with open(tmp, 'w') as f:
+            json.dump({'version': _records_version, 'mpi': records}, f,
+                      indent=1, sort_keys=True)
+        os.rename(tmp, self._records_file)
+
+    def update_records(self, changes):
+        """Store records, given as {name: record}.
+
+        A record of None removes it. Records of names that are no longer
+        registered are dropped.
+        """
+        with self.lock():
+            records = self.records()
+            for name, record in changes.items():
+                if record is None:
+                    records.pop(name, None)
+                else:
+                    records[name] = record
+            names = self._list()
+            self._write_records({n: r for n, r in records.items()
+                                 if n in names})
+
+    def _link(self, name, target):
+        try:
+            with span('symlink', 'symlink', path=self.path(name)):
+                os.symlink(target, self.path(name))
+        except OSError as e:
+            if e.errno == errno.EEXIST:
+                raise RegistryError("Name '{}' already exists".format(name))
+            raise
+
+    def link(self, name, target, record=None):
+        """Register `target` as `name`, with its metadata `record`."""
+        with self.transaction():
+            self._link(name, target)
+            if record is not None:
+                self.update_records({name: record})
+
+    def link_many(self, entries):
+        """Register all of `entries`, given as [(name, target, record)].
+
+        Either all the entries are registered, or none of them is.
+        """
+        with self.transaction():
+            done = []
+            try:
+                for name, target, _ in entries:
+                    self._link(name, target)
+                    done.append(name)
+            except BaseException:
+                for name in done:
+                    os.unlink(self.path(name))
+                raise
+            self.update_records({name: record
+                                 for name, _, record in entries
+                                 if record is not None})
+
+    def remove(self, name):
+        with self.transaction():
+            path = self.path(name)
+            if not os.path.lexists(path):
+                raise RegistryError("No such MPI: '{}'".format(name))
+            # Hide the entry atomically before removing its contents
+            tmp = self._tmp_path(path)
+            os.rename(path, tmp)
+            if os.path.exists(self._records_file):
+                self.update_records({name: None})
+            _remove_path(tmp)
+
+    def rename(self, name_from, name_to):
+        with self.transaction():
+            path_from = self.path(name_from)
+            path_to = self.path(name_to)
+            if not os.path.lexists(path_from):
+                raise RegistryError("No such MPI: '{}'".format(name_from))
+            if os.path.lexists(path_to):
+                raise RegistryError("Name '{}' already "
+                                    "exists".format(name_to))
+            os.rename(path_from, path_to)
+            record = self.records().get(name_from)
+            if record is not None:
+                self.update_records({name_to: record})
+
+    def shims_dir(self):
+        return self._shims_dir
+
+    def replace_shims(self, build):
+        """Atomically replace the shims directory.
+
+        `build(path)` populates a new shims directory at `path`. The new
+        directory is then swapped in by renaming a symlink over
+        `versions/shims`, so that readers see either the old or the new
+        shims, never a partial one.
+        """
+        tag = '{}-{}-{}'.format(os.uname()[1], os.getpid(),
+                                int(time.time() * 1e6))
+        build_dir = os.path.join(self._vers_dir, '.build-shims-' + tag)
+        new_dir = os.path.join(self._vers_dir, '.shims-' + tag)
+        if not os.path.exists(self._vers_dir):
+            os.makedirs(self._vers_dir)
+        os.mkdir(build_dir)
+        try:
+            build(build_dir)
+        except Exception:
+            _remove_path(build_dir)
+            raise
+
+        with self.transaction():
+            old_dir = None
+            if os.path.islink(self._shims_dir):
+                old_dir = os.path.join(self._vers_dir,
+                                       os.readlink(self._shims_dir))
+            elif os.path.exists(self._shims_dir):
+                # Migrate a plain shims directory of older versions
+                old_dir = os.path.join(self._vers_dir, '.shims-legacy-' + tag)
+                os.rename(self._shims_dir, old_dir)
+
+            os.rename(build_dir, new_dir)
+            tmp = self._tmp_path(self._shims_dir)
+            with span('symlink', 'symlink', path=self._shims_dir):
+                os.symlink(os.path.basename(new_dir), tmp)
+                os.rename(tmp, self._shims_dir)
+
+            self._collect_shims([new_dir, old_dir])
+
+    def _collect_shims(self, keep):
+        # Keep the previous shims for processes still resolving them,
+        # and remove the older ones and builds abandoned long ago.
+        for name in os.listdir(self._vers_dir):
+            path = os.path.join(self._vers_dir, name)
+            if name.startswith('.shims-') and path not in keep:
+                _remove_path(path)
+            elif (name.startswith('.build-shims-') and
+                  os.path.getmtime(path) < time.time() - 3600):
+                _remove_path(path)
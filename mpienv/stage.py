@@ -0,0 +1,175 @@
+# coding: utf-8
+
+import errno
+import fcntl
+import json
+import os
+import os.path
+import shutil
+from subprocess import check_call
+import time
+
+from mpienv.fingerprint import installation_stamp
+from mpienv.profile import command
+
+# Marker written into a staged copy when it is complete
+_marker = '.mpienv-staged'
+
+# Directories of an installation needed at runtime. `include`, manuals
+# and documents are not staged.
+_runtime_dirs = ['bin', 'lib', 'lib64', 'libexec', 'etc',
+                 os.path.join('share', 'openmpi'),
+                 os.path.join('share', 'mpich')]
+
+# Shared prefixes which contain much more than the MPI itself
+_system_prefixes = ['/', '/usr', '/usr/local', '/opt/local']
+
+modes = ['copy', 'hardlink', 'reflink']
+
+
+class StageError(RuntimeError):
+    pass
+
+
+def _copy(src, dst):
+    shutil.copy2(src, dst)
+
+
+def _hardlink(src, dst):
+    try:
+        os.link(src, dst)
+    except OSError as e:
+        if e.errno not in (errno.EXDEV, errno.EPERM, errno.EMLINK):
+            raise
+        # Hard links do not work across filesystems
+        shutil.copy2(src, dst)
+
+
+def _reflink(src, dst):
+    cmd = ['cp', '--reflink=always', '-p', src, dst]
+    with command(cmd):
+        check_call(cmd)
+
+
+_file_ops = {
+    'copy': _copy,
+    'hardlink': _hardlink,
+    'reflink': _reflink,
+}
+
+
+def _is_staged(prefix, path):
+    # Whether `path` is under one of the staged directories of `prefix`
+    rel = os.path.relpath(path, prefix)
+    return any(rel == d or rel.startswith(d + os.sep)
+               for d in _runtime_dirs)
+
+
+def _link_target(link, prefix):
+    """Target of the copy of the symlink `link` of the installation.
+
+    Relative links (e.g. libmpi.so -> libmpi.so.40) are kept as they are.
+    Absolute links into the staged files of the installation, common in
+    Spack and EasyBuild trees, are made relative so that the staged copy
+    does not load from the original prefix.
+    """
+    target = os.readlink(link)
+    if not os.path.isabs(target):
+        return target
+    for path in [os.path.normpath(target), os.path.realpath(target)]:
+        if _is_staged(prefix, path):
+            return os.path.relpath(path, os.path.dirname(link))
+    return target
+
+
+def _copy_tree(src, dst, file_op, prefix):
+    os.makedirs(dst)
+    for name in os.listdir(src):
+        s = os.path.join(src, name)
+        d = os.path.join(dst, name)
+        if os.path.islink(s):
+            os.symlink(_link_target(s, prefix), d)
+        elif os.path.isdir(s):
+            _copy_tree(s, d, file_op, prefix)
+        else:
+            file_op(s, d)
+    shutil.copystat(src, dst)
+
+
+def stage_path(stage_dir, name, info):
+    # `mpienv exec` looks for the copy at every launch: hashing libmpi
+    # would read it from the shared file system each time.
+    return os.path.join(stage_dir, "{}-{}".format(
+        name, installation_stamp(info)))
+
+
+def read_marker(path):
+    try:
+        with open(os.path.join(path, _marker)) as f:
+            return json.load(f)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def staged_prefix(stage_dir, name, info):
+    """Return the completely staged copy of an installation, or None."""
+    path = stage_path(stage_dir, name, info)
+    if read_marker(path) is None:
+        return None
+    return path
+
+
+def stage(stage_dir, name, info, mode='copy'):
+    """Copy the runtime files of an installation to `stage_dir`.
+
+    The copy is made once: concurrent calls (e.g. from all the ranks on
+    a node) wait for the first one, and a complete copy is reused.
+    Returns the path of the staged copy.
+    """
+    prefix = os.path.realpath(info['prefix'])
+    if prefix in _system_prefixes:
+        raise StageError("Cannot stage '{}': it is installed in the "
+                         "system prefix {}".format(name, prefix))
+
+    dst = stage_path(stage_dir, name, info)
+    if not os.path.exists(stage_dir):
+        try:
+            os.makedirs(stage_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    fd = os.open(dst + '.lock', os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.lockf(fd, fcntl.LOCK_EX)
+        if read_marker(dst) is not None:
+            return dst
+
+        if os.path.exists(dst):
+            # An incomplete copy from an interrupted run
+            shutil.rmtree(dst)
+
+        tmp = "{}.tmp.{}".format(dst, os.getpid())
+        os.makedirs(tmp)
+        try:
+            for d in _runtime_dirs:
+                if os.path.isdir(os.path.join(prefix, d)):
+                    _copy_tree(os.path.join(prefix, d),
+                               os.path.join(tmp, d), _file_ops[mode], prefix)
+
+            with open(os.path.join(tmp, _marker), 'w') as f:
+                json.dump({
+                    'name': name,
+                    'prefix': prefix,
+                    'mode': mode,
+                    'time': time.time(),
+                }, f)
+            os.rename(tmp, dst)
+        except Exception:
+            shutil.rmtree(tmp)
+            raise
+    finally:
+        fcntl.lockf(fd, fcntl.LOCK_UN)
+        os.close(fd)
+
+    return dst
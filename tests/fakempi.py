@@ -0,0 +1,277 @@
+# coding: utf-8
+"""Generate stub MPI installations for tests and benchmarks.
+
+A stub prefix has the layout of a real Open MPI, MPICH or MVAPICH
+installation: `mpiexec --version` and `ompi_info --all --parsable` are
+shell scripts printing what the real commands print, `mpi.h` has the
+version defines, and the shared libraries are minimal ELF files with
+the right sonames and dependencies. Nothing in them runs an MPI job.
+
+    from fakempi import make_mpi
+    make_mpi('/tmp/x/openmpi-2.1.1', 'openmpi', '2.1.1')
+"""
+
+import os
+import os.path
+import struct
+
+flavors = ['openmpi', 'mpich', 'mvapich']
+
+default_versions = {
+    'openmpi': '2.1.1',
+    'mpich': '3.2',
+    'mvapich': '2.2',
+}
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_STRSZ = 10
+DT_SONAME = 14
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+
+def make_elf(path, needed=(), soname=None, rpath=None, runpath=None,
+             elf_class=64, machine=62):
+    """Write a minimal ELF file with a dynamic section."""
+    strtab = b'\0'
+    offsets = {}
+    for s in list(needed) + [soname, rpath, runpath]:
+        if s is not None and s not in offsets:
+            offsets[s] = len(strtab)
+            strtab += s.encode('utf-8') + b'\0'
+
+    dyn = [(DT_NEEDED, offsets[n]) for n in needed]
+    for tag, s in [(DT_SONAME, soname), (DT_RPATH, rpath),
+                   (DT_RUNPATH, runpath)]:
+        if s is not None:
+            dyn.append((tag, offsets[s]))
+
+    if elf_class == 64:
+        ehdr, phdr, dfmt, ehsize, phsize = 'HHIQQQIHHHHHH', 'IIQQQQQQ', \
+            'qQ', 64, 56
+    else:
+        ehdr, phdr, dfmt, ehsize, phsize = 'HHIIIIIHHHHHH', 'IIIIIIII', \
+            'iI', 52, 32
+    base = 0x400000
+    str_off = ehsize + 2 * phsize
+    dyn_off = str_off + len(strtab)
+    dyn += [(DT_STRTAB, base + str_off), (DT_STRSZ, len(strtab)),
+            (DT_NULL, 0)]
+    dyn_size = len(dyn) * struct.calcsize('<' + dfmt)
+    total = dyn_off + dyn_size
+
+    ident = b'\x7fELF' + (b'\x02' if elf_class == 64 else b'\x01') + \
+        b'\x01\x01' + b'\0' * 9
+    out = ident + struct.pack('<' + ehdr, 3, machine, 1, 0, ehsize, 0, 0,
+                              ehsize, phsize, 2, 0, 0, 0)
+    for p_type, off, size in [(PT_LOAD, 0, total),
+                              (PT_DYNAMIC, dyn_off, dyn_size)]:
+        if elf_class == 64:
+            out += struct.pack('<' + phdr, p_type, 4, off, base + off,
+                               base + off, size, size, 8)
+        else:
+            out += struct.pack('<' + phdr, p_type, off, base + off,
+                               base + off, size, size, 4, 4)
+    out += strtab
+    for tag, val in dyn:
+        out += struct.pack('<' + dfmt, tag, val)
+
+    with open(path, 'wb') as f:
+        f.write(out)
+
+
+def _write(path, text, mode=0o644):
+    d = os.path.dirname(path)
+    if not os.path.exists(d):
+        os.makedirs(d)
+    with open(path, 'w') as f:
+        f.write(text)
+    os.chmod(path, mode)
+
+
+def _script(path, output, tail=''):
+    # A command printing `output` whatever its arguments are
+    _write(path, "#!/bin/sh\ncat <<'__EOF__'\n{}__EOF__\n{}".format(
+        output, tail), 0o755)
+
+
+# Like the real one, the fake ompi_info reports the parameters set in
+# etc/openmpi-mca-params.conf and in OMPI_MCA_* environment variables,
+# after their defaults. <framework>_<component>_* is assumed.
+_ompi_info_params = r"""param() {
+  fw=${1%%_*}; rest=${1#*_}; comp=${rest%%_*}
+  printf 'mca:%s:%s:param:%s:value:%s\n' "$fw" "$comp" "$1" "$2"
+  printf 'mca:%s:%s:param:%s:source:%s\n' "$fw" "$comp" "$1" "$3"
+}
+conf="$(dirname "$0")/../etc/openmpi-mca-params.conf"
+if [ -f "$conf" ]; then
+  sed -n 's/^ *\([a-z0-9_]*\) *= *\(.*\)$/\1 \2/p' "$conf" |
+  while read -r name value; do param "$name" "$value" file; done
+fi
+env | sed -n 's/^OMPI_MCA_\([a-z0-9_]*\)=\(.*\)$/\1 \2/p' |
+while read -r name value; do param "$name" "$value" environment; done
+"""
+
+
+def _symlink(target, path):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    os.symlink(target, path)
+
+
+def _library(prefix, name, version, needed=()):
+    """Create lib/<name>.so.<version> with the usual symlinks."""
+    major = version.split('.')[0]
+    soname = '{}.so.{}'.format(name, major)
+    real = '{}.so.{}'.format(name, version)
+    if not os.path.exists(os.path.join(prefix, 'lib')):
+        os.makedirs(os.path.join(prefix, 'lib'))
+    make_elf(os.path.join(prefix, 'lib', real), needed, soname=soname,
+             runpath='$ORIGIN')
+    _symlink(real, os.path.join(prefix, 'lib', soname))
+    _symlink(soname, os.path.join(prefix, 'lib', name + '.so'))
+    return soname
+
+
+_mca_params = [
+    ('btl', 'base', 'btl_base_verbose', 'error', 'int'),
+    ('btl', 'self', 'btl_self_eager_limit', '1024', 'size_t'),
+    ('btl', 'tcp', 'btl_tcp_if_include', '', 'string'),
+    ('btl', 'vader', 'btl_vader_single_copy_mechanism', 'cma', 'int'),
+    ('pml', 'ob1', 'pml_ob1_priority', '20', 'int'),
+    ('pml', 'ucx', 'pml_ucx_priority', '51', 'int'),
+]
+
+
+def ompi_info_output(prefix, version, nparams=50):
+    """Output of `ompi_info --all --parsable` of Open MPI `version`."""
+    out = [
+        "package:Open MPI fakempi Distribution",
+        "ompi:version:full:{}".format(version),
+        "ompi:version:repo:v{}".format(version),
+        "orte:version:full:{}".format(version),
+        "opal:version:full:{}".format(version),
+        "mpi-api:version:full:3.1.0",
+        "ident:{}".format(version),
+        "path:prefix:{}".format(prefix),
+        "path:bindir:{}/bin".format(prefix),
+        "path:libdir:{}/lib".format(prefix),
+        "path:incdir:{}/include".format(prefix),
+        "compiler:c:command:gcc",
+        "bindings:c:yes",
+        "bindings:cxx:no",
+        "bindings:mpif.h:yes (all)",
+        "bindings:use_mpi:yes (full: ignore TKR)",
+        "mca:opal:base:param:opal_built_with_cuda_support:value:false",
+        "mca:mca:base:param:mca_param_files:value:"
+        "{}/etc/openmpi-mca-params.conf".format(prefix),
+    ]
+    for fw, comp, name, val, typ in _mca_params:
+        out += [
+            "mca:{}:{}:param:{}:value:{}".format(fw, comp, name, val),
+            "mca:{}:{}:param:{}:source:default".format(fw, comp, name),
+            "mca:{}:{}:param:{}:type:{}".format(fw, comp, name, typ),
+        ]
+    for i in range(nparams):
+        out.append("mca:btl:tcp:param:btl_tcp_param{}:value:{}".format(i, i))
+        out.append("mca:btl:tcp:param:btl_tcp_param{}:source:default"
+                   "".format(i))
+    return "\n".join(out) + "\n"
+
+
+def _libmpi_version(flavor, version):
+    if flavor == 'openmpi':
+        major = int(version.split('.')[0])
+        return {1: '1.6.5', 2: '20.10.1'}.get(major, '40.10.4')
+    return '12.1.0'
+
+
+def make_openmpi(prefix, version=None, nparams=50):
+    version = version or default_versions['openmpi']
+    bin_dir = os.path.join(prefix, 'bin')
+
+    _script(os.path.join(bin_dir, 'orterun'),
+            "mpiexec (OpenRTE) {}\n\n"
+            "Report bugs to http://www.open-mpi.org/community/help/\n"
+            "".format(version))
+    for cmd in ['mpiexec', 'mpirun']:
+        _symlink('orterun', os.path.join(bin_dir, cmd))
+    _script(os.path.join(bin_dir, 'ompi_info'),
+            ompi_info_output(prefix, version, nparams), _ompi_info_params)
+    _script(os.path.join(bin_dir, 'opal_wrapper'), "gcc\n")
+    for cmd in ['mpicc', 'mpicxx', 'mpic++', 'mpifort']:
+        _symlink('opal_wrapper', os.path.join(bin_dir, cmd))
+
+    libver = _libmpi_version('openmpi', version)
+    pal = _library(prefix, 'libopen-pal', libver)
+    rte = _library(prefix, 'libopen-rte', libver, [pal])
+    _library(prefix, 'libmpi', libver, [rte, pal, 'libc.so.6'])
+    os.makedirs(os.path.join(prefix, 'lib', 'openmpi'))
+    os.makedirs(os.path.join(prefix, 'lib', 'pkgconfig'))
+
+    major, minor = (version.split('.') + ['0'])[:2]
+    _write(os.path.join(prefix, 'include', 'mpi.h'),
+           "#define OMPI_MAJOR_VERSION {}\n"
+           "#define OMPI_MINOR_VERSION {}\n".format(major, minor))
+    _write(os.path.join(prefix, 'etc', 'openmpi-mca-params.conf'), "")
+    return prefix
+
+
+def _hydra_output(prefix, version):
+    return ("HYDRA build details:\n"
+            "    Version:                                 {}\n"
+            "    Release Date:                            unreleased\n"
+            "    CC:                              gcc\n"
+            "    Configure options:                       "
+            "'--disable-option-checking' '--prefix={}' '--enable-shared'\n"
+            "    Process Manager:                         pmi\n"
+            "    Launchers available:                     ssh rsh fork\n"
+            "".format(version, prefix))
+
+
+def make_mpich(prefix, version=None, mpich_version=None, mvapich=False):
+    version = version or \
+        default_versions['mvapich' if mvapich else 'mpich']
+    mpich_version = mpich_version or (version if not mvapich else '3.2')
+    bin_dir = os.path.join(prefix, 'bin')
+
+    _script(os.path.join(bin_dir, 'mpiexec.hydra'),
+            _hydra_output(prefix, mpich_version))
+    for cmd in ['mpiexec', 'mpirun']:
+        _symlink('mpiexec.hydra', os.path.join(bin_dir, cmd))
+    _script(os.path.join(bin_dir, 'hydra_pmi_proxy'), "")
+    for cmd in ['mpicc', 'mpicxx', 'mpifort']:
+        _script(os.path.join(bin_dir, cmd), "gcc\n")
+
+    libver = _libmpi_version('mpich', version)
+    libmpi = _library(prefix, 'libmpi', libver, ['libc.so.6'])
+    _symlink(libmpi, os.path.join(prefix, 'lib', 'libmpich.so'))
+    _library(prefix, 'libmpl', '1.0.0')
+    _library(prefix, 'libopa', '1.0.0')
+
+    defines = '#define MPICH_VERSION "{}"\n'.format(mpich_version)
+    if mvapich:
+        defines += '#define MVAPICH2_VERSION "{}"\n'.format(version)
+        os.makedirs(os.path.join(prefix, 'libexec', 'osu-micro-benchmarks'))
+    _write(os.path.join(prefix, 'include', 'mpi.h'), defines)
+    _write(os.path.join(prefix, 'include', 'mpicxx.h'), "")
+    return prefix
+
+
+def make_mvapich(prefix, version=None, mpich_version=None):
+    return make_mpich(prefix, version, mpich_version, mvapich=True)
+
+
+def make_mpi(prefix, flavor, version=None):
+    """Create a stub installation of `flavor` under `prefix`."""
+    if flavor == 'openmpi':
+        return make_openmpi(prefix, version)
+    elif flavor == 'mpich':
+        return make_mpich(prefix, version)
+    elif flavor == 'mvapich':
+        return make_mvapich(prefix, version)
+    raise ValueError("Unknown MPI flavor: '{}'".format(flavor))
@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from fakempi import make_elf
+from mpienv import abi
+from mpienv import elf
+
+
+class TestABICheck(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_dirs = elf._system_dirs
+        elf._system_dirs = []
+
+        self.ompi = self.make_mpi('ompi', 'libmpi.so.40')
+        self.mpich = self.make_mpi('mpich', 'libmpi.so.12')
+
+    def tearDown(self):
+        elf._system_dirs = self.saved_dirs
+        shutil.rmtree(self.tmpdir)
+
+    def make_mpi(self, name, soname):
+        lib = os.path.join(self.tmpdir, name, 'lib')
+        os.makedirs(lib)
+        make_elf(os.path.join(lib, soname), soname=soname)
+        os.symlink(soname, os.path.join(lib, 'libmpi.so'))
+        return os.path.join(self.tmpdir, name)
+
+    def make_program(self, name, needed):
+        path = os.path.join(self.tmpdir, name)
+        make_elf(path, needed)
+        os.chmod(path, 0o755)
+        return path
+
+    def test_find_program(self):
+        prog = self.make_program('a.out', ['libmpi.so.40'])
+        with open(os.path.join(self.tmpdir, 'hostfile'), 'w') as f:
+            f.write("localhost\n")
+        args = ['-n', '4', '--hostfile', 'hostfile', 'a.out', 'hostfile']
+        self.assertEqual(prog, abi.find_program(args, self.tmpdir))
+        self.assertIsNone(abi.find_program(['-n', '4'], self.tmpdir))
+
+    def test_check(self):
+        prog = self.make_program('a.out', ['libmpi.so.40'])
+        ompi_lib = [os.path.join(self.ompi, 'lib')]
+        mpich_lib = [os.path.join(self.mpich, 'lib')]
+
+        self.assertEqual([], abi.check(prog, self.ompi, ompi_lib))
+
+        # The same soname found in another installation
+        other = self.make_mpi('ompi2', 'libmpi.so.40')
+        problems = abi.check(prog, self.ompi,
+                             [os.path.join(other, 'lib')] + ompi_lib)
+        self.assertEqual(['warn'], [level for level, _ in problems])
+
+        problems = abi.check(prog, self.mpich, mpich_lib)
+        self.assertEqual(['error'], [level for level, _ in problems])
+
+        # Not an MPI program
+        prog = self.make_program('b.out', ['libc.so.6'])
+        self.assertEqual([], abi.check(prog, self.mpich, mpich_lib))
+
+    def test_cache(self):
+        prog = self.make_program('a.out', ['libmpi.so.40'])
+        ld_path = [os.path.join(self.ompi, 'lib')]
+        cache_file = os.path.join(self.tmpdir, 'cache', 'abi.json')
+        expected = [('libmpi.so.40',
+                     os.path.join(self.ompi, 'lib', 'libmpi.so.40'))]
+        self.assertEqual(expected, abi.ABICache(cache_file).linked_libmpi(
+            prog, ld_path))
+
+        scanned = []
+        orig = abi.linked_libmpi
+        abi.linked_libmpi = lambda *args: scanned.append(args)
+        try:
+            self.assertEqual(expected, abi.ABICache(
+                cache_file).linked_libmpi(prog, ld_path))
+        finally:
+            abi.linked_libmpi = orig
+        self.assertEqual([], scanned)
+
+        # A rebuilt program is scanned again
+        make_elf(prog, ['libmpi.so.12', 'libm.so.6'])
+        self.assertEqual([('libmpi.so.12', None)], abi.ABICache(
+            cache_file).linked_libmpi(prog, ld_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+from subprocess import PIPE
+from subprocess import Popen
+import sys
+import tempfile
+import unittest
+
+import fakempi
+
+ProjDir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..'))
+
+
+class TestAdd(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.env = dict(os.environ)
+        self.env.update({
+            'HOME': self.tmpdir,
+            'MPIENV_ROOT': os.path.join(self.tmpdir, 'root'),
+            'MPIENV_VERSIONS_DIR': os.path.join(self.tmpdir, 'versions'),
+            'MPIENV_CACHE_DIR': os.path.join(self.tmpdir, 'cache'),
+            'PYTHONPATH': ProjDir,
+        })
+        self.prefixes = [
+            fakempi.make_mpi(os.path.join(self.tmpdir, name), 'openmpi',
+                             version)
+            for name, version in [('ompi2', '2.1.1'), ('ompi3', '3.1.0')]]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def add(self, args, stdin=b'', status=0):
+        p = Popen([sys.executable, os.path.join(ProjDir, 'bin', 'add.py')] +
+                  args, stdin=PIPE, stdout=PIPE, stderr=PIPE, env=self.env)
+        out, err = p.communicate(stdin)
+        self.assertEqual(status, p.returncode, err)
+        return out.decode(), err.decode()
+
+    def registered(self):
+        mpi_dir = os.path.join(self.tmpdir, 'versions', 'mpi')
+        if not os.path.isdir(mpi_dir):
+            return []
+        return sorted(os.listdir(mpi_dir))
+
+    def test_stdin(self):
+        text = "# prefixes\n{}\n\n{}\n".format(*self.prefixes)
+        out, _ = self.add(['-'], stdin=text.encode())
+        self.assertEqual(2, out.count("Added "))
+        self.assertEqual(2, len(self.registered()))
+
+    def test_stdin_not_a_tty(self):
+        out, _ = self.add([], stdin=self.prefixes[0].encode())
+        self.assertEqual(1, len(self.registered()))
+
+    def test_empty_stdin(self):
+        # e.g. a job script running `mpienv add </dev/null`
+        _, err = self.add([], status=2)
+        self.assertIn("no path given", err)
+        _, err = self.add(['-'], stdin=b"# nothing\n", status=2)
+        self.assertIn("no path given", err)
+        self.assertEqual([], self.registered())
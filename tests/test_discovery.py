@@ -0,0 +1,133 @@
+# coding: utf-8
+
+import json
+import os
+import os.path
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from mpienv import discovery
+
+
+def _write(path, text):
+    if not os.path.exists(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+class TestDiscovery(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = {k: getattr(discovery, k) for k in [
+            'dpkg_info_dir', 'rpm_dbs', 'alternatives_dirs', 'spack_roots',
+            'conda_environments']}
+        self.saved_env = os.environ.copy()
+        for var in ['MODULEPATH', 'CONDA_PREFIX', 'CONDA_EXE']:
+            os.environ.pop(var, None)
+
+        discovery.dpkg_info_dir = self.path('dpkg', 'info')
+        discovery.rpm_dbs = [self.path('rpm', 'rpmdb.sqlite')]
+        discovery.alternatives_dirs = [self.path('alternatives')]
+        discovery.spack_roots = [self.path('spack')]
+        discovery.conda_environments = self.path('environments.txt')
+
+    def tearDown(self):
+        for k, v in self.saved.items():
+            setattr(discovery, k, v)
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, *p):
+        return os.path.join(self.tmpdir, *p)
+
+    def test_dpkg(self):
+        _write(self.path('dpkg', 'info', 'mpich.list'),
+               "/.\n/usr\n/usr/bin\n/usr/bin/mpiexec.hydra\n"
+               "/usr/lib/x86_64-linux-gnu/mpich/bin/mpirun\n")
+        _write(self.path('dpkg', 'info', 'coreutils.list'),
+               "/opt/not-mpi/bin/mpiexec\n")
+        self.assertEqual(['/usr', '/usr/lib/x86_64-linux-gnu/mpich'],
+                         sorted(discovery.from_dpkg()))
+
+    def test_rpm(self):
+        os.makedirs(self.path('rpm'))
+        conn = sqlite3.connect(discovery.rpm_dbs[0])
+        conn.execute("CREATE TABLE Basenames (key TEXT, hnum INTEGER, "
+                     "idx INTEGER)")
+        conn.execute("CREATE TABLE Dirnames (key TEXT, hnum INTEGER, "
+                     "idx INTEGER)")
+        conn.executemany("INSERT INTO Basenames VALUES (?, ?, 0)",
+                         [('mpiexec', 1), ('mpirun', 1), ('ls', 2)])
+        conn.executemany("INSERT INTO Dirnames VALUES (?, ?, 0)",
+                         [('/usr/lib64/openmpi/bin/', 1),
+                          ('/usr/lib64/openmpi/lib/', 1),
+                          ('/usr/bin/', 2)])
+        conn.commit()
+        conn.close()
+        self.assertEqual(['/usr/lib64/openmpi'], discovery.from_rpm())
+
+    def test_alternatives(self):
+        _write(self.path('alternatives', 'mpirun'),
+               "auto\n/usr/bin/mpirun\nmpiexec\n/usr/bin/mpiexec\n\n"
+               "/usr/bin/mpirun.openmpi\n50\n/usr/bin/mpiexec.openmpi\n"
+               "/opt/mpich/bin/mpirun\n40\n/opt/mpich/bin/mpiexec\n")
+        self.assertEqual(['/opt/mpich', '/usr'],
+                         sorted(set(discovery.from_alternatives())))
+
+    def test_spack(self):
+        installs = {
+            'a': {'spec': {'name': 'openmpi'}, 'path': '/spack/openmpi',
+                  'installed': True},
+            'b': {'spec': {'mvapich2': {'version': '2.3'}},
+                  'path': '/spack/mvapich2', 'installed': True},
+            'c': {'spec': {'name': 'mpich'}, 'path': '/spack/mpich',
+                  'installed': False},
+            'd': {'spec': {'name': 'zlib'}, 'path': '/spack/zlib',
+                  'installed': True},
+        }
+        _write(self.path('spack', 'opt', 'spack', '.spack-db', 'index.json'),
+               json.dumps({'database': {'version': '5',
+                                        'installs': installs}}))
+        self.assertEqual(['/spack/mvapich2', '/spack/openmpi'],
+                         sorted(discovery.from_spack()))
+
+    def test_modules(self):
+        _write(self.path('modules', 'OpenMPI', '4.1.1-GCC-10.3.0.lua'),
+               'local root = "/sw/OpenMPI/4.1.1-GCC-10.3.0"\n'
+               'prepend_path("PATH", pathJoin(root, "bin"))\n')
+        _write(self.path('modules', 'mpi', 'mpich', '3.2'),
+               '#%Module\nprepend-path PATH /sw/mpich-3.2/bin\n')
+        _write(self.path('modules', 'gcc', '10.3.0.lua'),
+               'prepend_path("PATH", "/sw/gcc/bin")\n')
+        os.environ['MODULEPATH'] = self.path('modules') + ':/no/such/dir'
+        self.assertEqual(['/sw/OpenMPI/4.1.1-GCC-10.3.0', '/sw/mpich-3.2'],
+                         sorted(discovery.from_modules()))
+
+    def test_conda(self):
+        env1 = self.path('conda', 'envs', 'mpi')
+        env2 = self.path('conda', 'envs', 'other')
+        _write(os.path.join(env1, 'conda-meta',
+                            'openmpi-4.1.4-ha1ae619_100.json'), '{}')
+        _write(os.path.join(env2, 'conda-meta',
+                            'mpi4py-3.1.4-py311h.json'), '{}')
+        os.environ['CONDA_EXE'] = self.path('conda', 'bin', 'conda')
+        self.assertEqual([env1], discovery.from_conda())
+
+    def test_candidates(self):
+        _write(self.path('dpkg', 'info', 'openmpi-bin.list'),
+               "/usr/bin/mpiexec.openmpi\n")
+        _write(self.path('alternatives', 'mpiexec'),
+               "auto\n/usr/bin/mpiexec\n\n/usr/bin/mpiexec.openmpi\n50\n")
+        # Not a valid database
+        _write(discovery.rpm_dbs[0], "garbage")
+        self.assertEqual([('dpkg', '/usr')], discovery.candidates())
+        self.assertEqual([('alternatives', '/usr')],
+                         discovery.candidates(['alternatives', 'spack']))
+
+
+if __name__ == '__main__':
+    unittest.main()
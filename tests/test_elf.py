@@ -0,0 +1,89 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from fakempi import make_elf
+from mpienv import elf
+
+
+class TestELF(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        for d in ['bin', 'lib', 'other', 'lib32']:
+            os.mkdir(os.path.join(self.tmpdir, d))
+        self.saved_dirs = elf._system_dirs
+        elf._system_dirs = []
+
+    def tearDown(self):
+        elf._system_dirs = self.saved_dirs
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, *names):
+        return os.path.join(self.tmpdir, *names)
+
+    def test_read(self):
+        make_elf(self.path('lib', 'libmpi.so.40'), ['libc.so.6'],
+                 soname='libmpi.so.40', runpath='$ORIGIN')
+        e = elf.read_elf(self.path('lib', 'libmpi.so.40'))
+        self.assertEqual('libmpi.so.40', e.soname)
+        self.assertEqual(['libc.so.6'], e.needed)
+        self.assertEqual(['$ORIGIN'], e.runpath)
+        self.assertEqual([self.path('lib')], elf.search_dirs(e))
+
+        with open(self.path('bin', 'mpicc'), 'w') as f:
+            f.write("#!/bin/sh\n")
+        self.assertIsNone(elf.read_elf(self.path('bin', 'mpicc')))
+
+        make_elf(self.path('lib32', 'libfoo.so'), elf_class=32, machine=3)
+        self.assertEqual(32, elf.read_elf(self.path('lib32',
+                                                    'libfoo.so')).elf_class)
+
+    def test_resolve(self):
+        make_elf(self.path('bin', 'mpiexec'), ['libmpi.so.40'],
+                 rpath='$ORIGIN/../lib')
+        make_elf(self.path('lib', 'libmpi.so.40'),
+                 ['libopen-pal.so.40', 'libfabric.so.1'])
+        make_elf(self.path('lib', 'libopen-pal.so.40'))
+        make_elf(self.path('other', 'libopen-pal.so.40'))
+
+        deps = elf.check(self.path('bin', 'mpiexec'))
+        # DT_RPATH of the executable applies to libmpi's dependencies
+        self.assertEqual(self.path('lib', 'libopen-pal.so.40'),
+                         deps['libraries']['libopen-pal.so.40'])
+        self.assertEqual([('libfabric.so.1',
+                           self.path('lib', 'libmpi.so.40'))],
+                         deps['missing'])
+
+        # LD_LIBRARY_PATH comes after DT_RPATH
+        deps = elf.check(self.path('bin', 'mpiexec'), [self.path('other')])
+        self.assertEqual(self.path('lib', 'libopen-pal.so.40'),
+                         deps['libraries']['libopen-pal.so.40'])
+
+    def test_runpath_and_conflicts(self):
+        make_elf(self.path('bin', 'a.out'),
+                 ['libmpi.so.12', 'libother.so'], runpath='$ORIGIN/../lib')
+        make_elf(self.path('lib', 'libmpi.so.12'))
+        make_elf(self.path('lib', 'libother.so'), ['libmpi.so.40'],
+                 runpath=self.path('other'))
+        make_elf(self.path('other', 'libmpi.so.40'))
+        make_elf(self.path('other', 'libmpi.so.12'))
+        # A 32bit library is skipped by the loader
+        make_elf(self.path('lib32', 'libmpi.so.12'), elf_class=32,
+                 machine=3)
+
+        deps = elf.check(self.path('bin', 'a.out'),
+                         [self.path('lib32'), self.path('other')])
+        # LD_LIBRARY_PATH comes before DT_RUNPATH
+        self.assertEqual(self.path('other', 'libmpi.so.12'),
+                         deps['libraries']['libmpi.so.12'])
+        self.assertEqual([('libmpi.so.12', self.path('other', 'libmpi.so.12'),
+                           None, self.path('other', 'libmpi.so.40'))],
+                         deps['conflicts'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,82 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from mpienv import envpath
+
+
+class TestEnvPath(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.vers = self.mkdir('versions', 'mpi')[:-len('/mpi')]
+        self.other = self.mkdir('other', 'mpi')[:-len('/mpi')]
+        for vers in [self.vers, self.other]:
+            for d in ['bin', 'lib']:
+                os.makedirs(os.path.join(vers, 'shims', d))
+        self.a = self.mkdir('a')
+        self.b = self.mkdir('b')
+        os.symlink(self.a, self.path('a-link'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def path(self, *p):
+        return os.path.join(self.tmpdir, *p)
+
+    def mkdir(self, *p):
+        os.makedirs(self.path(*p))
+        return self.path(*p)
+
+    def test_split(self):
+        self.assertEqual(['/a', '/b'], envpath.split('/a::/b:'))
+        self.assertEqual([], envpath.split(None))
+
+    def test_versions_dir_of(self):
+        self.assertEqual(self.vers, envpath.versions_dir_of(
+            os.path.join(self.vers, 'shims', 'bin')))
+        self.assertEqual(self.vers, envpath.versions_dir_of(
+            os.path.join(self.vers, '.shims-1234', 'lib/')))
+        # Not a versions directory
+        self.assertIsNone(envpath.versions_dir_of(self.path('x/shims/bin')))
+        self.assertIsNone(envpath.versions_dir_of(self.a))
+
+    def test_normalize(self):
+        own = os.path.join(self.vers, 'shims', 'bin')
+        foreign = os.path.join(self.other, 'shims', 'bin')
+        paths = [self.a, '', self.path('no-such'), foreign, self.b,
+                 self.path('a-link'), own, self.a + '/']
+        self.assertEqual([self.a, self.b, own],
+                         envpath.normalize(paths, self.vers))
+        self.assertEqual([own, self.a, self.b],
+                         envpath.normalize(paths, self.vers, first=[own]))
+        self.assertEqual([self.a, self.path('no-such'), self.b, own],
+                         envpath.normalize(paths, self.vers,
+                                           drop_missing=False))
+
+    def test_normalize_environ(self):
+        shims = envpath.shims_paths(os.path.join(self.vers, 'shims'))
+        environ = {'PATH': ':'.join([self.b, self.a, self.b]),
+                   'HOME': self.tmpdir}
+        changed = envpath.normalize_environ(environ, self.vers, shims)
+        self.assertEqual({
+            'PATH': ':'.join([os.path.join(self.vers, 'shims', 'bin'),
+                              self.b, self.a]),
+            # shims/lib64 does not exist
+            'LD_LIBRARY_PATH': os.path.join(self.vers, 'shims', 'lib'),
+        }, changed)
+        self.assertEqual(changed['PATH'], environ['PATH'])
+        self.assertEqual(self.tmpdir, environ['HOME'])
+
+        # Variables which are not set stay unset
+        environ = {'PATH': self.a}
+        self.assertEqual({'PATH': self.a},
+                         envpath.normalize_environ(environ, self.vers))
+        self.assertNotIn('LD_LIBRARY_PATH', environ)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import fakempi
+import mpienv.fingerprint as fingerprint
+
+
+class TestFingerprint(unittest.TestCase):
+    def setUp(self):
+        self.prefix = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self.prefix, 'lib'))
+        self.lib = os.path.join(self.prefix, 'lib', 'libmpi.so.12.1.0')
+        with open(self.lib, 'wb') as f:
+            f.write(b'\x7fELF libmpi')
+        os.symlink('libmpi.so.12.1.0',
+                   os.path.join(self.prefix, 'lib', 'libmpi.so'))
+        self.info = {'type': 'MPICH', 'version': '3.2',
+                     'prefix': self.prefix}
+
+    def tearDown(self):
+        shutil.rmtree(self.prefix)
+
+    def test_find_libmpi(self):
+        self.assertEqual(os.path.realpath(self.lib),
+                         fingerprint.find_libmpi(self.prefix))
+
+    def test_fingerprint_stable(self):
+        fp = fingerprint.mpi_fingerprint(self.info)
+        info = dict(self.info, name='other-name')
+        self.assertEqual(fp, fingerprint.mpi_fingerprint(info))
+
+    def test_fingerprint_changes(self):
+        fp = fingerprint.mpi_fingerprint(self.info)
+        info = dict(self.info, version='3.2.1')
+        self.assertNotEqual(fp, fingerprint.mpi_fingerprint(info))
+
+        with open(self.lib, 'ab') as f:
+            f.write(b'rebuilt')
+        self.assertNotEqual(fp, fingerprint.mpi_fingerprint(self.info))
+
+    def install_libmpi(self, real, soname):
+        lib_dir = os.path.join(self.prefix, 'lib')
+        shutil.rmtree(lib_dir)
+        os.mkdir(lib_dir)
+        fakempi.make_elf(os.path.join(lib_dir, real), soname=soname)
+        os.symlink(real, os.path.join(lib_dir, 'libmpi.so'))
+
+    def test_soname(self):
+        self.assertEqual('libmpi.so.12.1.0',
+                         fingerprint.libmpi_soname(self.lib))
+
+        # A rebuild with the same SONAME and binary is compatible
+        self.install_libmpi('libmpi.so.40.10.0', 'libmpi.so.40')
+        fp = fingerprint.mpi_fingerprint(self.info)
+        self.install_libmpi('libmpi.so.40.10.1', 'libmpi.so.40')
+        self.assertEqual(fp, fingerprint.mpi_fingerprint(self.info))
+
+        self.install_libmpi('libmpi.so.40.10.1', 'libmpi.so.41')
+        self.assertNotEqual(fp, fingerprint.mpi_fingerprint(self.info))
@@ -0,0 +1,93 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import fakempi
+from mpienv import hosts
+
+
+class TestHosts(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = fakempi.make_openmpi(
+            os.path.join(self.tmpdir, 'openmpi'))
+        self.hosts = ['node{}'.format(i) for i in range(10)]
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def copy(self, host):
+        # The file system of `host`, with a copy of the installation
+        root = os.path.join(self.tmpdir, host)
+        shutil.copytree(self.prefix, root + self.prefix, symlinks=True)
+        return root
+
+    def test_read_hostfile(self):
+        path = os.path.join(self.tmpdir, 'hostfile')
+        with open(path, 'w') as f:
+            f.write("# nodes\nnode1 slots=4\nnode2:8\n\nnode1 slots=4\n"
+                    "node3  # spare\n")
+        self.assertEqual(['node1', 'node2', 'node3'],
+                         hosts.read_hostfile(path))
+
+    def test_tree(self):
+        t = hosts.tree(self.hosts, 3)
+        self.assertEqual(['node0', 'node4', 'node7'], [h for h, _ in t])
+        self.assertEqual([('node1', []), ('node2', []), ('node3', [])],
+                         t[0][1])
+
+        def flatten(t):
+            return sum([[h] + flatten(sub) for h, sub in t], [])
+        self.assertEqual(self.hosts, flatten(t))
+        self.assertEqual(self.hosts, flatten(hosts.tree(self.hosts, 1)))
+
+    def test_check_hosts(self):
+        roots = {'node3': self.copy('node3'), 'node8': self.copy('node8'),
+                 'node5': os.path.join(self.tmpdir, 'node5')}
+        lib = os.path.join('lib', 'libmpi.so.20.10.1')
+        with open(os.path.join(roots['node3'] + self.prefix, lib), 'ab') as f:
+            f.write(b'\0')
+        os.remove(os.path.join(roots['node8'] + self.prefix, lib))
+
+        report = hosts.check_hosts(self.hosts, self.prefix,
+                                   hosts.LocalTransport(roots), fanout=3)
+        self.assertEqual({
+            'node3': [lib + ': differs'],
+            'node5': [self.prefix + ': no such directory'],
+            'node8': [lib + ': missing'],
+        }, {h: p for h, p in report.items() if p})
+        self.assertEqual(sorted(self.hosts), sorted(report))
+
+    def test_unreachable(self):
+        class Failing(hosts.LocalTransport):
+            def shell(self, host):
+                if host == 'node0':
+                    return "sh -c 'exit 255'"
+                return super(Failing, self).shell(host)
+
+        report = hosts.check_hosts(self.hosts, self.prefix, Failing(),
+                                   fanout=3)
+        self.assertEqual(['unreachable (exit 255)'], report['node0'])
+        # The subtree of node0 is not reached
+        for host in ['node1', 'node2', 'node3']:
+            self.assertEqual(['no answer'], report[host])
+        self.assertEqual([], report['node4'])
+
+    def test_timeout(self):
+        class Hanging(hosts.LocalTransport):
+            def shell(self, host):
+                if host == 'node4':
+                    return "sleep 60"
+                return super(Hanging, self).shell(host)
+
+        report = hosts.check_hosts(self.hosts, self.prefix, Hanging(),
+                                   fanout=3, timeout=0.5)
+        self.assertEqual(['no answer (timed out)'], report['node4'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,379 @@
+# coding: utf-8
+
+import io
+import json
+import os
+import os.path
+import shutil
+from subprocess import CalledProcessError
+from subprocess import PIPE
+from subprocess import Popen
+import sys
+import tarfile
+import tempfile
+import unittest
+
+import common
+from mpienv import installer
+
+ProjDir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..'))
+
+# ./configure of the fake source tree remembers the prefix for make
+_configure = """\
+while [ $# -gt 0 ]; do
+  if [ "$1" = --prefix ]; then echo "$2" > .prefix; fi
+  shift
+done
+echo configured
+"""
+
+# make installs a fake mpiexec
+_make = """\
+echo "make $*"
+if [ "$1" = install ]; then
+  prefix=$(cat .prefix)
+  mkdir -p "$prefix/bin"
+  echo '#!/bin/sh' > "$prefix/bin/mpiexec"
+fi
+"""
+
+
+def _script(path, body):
+    with open(path, 'w') as f:
+        f.write("#!/bin/sh\n" + body)
+    os.chmod(path, 0o755)
+
+
+class _Stdout(object):
+    """sys.stdout collecting both text and the bytes of child processes."""
+
+    def __init__(self):
+        self.buffer = io.BytesIO()
+
+    def write(self, s):
+        if not isinstance(s, bytes):
+            s = s.encode('utf-8')
+        self.buffer.write(s)
+
+    def flush(self):
+        pass
+
+    def getvalue(self):
+        return self.buffer.getvalue().decode('utf-8')
+
+
+class _Rusage(object):
+    def __init__(self, ru_maxrss):
+        self.ru_maxrss = ru_maxrss
+
+
+class InstallerTestBase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_env = os.environ.copy()
+        for var in installer._build_env_vars + ['MPIENV_VERSIONS_DIR',
+                                                'MPIENV_CONFIGURE_OPTS']:
+            os.environ.pop(var, None)
+        root = os.path.join(self.tmpdir, 'root')
+        os.environ['MPIENV_CACHE_DIR'] = os.path.join(root, 'cache')
+        os.environ['MPIENV_BUILD_DIR'] = os.path.join(root, 'builds')
+
+        # Stub make and compilers
+        bin_dir = os.path.join(self.tmpdir, 'bin')
+        os.mkdir(bin_dir)
+        _script(os.path.join(bin_dir, 'make'), _make)
+        for var, cmd in installer._build_compilers:
+            _script(os.path.join(bin_dir, cmd), "echo '{} 1.0'\n".format(cmd))
+            os.environ[var] = os.path.join(bin_dir, cmd)
+        os.environ['PATH'] = bin_dir + ':' + os.environ['PATH']
+
+        self.manager = common.Manager(root)
+        self.make_tarball('openmpi-2.1.1', 'v1')
+
+        self.saved_stdout = sys.stdout
+        sys.stdout = self.stdout = _Stdout()
+
+    def tearDown(self):
+        sys.stdout = self.saved_stdout
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.tmpdir)
+
+    def make_tarball(self, dir_name, content):
+        src = os.path.join(self.tmpdir, 'src', dir_name)
+        if not os.path.exists(src):
+            os.makedirs(src)
+        _script(os.path.join(src, 'configure'), _configure)
+        with open(os.path.join(src, 'VERSION'), 'w') as f:
+            f.write(content)
+
+        cache_dir = self.manager.cache_dir()
+        if not os.path.exists(cache_dir):
+            os.makedirs(cache_dir)
+        tar = tarfile.open(os.path.join(cache_dir, dir_name + '.tar.bz2'),
+                           'w:bz2')
+        try:
+            tar.add(src, dir_name)
+        finally:
+            tar.close()
+
+    def installer(self):
+        return installer.OmpiInstaller(self.manager, 'openmpi-2.1.1',
+                                       'ompi', False)
+
+    def last_run(self):
+        return installer.load_build_record(self.manager, 'ompi')['runs'][-1]
+
+
+class TestPhase(unittest.TestCase):
+    def test_add_child(self):
+        phase = installer._Phase('build')
+        phase.add_child(_Rusage(300), 10)
+        phase.add_child(_Rusage(200), 5)
+        d = phase.to_dict()
+        self.assertEqual(2, d['commands'])
+        self.assertEqual(15, d['output_bytes'])
+        if sys.platform == 'darwin':
+            self.assertEqual(0, d['max_rss_kb'])
+        else:
+            self.assertEqual(300, d['max_rss_kb'])
+        self.assertEqual('build', d['phase'])
+        self.assertFalse(d['skipped'])
+
+
+class TestCheckCall(InstallerTestBase):
+    def test_accounting(self):
+        inst = self.installer()
+        cmd = [sys.executable, '-c',
+               "b = bytearray(64 << 20); print('x' * 999)"]
+        phase = inst._run_phase('build', inst._check_call, cmd)
+        self.assertEqual(1, phase.commands)
+        self.assertEqual(1000, phase.output_bytes)
+        self.assertGreaterEqual(phase.max_rss_kb, 64 << 10)
+        # The output is passed through
+        self.assertEqual('x' * 999 + "\n", self.stdout.getvalue())
+
+    def test_stdout(self):
+        inst = self.installer()
+        out = os.path.join(self.tmpdir, 'out')
+        cmd = ['sh', '-c', 'echo out; echo err >&2']
+        with open(out, 'w') as f:
+            phase = inst._run_phase('download', inst._check_call, cmd,
+                                    None, f)
+        with open(out) as f:
+            self.assertEqual("out\n", f.read())
+        self.assertEqual("err\n", self.stdout.getvalue())
+        self.assertEqual(4, phase.output_bytes)
+
+    def test_failure(self):
+        inst = self.installer()
+        with self.assertRaises(CalledProcessError) as cm:
+            inst._check_call(['sh', '-c', 'exit 3'])
+        self.assertEqual(3, cm.exception.returncode)
+        with self.assertRaises(CalledProcessError) as cm:
+            inst._check_call(['sh', '-c', 'kill -9 $$'])
+        self.assertEqual(-9, cm.exception.returncode)
+
+
+class TestBuildRecord(InstallerTestBase):
+    def test_record(self):
+        self.installer().build(npar=2)
+        rec = installer.load_build_record(self.manager, 'ompi')
+        self.assertEqual('openmpi-2.1.1', rec['mpi'])
+        self.assertEqual(self.installer().prefix, rec['prefix'])
+        self.assertEqual(1, len(rec['runs']))
+        run = rec['runs'][0]
+        self.assertEqual('build', run['command'])
+        self.assertEqual(['download', 'extract', 'configure', 'build'],
+                         [ph['phase'] for ph in run['phases']])
+        phases = {ph['phase']: ph for ph in run['phases']}
+        self.assertEqual(0, phases['download']['commands'])
+        self.assertEqual(1, phases['configure']['commands'])
+        self.assertEqual(len("configured\n"),
+                         phases['configure']['output_bytes'])
+        self.assertEqual(len("make -j 2\n"), phases['build']['output_bytes'])
+        self.assertIn("make -j 2\n", self.stdout.getvalue())
+
+    def test_failed_run(self):
+        # A failed run is recorded too
+        os.remove(os.path.join(self.manager.cache_dir(),
+                               'openmpi-2.1.1.tar.bz2'))
+        os.environ['PATH'] = os.path.join(self.tmpdir, 'bin')
+        with self.assertRaises((CalledProcessError, OSError)):
+            self.installer().build()
+        self.assertEqual(['download'],
+                         [ph['phase'] for ph in self.last_run()['phases']])
+
+    def test_max_runs(self):
+        for _ in range(installer._max_runs + 2):
+            self.installer().configure()
+        rec = installer.load_build_record(self.manager, 'ompi')
+        self.assertEqual(installer._max_runs, len(rec['runs']))
+        self.assertEqual(['ompi'], installer.list_build_records(self.manager))
+
+
+class TestBuildStats(InstallerTestBase):
+    def build_stats(self, *args):
+        env = dict(os.environ, MPIENV_ROOT=self.manager.root_dir(),
+                   PYTHONPATH=ProjDir)
+        p = Popen([sys.executable,
+                   os.path.join(ProjDir, 'bin', 'build-stats.py')] +
+                  list(args), stdout=PIPE, stderr=PIPE, env=env)
+        out, err = p.communicate()
+        self.assertEqual(0, p.returncode, err)
+        return out.decode()
+
+    def test_output(self):
+        self.installer().build()
+        self.installer().install()
+        lines = self.build_stats().splitlines()
+        self.assertEqual("ompi (openmpi-2.1.1)", lines[0])
+        self.assertTrue(lines[1].startswith("  install at "))
+        self.assertEqual(['phase', 'seconds', 'peak', 'RSS', 'output'],
+                         lines[2].split())
+        phases = [line.split()[0] for line in lines[3:] if line]
+        self.assertEqual(['download', 'extract', 'configure', 'build',
+                          'install'], phases)
+        self.assertIn("    build         skipped", lines)
+
+        out = self.build_stats('--all', 'ompi')
+        self.assertEqual(1, out.count("  build at "))
+        self.assertEqual(1, out.count("  install at "))
+
+    def test_json(self):
+        self.installer().build()
+        records = json.loads(self.build_stats('--json'))
+        self.assertEqual(['ompi'], list(records))
+        self.assertEqual(
+            installer.load_build_record(self.manager, 'ompi'),
+            records['ompi'])
+
+
+class TestStamps(InstallerTestBase):
+    def skipped(self):
+        return [ph['phase'] for ph in self.last_run()['phases']
+                if ph['skipped']]
+
+    def reasons(self, phase):
+        for ph in self.last_run()['phases']:
+            if ph['phase'] == phase:
+                return ph['reasons']
+
+    def test_stamp_diff(self):
+        old = {'tarball': 'a', 'after': {'extract': 1.0}, 'conf_args': []}
+        new = {'tarball': 'b', 'after': {'extract': 2.0},
+               'conf_args': ['--prefix', '/p']}
+        self.assertEqual(["extract re-ran",
+                          "conf_args changed: [] -> ['--prefix', '/p']",
+                          "the source tarball changed"],
+                         installer._stamp_diff(old, new))
+        self.assertEqual([], installer._stamp_diff(old, dict(old)))
+
+    def test_outdated(self):
+        inst = self.installer()
+        self.assertEqual(["no stamp from a previous run"],
+                         inst._outdated('build', {}))
+        inst._write_stamp('build', {'after': {'configure': 1.0}})
+        self.assertEqual([], inst._outdated('build',
+                                            {'after': {'configure': 1.0}}))
+        self.assertEqual(["configure re-ran"], inst._outdated(
+            'build', {'after': {'configure': 2.0}}))
+
+    def test_up_to_date(self):
+        self.installer().build()
+        self.assertEqual([], self.skipped())
+        self.assertEqual(["no stamp from a previous run"],
+                         self.reasons('configure'))
+
+        self.installer().build()
+        self.assertEqual(['extract', 'configure', 'build'], self.skipped())
+        out = self.stdout.getvalue()
+        self.assertIn("extract: up to date, skipping\n", out)
+        self.assertIn("build: up to date, skipping\n", out)
+
+    def test_env_changed(self):
+        self.installer().build()
+        os.environ['CFLAGS'] = '-O3'
+        self.installer().build()
+        self.assertEqual(['extract'], self.skipped())
+        self.assertEqual(["env.CFLAGS changed: None -> '-O3'"],
+                         self.reasons('configure'))
+        self.assertEqual(["configure re-ran"], self.reasons('build'))
+        self.assertIn("configure: running because env.CFLAGS changed: "
+                      "None -> '-O3'\n", self.stdout.getvalue())
+
+    def test_compiler_changed(self):
+        self.installer().build()
+        cc = os.environ['CC']
+        _script(cc, "echo 'cc 2.0'\n")
+        self.installer().build()
+        self.assertEqual(['extract'], self.skipped())
+        reasons = self.reasons('configure')
+        self.assertEqual(1, len(reasons))
+        self.assertTrue(reasons[0].startswith(
+            "compilers.{} changed: ".format(cc)), reasons)
+
+    def test_tarball_changed(self):
+        inst = self.installer()
+        inst.build()
+        self.make_tarball('openmpi-2.1.1', 'v2')
+        self.installer().build()
+        self.assertEqual([], self.skipped())
+        self.assertEqual(["the source tarball changed"],
+                         self.reasons('extract'))
+        with open(os.path.join(inst.dir_path, 'VERSION')) as f:
+            self.assertEqual('v2', f.read())
+
+    def test_forced_per_build(self):
+        # Reasons to force a phase hold for a single run
+        inst = self.installer()
+        inst.install()
+        self.assertEqual(["{} is not installed".format(inst.prefix)],
+                         self.reasons('install'))
+        inst.install()
+        self.assertEqual(['extract', 'configure', 'build', 'install'],
+                         self.skipped())
+
+        os.remove(os.path.join(inst.prefix, 'bin', 'mpiexec'))
+        inst.install()
+        self.assertEqual(["{} is not installed".format(inst.prefix)],
+                         self.reasons('install'))
+        inst.install()
+        self.assertIn('install', self.skipped())
+
+    def test_tree_removed(self):
+        inst = self.installer()
+        inst.build()
+        shutil.rmtree(inst.dir_path)
+        inst.build()
+        self.assertEqual(["{} does not exist".format(inst.dir_path)],
+                         self.reasons('extract'))
+        self.assertEqual([], self.skipped())
+
+    def test_tree_without_stamp(self):
+        # A tree extracted before the stamps existed is not extracted again
+        inst = self.installer()
+        inst.build()
+        marker = os.path.join(inst.dir_path, 'marker')
+        with open(marker, 'w'):
+            pass
+        shutil.rmtree(inst.stamp_dir)
+        inst.build()
+        self.assertIn("extract: recording the stamp of {}\n".format(
+            inst.dir_path), self.stdout.getvalue())
+        self.assertEqual(['extract'], self.skipped())
+        self.assertTrue(os.path.exists(marker))
+
+    def test_failed_extract(self):
+        # A partly extracted tree is removed
+        inst = self.installer()
+        with open(inst.local_file, 'wb') as f:
+            f.write(b'not a tarball')
+        with self.assertRaises(CalledProcessError):
+            inst.build()
+        self.assertFalse(os.path.exists(inst.dir_path))
+
+
+if __name__ == '__main__':
+    unittest.main()
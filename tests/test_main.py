@@ -1,6 +1,9 @@
 # -*- coding:utf-8 -*-
 
+import atexit
+import contextlib
 import json
+from multiprocessing.pool import ThreadPool
 import os.path
 import platform
 import re
@@ -9,8 +12,19 @@ from subprocess import PIPE
 from subprocess import Popen
 import sys
 import tempfile
+import threading
 import unittest
 
+try:
+    from shlex import quote
+except ImportError:
+    from pipes import quote
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
 
 ProjDir = os.path.abspath(
     os.path.join(os.path.dirname(__file__), '..'))
@@ -31,46 +45,144 @@ mpi_vers = {
     'openmpi-2.1.1': '2.1.1',
 }
 
+shell_cmd = os.environ.get('TEST_SHELL_CMD', None) or "bash"
+_enc = sys.getdefaultencoding()
+
+
+class ShellSession(object):
+    """A shell with mpienv loaded, running commands one after another.
+
+    The session has its own MPIENV_VERSIONS_DIR, which is set before
+    `init` is sourced and emptied before every command, so a command
+    does not see the MPIs added by the previous ones. Commands run in a
+    subshell, so `mpienv use` and `export` do not leak either.
+    """
+
+    _done = '__sh_session_done__'
+
+    def __init__(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.ver_dir = os.path.join(self.tmpdir, 'versions')
+        self.out_file = os.path.join(self.tmpdir, 'out')
+        self.err_file = os.path.join(self.tmpdir, 'err')
+
+        env = {k: v for k, v in os.environ.items() if v is not None}
+        env['MPIENV_VERSIONS_DIR'] = self.ver_dir
+        self.proc = Popen([shell_cmd], stdin=PIPE, stdout=PIPE, env=env)
+        self.alive = True
+        if self._run(". {}/init".format(ProjDir)) != 0:
+            self.close()
+            raise RuntimeError("Cannot load mpienv in {}".format(shell_cmd))
+
+    def _run(self, script):
+        self.proc.stdin.write("{} </dev/null >{} 2>{}\necho {} $?\n".format(
+            script, self.out_file, self.err_file, self._done).encode(_enc))
+        self.proc.stdin.flush()
+        while True:
+            line = self.proc.stdout.readline().decode(_enc)
+            if line == '':
+                self.alive = False
+                raise RuntimeError("{} exited unexpectedly".format(shell_cmd))
+            if line.startswith(self._done):
+                return int(line.split()[1])
+
+    def _reset(self):
+        for f in os.listdir(self.ver_dir):
+            path = os.path.join(self.ver_dir, f)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+        os.mkdir(os.path.join(self.ver_dir, 'shims'))
+
+    def run(self, cmd, env={}):
+        self._reset()
+        setenv = ["unset {}".format(k) if v is None else
+                  "export {}={}".format(k, quote(v))
+                  for k, v in sorted(env.items())]
+        ret = self._run("({})".format("; ".join(setenv + ["set -eu", cmd])))
+        with open(self.out_file, 'rb') as f:
+            out = f.read().decode(_enc)
+        with open(self.err_file, 'rb') as f:
+            err = f.read().decode(_enc)
+        return out, err, ret
+
+    def close(self):
+        if self.alive:
+            try:
+                self.proc.communicate(b"exit\n")
+            except (IOError, OSError):
+                pass
+        self.alive = False
+        shutil.rmtree(self.tmpdir)
+
+
+class SessionPool(object):
+    """At most `size` shell sessions, reused by the tests."""
+
+    def __init__(self, size):
+        self.size = size
+        self._idle = queue.Queue()
+        self._slots = threading.Semaphore(size)
+        self._sessions = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def session(self):
+        with self._slots:
+            try:
+                sh = self._idle.get_nowait()
+            except queue.Empty:
+                sh = ShellSession()
+                with self._lock:
+                    self._sessions.append(sh)
+            try:
+                yield sh
+            finally:
+                if sh.alive:
+                    self._idle.put(sh)
+
+    def close(self):
+        with self._lock:
+            for sh in self._sessions:
+                sh.close()
+            self._sessions = []
+
+
+_pool = SessionPool(int(os.environ.get('TEST_SHELL_JOBS', 0)) or
+                    max(2, len(mpi_list)))
+atexit.register(_pool.close)
+
 
 def sh_session(cmd, env={}):
-    env2 = os.environ.copy()
-    env2.update(env)
-    env2 = {k: env2[k] for k in env2 if env2[k] is not None}
+    if isinstance(cmd, list):
+        cmd = " && ".join(cmd)
 
-    shell_cmd = os.environ.get('TEST_SHELL_CMD', None) or "bash"
-    ver_dir = tempfile.mkdtemp()
+    with _pool.session() as sh:
+        out, err, ret = sh.run(cmd, env)
 
-    try:
-        if os.path.exists(ver_dir):
-            os.rmdir
-        if isinstance(cmd, list):
-            cmd = " && ".join(cmd)
-
-        p = Popen([shell_cmd], stdout=PIPE, stdin=PIPE, stderr=PIPE,
-                  env=env2)
-        enc = sys.getdefaultencoding()
-        cmd = (". {}/init;"
-               "export MPIENV_VERSIONS_DIR={};"
-               "set -eu; {}\n".format(ProjDir,
-                                      ver_dir,
-                                      cmd))
-
-        out, err = p.communicate(cmd.encode(enc))
-        ret = p.returncode
+    if ret != 0:
+        print("sh_session(): return code != 0")
+        print("----------------------------------")
+        print("sh_session(): out=")
+        print(out)
+        print("----------------------------------")
+        print("sh_session(): err=")
+        print(err)
+        print("----------------------------------")
+
+    return out, err, ret
 
-        if ret != 0:
-            print("sh_session(): return code != 0")
-            print("----------------------------------")
-            print("sh_session(): out=")
-            print(out.decode(sys.getdefaultencoding()))
-            print("----------------------------------")
-            print("sh_session(): err=")
-            print(err.decode(sys.getdefaultencoding()))
-            print("----------------------------------")
-    finally:
-        shutil.rmtree(ver_dir)
 
-    return out.decode(enc), err.decode(enc), ret
+def sh_sessions(func, cases):
+    """Run `func(case)`, which calls sh_session(), for each case in
+    parallel. Returns the results in the order of `cases`."""
+    pool = ThreadPool(_pool.size)
+    try:
+        return pool.map(func, cases)
+    finally:
+        pool.close()
+        pool.join()
 
 
 class TestList(unittest.TestCase):
@@ -164,19 +276,25 @@ class TestUseMPI4Py(unittest.TestCase):
         mpis = ['mpich-3.2', 'openmpi-2.1.1']
         # mpis = [mpi for mpi in mpi_list if mpi.find("mvapich") == -1]
 
-        cmds = ["mpienv use --mpi4py {};"
-                "mpiexec -n 2 python -c '{}'".format(mpi, prog)
-                for mpi in mpis]
-
-        for pp in ["", None]:
-            out, err, ret = sh_session([
-                'export TMPDIR=/tmp',  # Avoid Open MPI error
-                'mpienv autodiscover --add ~/mpi >/dev/null',
-            ] + cmds, env={'PYTHONPATH': pp})
-
+        def run(case):
+            used, pp = case
+            cmds = ['export TMPDIR=/tmp']  # Avoid Open MPI error
+            cmds += ['mpienv add ~/mpi/{} >/dev/null'.format(mpi)
+                     for mpi in sorted(set(used))]
+            for mpi in used:
+                cmds += ["mpienv use --mpi4py {}".format(mpi),
+                         "mpiexec -n 2 python -c '{}'".format(prog)]
+            return sh_session(cmds, env={'PYTHONPATH': pp})
+
+        # Each MPI alone, and switching between them in the same shell,
+        # which must switch PYTHONPATH too
+        useds = [(mpi,) for mpi in mpis] + [tuple(mpis), tuple(mpis[::-1])]
+        cases = [(used, pp) for used in useds for pp in ["", None]]
+        for case, (out, err, ret) in zip(cases, sh_sessions(run, cases)):
+            print(case, out.strip())
             self.assertEqual(0, ret)
-            print(out.strip())
-            self.assertIsNotNone(re.match(r'^(01|10){2}$', out.strip()))
+            self.assertIsNotNone(re.match(
+                r'^(01|10){{{}}}$'.format(len(case[0])), out.strip()))
 
 
 class TestUseMPI4PyError(unittest.TestCase):
@@ -187,8 +305,8 @@ class TestUseMPI4PyError(unittest.TestCase):
 
         # If `use` is used without --mpi4py option,
         # mpi4py script should cause an error.
-        for pp in ["", None]:
-            out, err, ret = sh_session(
+        def run(pp):
+            return sh_session(
                 ['export TMPDIR=/tmp',  # Avoid Open MPI error
                  'mpienv autodiscover --add ~/mpi >/dev/null',
                  "mpienv use --mpi4py mpich-3.2",
@@ -196,6 +314,7 @@ class TestUseMPI4PyError(unittest.TestCase):
                  "mpiexec -n 2 python -c '{}'".format(prog)],
                 env={'PYTHONPATH': pp})
 
+        for out, err, ret in sh_sessions(run, ["", None]):
             print(out)
             print(err)
             self.assertTrue(ret != 0 or out == "00")
@@ -0,0 +1,451 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import common
+import fakempi
+from mpienv import debug
+from mpienv import stage
+
+
+def _make_prefix(root, name):
+    prefix = os.path.join(root, name)
+    os.makedirs(os.path.join(prefix, 'bin'))
+    mpiexec = os.path.join(prefix, 'bin', 'mpiexec')
+    with open(mpiexec, 'w') as f:
+        f.write("#!/bin/sh\n")
+    os.chmod(mpiexec, 0o755)
+    return prefix
+
+
+class ManagerTestBase(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'root')
+        self.saved_env = os.environ.copy()
+        os.environ.pop('MPIENV_VERSIONS_DIR', None)
+        self.manager = common.Manager(self.root)
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.tmpdir)
+
+    def register(self, name, prefix):
+        self.manager._registry.link(name, prefix)
+        self.manager._invalidate(name)
+
+
+class TestActiveResolver(ManagerTestBase):
+    def setUp(self):
+        super(TestActiveResolver, self).setUp()
+        self.p1 = _make_prefix(self.tmpdir, 'mpi1')
+        self.p2 = _make_prefix(self.tmpdir, 'mpi2')
+        self.register('mpi1', self.p1)
+        self.register('mpi2', self.p2)
+
+    def test_active_name(self):
+        os.environ['PATH'] = os.path.join(self.p2, 'bin')
+        self.assertEqual('mpi2', self.manager.active_name())
+        self.assertEqual('mpi2', self.manager.get_current_name())
+        self.assertFalse(self.manager.is_active_prefix(self.p1))
+
+    def test_symlinked_mpiexec(self):
+        # mpiexec in PATH is a symlink to the installation's mpiexec
+        bin_dir = os.path.join(self.tmpdir, 'shims')
+        os.mkdir(bin_dir)
+        os.symlink(os.path.join(self.p1, 'bin', 'mpiexec'),
+                   os.path.join(bin_dir, 'mpiexec'))
+        os.environ['PATH'] = bin_dir
+        self.assertEqual('mpi1', self.manager.active_name())
+
+    def test_no_mpiexec(self):
+        os.environ['PATH'] = self.tmpdir
+        self.assertIsNone(self.manager.active_name())
+        self.assertRaises(common.UnknownMPI, self.manager.get_current_name)
+
+    def test_path_searched_once(self):
+        os.environ['PATH'] = os.path.join(self.p1, 'bin')
+        calls = []
+        orig = common.find_executable
+
+        def counting(cmd):
+            calls.append(cmd)
+            return orig(cmd)
+
+        common.find_executable = counting
+        try:
+            for _ in range(3):
+                self.manager.active_name()
+                self.manager.is_active_prefix(self.p2)
+        finally:
+            common.find_executable = orig
+        self.assertEqual(['mpiexec'], calls)
+
+
+class TestIdentityIndex(ManagerTestBase):
+    def setUp(self):
+        super(TestIdentityIndex, self).setUp()
+        self.p1 = _make_prefix(self.tmpdir, 'mpi1')
+        self.register('mpi1', self.p1)
+
+        def no_probe(name):
+            raise AssertionError("probed {}".format(name))
+        self.manager.get_info = no_probe
+
+    def test_lookup(self):
+        self.assertEqual('mpi1', self.manager.is_installed(self.p1))
+
+        # The same installation reached through a symlink
+        link = os.path.join(self.tmpdir, 'link')
+        os.symlink(self.p1, link)
+        self.assertEqual('mpi1', self.manager.is_installed(link))
+
+        p2 = _make_prefix(self.tmpdir, 'mpi2')
+        self.assertIsNone(self.manager.is_installed(p2))
+
+    def test_rename_and_rm(self):
+        self.assertEqual('mpi1', self.manager.is_installed(self.p1))
+
+        self.manager.rename('mpi1', 'renamed')
+        self.assertEqual('renamed', self.manager.is_installed(self.p1))
+
+        self.manager.get_info = lambda name: {'broken': False,
+                                              'active': False}
+        self.manager.rm('renamed')
+        self.assertIsNone(self.manager.is_installed(self.p1))
+
+
+class TestProbeMemo(ManagerTestBase):
+    def setUp(self):
+        super(TestProbeMemo, self).setUp()
+        self.p1 = _make_prefix(self.tmpdir, 'mpi1')
+        self.register('mpi1', self.p1)
+        self.probed = []
+
+        def fake_probe(prefix):
+            self.probed.append(prefix)
+            return {'type': 'Open MPI', 'active': False}
+        self.manager.get_info_from_prefix = fake_probe
+
+    def test_probed_once(self):
+        info = self.manager.get_info('mpi1')
+        info['name'] = 'mutated'
+        self.manager.get_info(self.p1)
+        # Callers get their own copy of the memoized result
+        self.assertNotIn('name', self.manager.get_info('mpi1'))
+        self.assertEqual(1, len(self.probed))
+
+    def test_refresh(self):
+        self.manager.get_info('mpi1')
+        self.manager.refresh('mpi1')
+        self.manager.get_info('mpi1')
+        self.manager.refresh()
+        self.manager.get_info('mpi1')
+        self.assertEqual(3, len(self.probed))
+
+
+class TestRecords(ManagerTestBase):
+    def setUp(self):
+        super(TestRecords, self).setUp()
+        self.p1 = _make_prefix(self.tmpdir, 'mpi1')
+        self.register('mpi1', self.p1)
+        self.probed = []
+
+    def new_manager(self):
+        def fake_probe(prefix):
+            self.probed.append(prefix)
+            return {'type': 'Open MPI', 'prefix': prefix, 'active': False}
+        manager = common.Manager(self.root)
+        manager.get_info_from_prefix = fake_probe
+        return manager
+
+    def test_migrate_and_reuse(self):
+        # A registry with symlinks only is probed once and recorded
+        self.assertEqual('Open MPI', self.new_manager()['mpi1']['type'])
+        record = self.manager._registry.records()['mpi1']
+        self.assertIn('added_at', record)
+        self.assertNotIn('active', record['info'])
+
+        info = self.new_manager()['mpi1']
+        self.assertEqual('Open MPI', info['type'])
+        self.assertFalse(info['active'])
+        self.assertEqual(1, len(self.probed))
+
+    def test_stale_record(self):
+        self.new_manager()['mpi1']
+        added_at = self.manager._registry.records()['mpi1']['added_at']
+
+        # Replacing mpiexec invalidates the record
+        mpiexec = os.path.join(self.p1, 'bin', 'mpiexec')
+        os.remove(mpiexec)
+        with open(mpiexec, 'w') as f:
+            f.write("#!/bin/sh\n# rebuilt\n")
+        self.new_manager()['mpi1']
+        self.assertEqual(2, len(self.probed))
+        self.assertEqual(added_at,
+                         self.manager._registry.records()['mpi1']['added_at'])
+
+
+class TestQuarantine(ManagerTestBase):
+    def setUp(self):
+        super(TestQuarantine, self).setUp()
+        self.p1 = _make_prefix(self.tmpdir, 'mpi1')
+        self.register('mpi1', self.p1)
+        self.probed = []
+        self.hang = True
+
+    def new_manager(self):
+        def fake_probe(prefix):
+            self.probed.append(prefix)
+            if self.hang:
+                raise common.ProbeTimeout("mpiexec did not finish")
+            return {'type': 'MPICH', 'prefix': prefix, 'active': False}
+        manager = common.Manager(self.root)
+        manager.get_info_from_prefix = fake_probe
+        return manager
+
+    def expire(self):
+        # Move the end of the backoff to the past
+        records = self.manager._registry.records()
+        records['mpi1']['quarantine']['until'] = 0
+        self.manager._registry.update_records(records)
+
+    def test_quarantine(self):
+        info = self.new_manager()['mpi1']
+        self.assertTrue(info['broken'])
+        self.assertTrue(info['quarantined'])
+        self.assertEqual("mpiexec did not finish", info['error'])
+        self.assertEqual(['mpi1'], list(self.new_manager().quarantined()))
+
+        # Not probed again during the backoff
+        self.assertTrue(self.new_manager()['mpi1']['quarantined'])
+        self.assertEqual(1, len(self.probed))
+
+        # The backoff doubles after each failure
+        self.expire()
+        info = self.new_manager()['mpi1']
+        self.assertEqual(2, info['failures'])
+        self.assertEqual(2, len(self.probed))
+
+        # Recovered
+        self.expire()
+        self.hang = False
+        info = self.new_manager()['mpi1']
+        self.assertEqual('MPICH', info['type'])
+        self.assertEqual({}, self.new_manager().quarantined())
+
+    def test_unexpected_output(self):
+        # An output the parser does not understand is a probe failure
+        mpiexec = os.path.join(self.p1, 'bin', 'mpiexec')
+        with open(mpiexec, 'w') as f:
+            f.write("#!/bin/sh\necho 'HYDRA build details:'\n")
+        info = common.Manager(self.root)['mpi1']
+        self.assertTrue(info['quarantined'])
+        self.assertEqual("cannot find the configure options in the output "
+                         "of the probe", info['error'])
+
+    def test_bug(self):
+        # Errors of the probe code itself are not quarantined
+        manager = common.Manager(self.root)
+
+        def buggy_probe(prefix):
+            return None.group(1)
+        manager.get_info_from_prefix = buggy_probe
+        with self.assertRaises(AttributeError):
+            manager['mpi1']
+        self.assertEqual({}, self.new_manager().quarantined())
+
+    def test_changed_installation(self):
+        self.new_manager()['mpi1']
+        mpiexec = os.path.join(self.p1, 'bin', 'mpiexec')
+        os.remove(mpiexec)
+        with open(mpiexec, 'w') as f:
+            f.write("#!/bin/sh\n# rebuilt\n")
+        self.hang = False
+        self.assertEqual('MPICH', self.new_manager()['mpi1']['type'])
+        self.assertEqual(2, len(self.probed))
+
+    def test_others_load(self):
+        p2 = _make_prefix(self.tmpdir, 'mpi2')
+        self.register('mpi2', p2)
+        manager = self.new_manager()
+        probe = manager.get_info_from_prefix
+
+        def fake_probe(prefix):
+            if prefix == manager.prefix('mpi2'):
+                return {'type': 'Open MPI', 'prefix': p2, 'active': False}
+            return probe(prefix)
+        manager.get_info_from_prefix = fake_probe
+        infos = dict(manager.items(npar=2))
+        self.assertTrue(infos['mpi1']['quarantined'])
+        self.assertEqual('Open MPI', infos['mpi2']['type'])
+
+
+class TestListing(ManagerTestBase):
+    def setUp(self):
+        super(TestListing, self).setUp()
+        self.prefixes = {}
+        for i in range(10):
+            name = 'mpi{}'.format(i)
+            self.prefixes[name] = _make_prefix(self.tmpdir, name)
+            self.register(name, self.prefixes[name])
+        # Several names for one installation
+        self.register('alias', self.prefixes['mpi0'])
+        self.probed = []
+
+        def fake_probe(prefix):
+            self.probed.append(prefix)
+            return {'type': 'MPICH', 'prefix': prefix, 'active': False}
+        self.manager.get_info_from_prefix = fake_probe
+
+    def test_registered(self):
+        prefixes = self.manager.registered()
+        self.assertEqual(self.prefixes['mpi0'], prefixes['alias'])
+        self.assertEqual(11, len(prefixes))
+        self.assertEqual([], self.probed)
+
+    def test_parallel_items(self):
+        infos = dict(self.manager.items(npar=4))
+        self.assertEqual(sorted(self.manager.keys()), sorted(infos))
+        self.assertEqual('alias', infos['alias']['name'])
+        self.assertEqual(10, len(self.probed))
+
+
+class TestFakeMPI(ManagerTestBase):
+    def setUp(self):
+        super(TestFakeMPI, self).setUp()
+        self.prefixes = {}
+        for flavor in fakempi.flavors:
+            self.prefixes[flavor] = fakempi.make_mpi(
+                os.path.join(self.tmpdir, flavor), flavor)
+        os.environ['PATH'] = '/usr/bin:/bin'
+
+    def activate(self, prefix):
+        os.environ['PATH'] = os.path.join(prefix, 'bin') + ':/usr/bin:/bin'
+        self.manager._active_mpiexec = self.manager._active_name = False
+
+    def test_probe(self):
+        expected = {
+            'openmpi': ('Open MPI', '2.1.1', 'openmpi-2.1.1'),
+            'mpich': ('MPICH', '3.2', 'mpich-3.2'),
+            'mvapich': ('MVAPICH', '2.2', 'mvapich2-2.2'),
+        }
+        for flavor, prefix in self.prefixes.items():
+            info = self.manager.get_info(prefix)
+            self.assertEqual(expected[flavor],
+                             (info['type'], info['version'],
+                              info['default_name']))
+        info = self.manager.get_info(self.prefixes['mvapich'])
+        self.assertEqual('3.2', info['mpich_ver'])
+
+    def test_ompi_info_cache(self):
+        prefix = self.prefixes['openmpi']
+        counters = debug.counters
+        debug.counters = {}
+        try:
+            self.manager.get_info_from_prefix(prefix)
+            self.manager.get_info_from_prefix(prefix)
+            self.assertEqual(1, debug.counters['subprocess:ompi_info'])
+        finally:
+            debug.counters = counters
+
+    def test_probe_timeout(self):
+        prefix = self.prefixes['mpich']
+        hydra = os.path.join(prefix, 'bin', 'mpiexec.hydra')
+        with open(hydra, 'w') as f:
+            f.write("#!/bin/sh\nsleep 60 &\nsleep 60\n")
+        os.environ['MPIENV_PROBE_TIMEOUT'] = '0.2'
+        with self.assertRaises(common.ProbeTimeout):
+            self.manager.get_info(prefix)
+
+    def test_exec_staged(self):
+        self.manager.add(self.prefixes['openmpi'])
+        prefix = self.prefixes['openmpi']
+        os.makedirs(os.path.join(prefix, 'lib64'))
+        self.activate(prefix)
+        os.environ['MPIENV_STAGE_DIR'] = os.path.join(self.tmpdir, 'local')
+        os.environ['LD_LIBRARY_PATH'] = '/usr/lib'
+        staged = stage.stage(self.manager.stage_dir(), 'openmpi-2.1.1',
+                             self.manager['openmpi-2.1.1'])
+
+        argv, env, pref = self.manager.exec_args(['a.out'])
+        self.assertEqual(staged, pref)
+        self.assertEqual(['--prefix', staged], argv[-3:-1])
+        self.assertEqual(':'.join([os.path.join(staged, 'lib'),
+                                   os.path.join(staged, 'lib64'),
+                                   '/usr/lib']),
+                         env['LD_LIBRARY_PATH'])
+        self.assertEqual(staged, env['OPAL_PREFIX'])
+
+    def test_add_name(self):
+        self.assertEqual('my-mpi', self.manager.add(self.prefixes['mpich'],
+                                                    'my-mpi'))
+        self.assertEqual(['my-mpi'], sorted(self.manager.keys()))
+
+    def test_add_many(self):
+        others = [fakempi.make_openmpi(os.path.join(self.tmpdir, str(i)))
+                  for i in range(3)]
+        empty = os.path.join(self.tmpdir, 'empty')
+        os.mkdir(empty)
+
+        self.manager.add(others[2])
+        self.assertRaises(RuntimeError, self.manager.add_many,
+                          [others[0], others[1], empty])
+        self.assertEqual(['openmpi-2.1.1'], sorted(self.manager.keys()))
+
+        prefixes = [self.prefixes['openmpi'], self.prefixes['mpich'],
+                    others[1], others[0], others[0] + '/']
+        self.assertRaises(RuntimeError, self.manager.add_many, others)
+        added = self.manager.add_many(prefixes, npar=4, skip_existing=True)
+        self.assertEqual([(self.prefixes['openmpi'], 'openmpi-2.1.1-2'),
+                          (self.prefixes['mpich'], 'mpich-3.2'),
+                          (others[1], 'openmpi-2.1.1-3'),
+                          (others[0], 'openmpi-2.1.1-4')], added)
+        for prefix, name in added:
+            self.assertEqual(name, self.manager.is_installed(prefix))
+            self.assertEqual(os.path.realpath(prefix),
+                             self.manager.get_info(name)['prefix'])
+
+    def test_use(self):
+        names = {f: self.manager.add(p) for f, p in self.prefixes.items()}
+        shims = self.manager.shims_dir()
+
+        self.manager.use(names['openmpi'])
+        for f in ['bin/mpiexec', 'bin/ompi_info', 'lib/libmpi.so',
+                  'include/mpi.h']:
+            self.assertTrue(os.path.exists(os.path.join(shims, f)), f)
+
+        self.manager.use(names['mvapich'])
+        for f in ['bin/mpiexec.hydra', 'lib/libmpi.so.12',
+                  'libexec/osu-micro-benchmarks']:
+            self.assertTrue(os.path.exists(os.path.join(shims, f)), f)
+        self.assertFalse(os.path.exists(os.path.join(shims, 'bin',
+                                                     'ompi_info')))
+
+    def test_exec_args(self):
+        name = self.manager.add(self.prefixes['openmpi'])
+        prefix = self.prefixes['openmpi']
+        self.activate(prefix)
+        os.environ['OMPI_MCA_btl'] = 'self'
+
+        argv, env, pref = self.manager.exec_args(['-n', '2', 'a.out'])
+        self.assertEqual(os.path.join(prefix, 'bin', 'orterun'), argv[0])
+        self.assertEqual(['-n', '2', 'a.out'], argv[-3:])
+        self.assertEqual(['--prefix', prefix], argv[-5:-3])
+        for var in ['PATH', 'OMPI_MCA_btl']:
+            self.assertEqual('-x', argv[argv.index(var) - 1])
+        self.assertEqual(prefix, pref)
+        self.assertEqual(name, self.manager.get_current_name())
+
+        self.manager.add(self.prefixes['mpich'])
+        prefix = self.prefixes['mpich']
+        self.activate(prefix)
+        argv, env, pref = self.manager.exec_args(['a.out'])
+        self.assertEqual([os.path.join(prefix, 'bin', 'mpiexec.hydra'),
+                          '-genvlist', 'PATH,LD_LIBRARY_PATH,PYTHONPATH',
+                          'a.out'], argv)
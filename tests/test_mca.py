@@ -0,0 +1,95 @@
+# coding: utf-8
+
+import json
+import os
+import os.path
+import shutil
+from subprocess import PIPE
+from subprocess import Popen
+import sys
+import tempfile
+import unittest
+
+import fakempi
+
+ProjDir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..'))
+
+
+class TestMca(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.env = {k: v for k, v in os.environ.items()
+                    if not k.startswith('OMPI_MCA_')}
+        self.env.update({
+            'HOME': self.tmpdir,
+            'MPIENV_ROOT': os.path.join(self.tmpdir, 'root'),
+            'MPIENV_VERSIONS_DIR': os.path.join(self.tmpdir, 'versions'),
+            'MPIENV_CACHE_DIR': os.path.join(self.tmpdir, 'cache'),
+            'PYTHONPATH': ProjDir,
+        })
+        self.prefixes = {}
+        for name, flavor, version in [('ompi2', 'openmpi', '2.1.1'),
+                                      ('ompi3', 'openmpi', '3.1.0'),
+                                      ('mpich', 'mpich', '3.2')]:
+            self.prefixes[name] = fakempi.make_mpi(
+                os.path.join(self.tmpdir, name), flavor, version)
+            self.run_bin('add.py', '-n', name, self.prefixes[name])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def run_bin(self, script, *args, **kwargs):
+        p = Popen([sys.executable, os.path.join(ProjDir, 'bin', script)] +
+                  list(args), stdout=PIPE, stderr=PIPE, env=self.env)
+        out, err = p.communicate()
+        self.assertEqual(kwargs.get('status', 0), p.returncode, err)
+        return out.decode()
+
+    def mca(self, *args, **kwargs):
+        return self.run_bin('mca.py', *args, **kwargs)
+
+    def test_params(self):
+        out = self.mca('ompi2', 'pml_*_priority')
+        self.assertEqual("ompi2:\n"
+                         "  pml_ob1_priority = 20  (pml/ob1, default)\n"
+                         "  pml_ucx_priority = 51  (pml/ucx, default)\n",
+                         out)
+        self.mca('mpich', status=255)
+
+    def test_all(self):
+        out = self.mca('--all', 'btl_tcp_if_*')
+        self.assertEqual("ompi2:\n"
+                         "  btl_tcp_if_include =   (btl/tcp, default)\n"
+                         "ompi3:\n"
+                         "  btl_tcp_if_include =   (btl/tcp, default)\n",
+                         out)
+
+    def test_components(self):
+        out = self.mca('-c', 'ompi3', 'b*')
+        self.assertEqual("ompi3:\n  btl  self tcp vader\n", out)
+
+    def test_json(self):
+        out = json.loads(self.mca('--json', '--all', '-c', '*'))
+        self.assertEqual({'ompi2', 'ompi3'}, set(out))
+        self.assertEqual(['ob1', 'ucx'], out['ompi2']['pml'])
+
+        out = json.loads(self.mca('--json', 'ompi2', 'btl_self_*'))
+        self.assertEqual([{'framework': 'btl', 'component': 'self',
+                           'name': 'btl_self_eager_limit',
+                           'value': 1024, 'source': 'default',
+                           'type': 'size_t'}], out['ompi2'])
+
+    def test_changed_params(self):
+        # The cached ompi_info is not used after the parameters change
+        self.mca('ompi2', 'btl_tcp_if_include')
+        conf = os.path.join(self.prefixes['ompi2'], 'etc',
+                            'openmpi-mca-params.conf')
+        with open(conf, 'w') as f:
+            f.write("btl_tcp_if_include = eth0\n")
+        self.assertIn("btl_tcp_if_include = eth0  (btl/tcp, file)",
+                      self.mca('ompi2', 'btl_tcp_if_include'))
+
+        self.env['OMPI_MCA_btl_tcp_if_include'] = 'ib0'
+        self.assertIn("btl_tcp_if_include = ib0  (btl/tcp, environment)",
+                      self.mca('ompi2', 'btl_tcp_if_include'))
@@ -1,7 +1,13 @@
 # coding: utf-8
 
+import os
+import os.path
+import shutil
+import tempfile
 import unittest
 
+from fakempi import make_openmpi
+from fakempi import ompi_info_output
 import mpienv.ompi as ompi
 
 
@@ -50,4 +56,140 @@ class TestOmpi(unittest.TestCase):
         info = ompi.parse_ompi_info(Text)
         self.assertEqual("2.1.1", info.get('ident'))
         self.assertEqual("2.1.1", info.get('ompi:version:full'))
-        self.assertEqual("77", info.get('compiler:fortran:value:true'))
+        self.assertEqual(77, info.get('compiler:fortran:value:true'))
+        self.assertEqual(True, info.get(
+            'mca:mca:base:param:mca_component_show_load_errors:value'))
+        self.assertEqual(
+            "/Users/keisukefukuda/mpi/openmpi-2.1.1/lib/openmpi:"
+            "/Users/keisukefukuda/.openmpi/components",
+            info.get('mca:mca:base:param:mca_component_path:value'))
+        self.assertEqual("May 10, 2017",
+                         info.get('ompi:version:release_date'))
+        self.assertIsNone(info.get('no:such:key'))
+
+    def test_interned_keys(self):
+        a = ompi.parse_ompi_info(Text)
+        b = ompi.parse_ompi_info(Text)
+        ka = [k for k, _ in a.items() if 'mca_param_files' in k][0]
+        kb = [k for k, _ in b.items() if 'mca_param_files' in k][0]
+        for sa, sb in zip(ka, kb):
+            self.assertIs(sa, sb)
+
+    def test_dumps(self):
+        info = ompi.parse_ompi_info(Text)
+        loaded = ompi.OmpiInfo.loads(info.dumps())
+        self.assertEqual(len(info), len(loaded))
+        self.assertEqual(sorted(info.items()), sorted(loaded.items()))
+
+
+class TestOmpiInfoTree(unittest.TestCase):
+    def setUp(self):
+        self.info = ompi.parse_ompi_info(
+            ompi_info_output('/opt/openmpi', '2.1.1', nparams=2))
+
+    def test_children(self):
+        self.assertEqual(['btl', 'mca', 'opal', 'pml'],
+                         self.info.frameworks())
+        self.assertEqual(['self', 'tcp', 'vader'],
+                         self.info.components('btl'))
+        self.assertEqual(['full', 'repo'],
+                         self.info.children('ompi:version'))
+        self.assertEqual([], self.info.children('no:such'))
+
+    def test_subtree(self):
+        self.assertEqual(
+            [(('mca', 'pml', 'ob1', 'param', 'pml_ob1_priority', 'source'),
+              'default'),
+             (('mca', 'pml', 'ob1', 'param', 'pml_ob1_priority', 'type'),
+              'int'),
+             (('mca', 'pml', 'ob1', 'param', 'pml_ob1_priority', 'value'),
+              20)],
+            self.info.subtree('mca:pml:ob1'))
+        self.assertEqual(len(self.info), len(self.info.subtree()))
+
+        # The tree follows modifications
+        self.info.set('mca:pml:ob1:param:pml_ob1_priority:value', 30)
+        self.assertEqual(30, self.info.subtree(
+            'mca:pml:ob1:param:pml_ob1_priority:value')[0][1])
+
+    def test_mca_params(self):
+        params = self.info.mca_params('pml_*_priority')
+        self.assertEqual(['pml_ob1_priority', 'pml_ucx_priority'],
+                         [p['name'] for p in params])
+        self.assertEqual({'framework': 'pml', 'component': 'ucx',
+                          'name': 'pml_ucx_priority', 'value': 51,
+                          'source': 'default', 'type': 'int'}, params[1])
+        self.assertEqual(2 + 4, len(self.info.mca_params('btl_*')))
+        self.assertEqual([], self.info.mca_params('no_such_*'))
+
+
+class TestOmpiInfoCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = make_openmpi(os.path.join(self.tmpdir, 'openmpi'))
+        self.bin = os.path.join(self.prefix, 'bin', 'ompi_info')
+        self.cache = ompi.OmpiInfoCache(os.path.join(self.tmpdir, 'cache'))
+        self.saved_env = os.environ.copy()
+        os.environ['HOME'] = self.tmpdir
+        for var in list(os.environ):
+            if var.startswith('OMPI_MCA_'):
+                del os.environ[var]
+
+    def tearDown(self):
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.tmpdir)
+
+    def test_cache(self):
+        self.assertIsNone(self.cache.load(self.bin))
+
+        info = ompi.parse_ompi_info(Text)
+        self.cache.save(self.bin, info)
+        self.assertEqual(sorted(info.items()),
+                         sorted(self.cache.load(self.bin).items()))
+
+        # A new component invalidates the entry
+        os.mkdir(os.path.join(self.prefix, 'lib', 'openmpi', 'x'))
+        self.assertIsNone(self.cache.load(self.bin))
+
+        self.cache.save(self.bin, info)
+        with open(self.cache.path(self.bin), 'wb') as f:
+            f.write(b'garbage')
+        self.assertIsNone(self.cache.load(self.bin))
+
+    def test_mca_params(self):
+        # Where the values of the parameters come from
+        info = ompi.parse_ompi_info(Text)
+        conf = os.path.join(self.prefix, 'etc', 'openmpi-mca-params.conf')
+        user_conf = os.path.join(self.tmpdir, '.openmpi', 'mca-params.conf')
+        self.cache.save(self.bin, info)
+        with open(conf, 'a') as f:
+            f.write("btl_tcp_if_include = eth0\n")
+        self.assertIsNone(self.cache.load(self.bin))
+
+        self.cache.save(self.bin, info)
+        os.makedirs(os.path.dirname(user_conf))
+        with open(user_conf, 'w') as f:
+            f.write("btl = self,tcp\n")
+        self.assertIsNone(self.cache.load(self.bin))
+
+        self.cache.save(self.bin, info)
+        os.environ['OMPI_MCA_pml_ucx_priority'] = '5'
+        self.assertIsNone(self.cache.load(self.bin))
+        self.cache.save(self.bin, info)
+        self.assertIsNotNone(self.cache.load(self.bin))
+
+    def test_fresh_parse(self):
+        import common
+
+        key = 'mca:btl:tcp:param:btl_tcp_if_include'
+        cache_dir = os.path.join(self.tmpdir, 'cache')
+        ompi_info = common._call_ompi_info(self.bin, cache_dir)
+        self.assertEqual('default', ompi_info.get(key + ':source'))
+
+        conf = os.path.join(self.prefix, 'etc', 'openmpi-mca-params.conf')
+        with open(conf, 'w') as f:
+            f.write("btl_tcp_if_include = eth0\n")
+        ompi_info = common._call_ompi_info(self.bin, cache_dir)
+        self.assertEqual('eth0', ompi_info.get(key + ':value'))
+        self.assertEqual('file', ompi_info.get(key + ':source'))
@@ -0,0 +1,125 @@
+# coding: utf-8
+
+import argparse
+import os
+import os.path
+import shutil
+import sys
+import tempfile
+import unittest
+
+import common
+import fakempi
+
+ProjDir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..'))
+# Appended, so that the scripts in bin/ do not shadow other modules
+sys.path.append(os.path.join(ProjDir, 'bin'))
+
+import prebuild  # NOQA
+
+
+class FakeMPI4Py(object):
+    """MPI4Py whose wheel directories and failures are set by the test."""
+    wheel_dirs = {}
+    errors = {}
+    installed = []
+
+    def __init__(self, mgr, name):
+        self._name = name
+
+    def is_installed(self):
+        return self._name in self.installed
+
+    def wheel_dir(self):
+        if self._name not in self.wheel_dirs:
+            raise RuntimeError("cannot probe '{}'".format(self._name))
+        return self.wheel_dirs[self._name]
+
+    def install(self, log=None):
+        log.write("building for {}\n".format(self._name))
+        if self._name in self.errors:
+            raise self.errors[self._name]
+        self.wheel_dir()
+        self.installed.append(self._name)
+
+
+class TestPrebuild(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved_env = os.environ.copy()
+        os.environ.pop('MPIENV_VERSIONS_DIR', None)
+        os.environ['MPIENV_CACHE_DIR'] = os.path.join(self.tmpdir, 'cache')
+        self.manager = common.Manager(os.path.join(self.tmpdir, 'root'))
+        for name in ['a', 'b', 'c']:
+            prefix = fakempi.make_mpi(os.path.join(self.tmpdir, name),
+                                      'openmpi')
+            self.manager._registry.link(name, prefix)
+            self.manager._invalidate(name)
+
+        self.saved = prebuild.manager, prebuild.MPI4Py
+        prebuild.manager = self.manager
+        prebuild.MPI4Py = FakeMPI4Py
+        FakeMPI4Py.wheel_dirs = {'a': 'w1', 'b': 'w2', 'c': 'w1'}
+        FakeMPI4Py.errors = {}
+        FakeMPI4Py.installed = []
+
+    def tearDown(self):
+        prebuild.manager, prebuild.MPI4Py = self.saved
+        os.environ.clear()
+        os.environ.update(self.saved_env)
+        shutil.rmtree(self.tmpdir)
+
+    def prebuild(self, *names):
+        args = argparse.Namespace(all=not names, npar=2, names=list(names))
+        prebuild._prebuild(args)
+
+    def read_log(self, name):
+        with open(prebuild._log_path(name)) as f:
+            return f.read()
+
+    def test_groups(self):
+        # MPIs with the same wheel directory are built one after another
+        self.assertEqual([['a', 'c'], ['b']],
+                         prebuild._groups(['a', 'b', 'c']))
+
+    def test_groups_unknown_wheel(self):
+        # An MPI that cannot be probed is built alone
+        del FakeMPI4Py.wheel_dirs['a']
+        FakeMPI4Py.wheel_dirs['c'] = 'w2'
+        self.assertEqual([['a'], ['b', 'c']],
+                         prebuild._groups(['a', 'b', 'c']))
+
+    def test_prebuild(self):
+        self.prebuild()
+        self.assertEqual(['a', 'b', 'c'], sorted(FakeMPI4Py.installed))
+        self.assertEqual("building for b\n", self.read_log('b'))
+
+    def test_skip_installed(self):
+        FakeMPI4Py.installed = ['b']
+        self.prebuild('a', 'b')
+        self.assertEqual(['b', 'a'], FakeMPI4Py.installed)
+        self.assertFalse(os.path.exists(prebuild._log_path('b')))
+
+    def test_failure(self):
+        # The errors are logged and the other builds go on
+        FakeMPI4Py.errors = {'a': RuntimeError("no fingerprint")}
+        del FakeMPI4Py.wheel_dirs['b']
+        with self.assertRaises(SystemExit):
+            self.prebuild()
+        self.assertEqual(['c'], FakeMPI4Py.installed)
+        self.assertIn("RuntimeError: no fingerprint", self.read_log('a'))
+        self.assertIn("RuntimeError: cannot probe 'b'", self.read_log('b'))
+
+    def test_build_group(self):
+        FakeMPI4Py.errors = {'a': OSError("no compiler")}
+        os.makedirs(prebuild._log_dir())
+        results = prebuild._build_group(['a', 'c'])
+        self.assertEqual([('a', 'failed'), ('c', 'ok')],
+                         [r[:2] for r in results])
+        self.assertEqual([prebuild._log_path(n) for n in ['a', 'c']],
+                         [r[3] for r in results])
+
+
+if __name__ == '__main__':
+    unittest.main()
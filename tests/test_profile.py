@@ -0,0 +1,68 @@
+# coding: utf-8
+
+import json
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from mpienv import debug
+from mpienv import profile
+
+
+class TestProfile(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.saved = profile.enabled, list(profile._events)
+        del profile._events[:]
+
+    def tearDown(self):
+        profile.enabled = self.saved[0]
+        profile._events[:] = self.saved[1]
+        shutil.rmtree(self.tmpdir)
+
+    def test_disabled(self):
+        profile.enabled = False
+        n = debug.counters.get('subprocess', 0)
+        self.assertIs(profile.span('x'), profile.span('y', 'glob'))
+        with profile.command(['/bin/true']):
+            pass
+        self.assertEqual([], profile._events)
+        # Subprocesses are counted all the same
+        self.assertEqual(n + 1, debug.counters['subprocess'])
+
+    def test_write(self):
+        profile.enabled = True
+        with profile.span('use'):
+            with profile.command(['/usr/bin/ompi_info', '--all']):
+                pass
+        try:
+            with profile.span('probe', 'probe', prefix='/usr'):
+                raise ValueError()
+        except ValueError:
+            pass
+
+        path = os.path.join(self.tmpdir, 'trace.json')
+        profile.write(path)
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        self.assertEqual(['command', 'subprocess', 'phase', 'probe'],
+                         [e['cat'] for e in events])
+        self.assertEqual('ompi_info', events[1]['name'])
+        self.assertEqual('ValueError', events[3]['args']['error'])
+        for e in events:
+            self.assertEqual('X', e['ph'])
+            self.assertGreaterEqual(e['dur'], 0)
+
+        with open(path + '.txt') as f:
+            summary = f.read()
+        self.assertIn('ompi_info', summary)
+
+        # A directory gets a file per command
+        profile.write(self.tmpdir)
+        self.assertEqual(4, len(os.listdir(self.tmpdir)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+# coding: utf-8
+
+import multiprocessing
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from mpienv.registry import Registry
+from mpienv.registry import RegistryError
+
+
+def _worker(args):
+    vers_dir, target, i = args
+    reg = Registry(vers_dir)
+    for k in range(10):
+        name = 'w{}-{}'.format(i, k)
+        reg.link(name, target)
+        reg.rename(name, name + 'r')
+        if k % 2 == 0:
+            reg.remove(name + 'r')
+        # Readers must never see temporary entries
+        for n in reg.snapshot():
+            assert not n.startswith('.'), n
+
+
+class TestRegistry(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.vers_dir = os.path.join(self.tmpdir, 'versions')
+        self.target = os.path.join(self.tmpdir, 'mpich-3.2')
+        os.makedirs(os.path.join(self.target, 'bin'))
+        self.reg = Registry(self.vers_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_link_rename_remove(self):
+        self.reg.link('a', self.target)
+        self.assertEqual({'a': self.target}, self.reg.snapshot())
+
+        self.assertRaises(RegistryError, self.reg.link, 'a', self.target)
+
+        self.reg.link('b', self.target)
+        self.assertRaises(RegistryError, self.reg.rename, 'a', 'b')
+        self.reg.rename('a', 'c')
+        self.assertEqual(['b', 'c'], sorted(self.reg.snapshot()))
+
+        self.reg.remove('b')
+        self.assertRaises(RegistryError, self.reg.remove, 'b')
+        self.assertEqual(['c'], sorted(self.reg.snapshot()))
+
+        # The registered directory itself is untouched
+        self.assertTrue(os.path.isdir(self.target))
+        self.assertEqual(0, self.reg.generation() % 2)
+
+    def test_records(self):
+        self.assertEqual({}, self.reg.records())
+
+        self.reg.link('a', self.target, {'added_at': 1.0})
+        self.reg.link('b', self.target)
+        self.assertEqual({'a': {'added_at': 1.0}}, self.reg.records())
+
+        self.reg.update_records({'b': {'added_at': 2.0}, 'x': {}})
+        self.assertEqual(['a', 'b'], sorted(self.reg.records()))
+
+        self.reg.rename('a', 'c')
+        self.reg.remove('b')
+        self.assertEqual({'c': {'added_at': 1.0}}, self.reg.records())
+
+    def test_link_many(self):
+        self.reg.link('b', self.target)
+        gen = self.reg.generation()
+
+        # 'b' exists: nothing is registered
+        self.assertRaises(RegistryError, self.reg.link_many,
+                          [('a', self.target, {'added_at': 1.0}),
+                           ('b', self.target, None)])
+        self.assertEqual(['b'], sorted(self.reg.snapshot()))
+        self.assertEqual({}, self.reg.records())
+
+        self.reg.link_many([('a', self.target, {'added_at': 1.0}),
+                            ('c', self.target, None)])
+        self.assertEqual(['a', 'b', 'c'], sorted(self.reg.snapshot()))
+        self.assertEqual({'a': {'added_at': 1.0}}, self.reg.records())
+        self.assertEqual(gen + 4, self.reg.generation())
+
+    def test_records_unknown_version(self):
+        os.makedirs(self.vers_dir)
+        with open(os.path.join(self.vers_dir, 'registry.json'), 'w') as f:
+            f.write('{"version": 999, "mpi": {"a": {}}}')
+        self.assertEqual({}, self.reg.records())
+
+    def test_replace_shims(self):
+        def build(label):
+            def _build(path):
+                with open(os.path.join(path, 'label'), 'w') as f:
+                    f.write(label)
+            return _build
+
+        shims = os.path.join(self.vers_dir, 'shims')
+        os.makedirs(shims)  # a plain directory created by `init`
+
+        for label in ['x', 'y', 'z']:
+            self.reg.replace_shims(build(label))
+            with open(os.path.join(shims, 'label')) as f:
+                self.assertEqual(label, f.read())
+
+        self.assertTrue(os.path.islink(shims))
+        # The current and the previous shims are kept
+        kept = [n for n in os.listdir(self.vers_dir)
+                if n.startswith('.shims-')]
+        self.assertEqual(2, len(kept))
+
+    def test_concurrent_mutations(self):
+        pool = multiprocessing.Pool(8)
+        try:
+            pool.map(_worker, [(self.vers_dir, self.target, i)
+                               for i in range(8)])
+        finally:
+            pool.close()
+            pool.join()
+
+        expected = sorted('w{}-{}r'.format(i, k)
+                          for i in range(8) for k in range(10) if k % 2)
+        self.assertEqual(expected, sorted(self.reg.snapshot()))
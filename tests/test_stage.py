@@ -0,0 +1,115 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+import mpienv.fingerprint as fingerprint
+import mpienv.stage as stage
+
+
+class TestStage(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.prefix = os.path.join(self.tmpdir, 'mpich-3.2')
+        for d in ['bin', 'lib', 'include', 'share/man']:
+            os.makedirs(os.path.join(self.prefix, d))
+        with open(os.path.join(self.prefix, 'bin', 'mpiexec.hydra'),
+                  'w') as f:
+            f.write('#!/bin/sh\n')
+        os.symlink('mpiexec.hydra',
+                   os.path.join(self.prefix, 'bin', 'mpiexec'))
+        with open(os.path.join(self.prefix, 'lib', 'libmpi.so.12'),
+                  'wb') as f:
+            f.write(b'libmpi')
+        self.info = {'type': 'MPICH', 'version': '3.2',
+                     'prefix': self.prefix}
+        self.stage_dir = os.path.join(self.tmpdir, 'local')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_stage(self):
+        self.assertIsNone(stage.staged_prefix(self.stage_dir, 'mpich',
+                                              self.info))
+        path = stage.stage(self.stage_dir, 'mpich', self.info)
+
+        self.assertEqual(path, stage.staged_prefix(self.stage_dir, 'mpich',
+                                                   self.info))
+        self.assertEqual('mpiexec.hydra',
+                         os.readlink(os.path.join(path, 'bin', 'mpiexec')))
+        self.assertTrue(os.path.exists(os.path.join(path, 'lib',
+                                                    'libmpi.so.12')))
+        # Only the runtime files are staged
+        self.assertFalse(os.path.exists(os.path.join(path, 'include')))
+        self.assertFalse(os.path.exists(os.path.join(path, 'share')))
+
+        # A complete copy is reused
+        mtime = os.path.getmtime(os.path.join(path, stage._marker))
+        self.assertEqual(path, stage.stage(self.stage_dir, 'mpich',
+                                           self.info))
+        self.assertEqual(mtime,
+                         os.path.getmtime(os.path.join(path, stage._marker)))
+
+    def test_absolute_symlinks(self):
+        # Absolute links into the installation point into the copy
+        lib = os.path.join(self.prefix, 'lib')
+        os.symlink(os.path.join(lib, 'libmpi.so.12'),
+                   os.path.join(lib, 'libmpi.so'))
+        os.symlink(os.path.join(self.prefix, 'bin', 'mpiexec.hydra'),
+                   os.path.join(lib, 'mpiexec'))
+        os.symlink(os.path.join(self.prefix, 'include'),
+                   os.path.join(lib, 'include'))
+        os.symlink('/bin/sh', os.path.join(lib, 'sh'))
+        path = stage.stage(self.stage_dir, 'mpich', self.info)
+
+        staged = os.path.join(path, 'lib')
+        self.assertEqual('libmpi.so.12',
+                         os.readlink(os.path.join(staged, 'libmpi.so')))
+        self.assertEqual(os.path.join(path, 'lib', 'libmpi.so.12'),
+                         os.path.realpath(os.path.join(staged, 'libmpi.so')))
+        self.assertEqual(os.path.join('..', 'bin', 'mpiexec.hydra'),
+                         os.readlink(os.path.join(staged, 'mpiexec')))
+        # Links to files that are not staged are kept
+        self.assertEqual(os.path.join(self.prefix, 'include'),
+                         os.readlink(os.path.join(staged, 'include')))
+        self.assertEqual('/bin/sh', os.readlink(os.path.join(staged, 'sh')))
+
+    def test_hardlink(self):
+        path = stage.stage(self.stage_dir, 'mpich', self.info,
+                           mode='hardlink')
+        src = os.stat(os.path.join(self.prefix, 'lib', 'libmpi.so.12'))
+        dst = os.stat(os.path.join(path, 'lib', 'libmpi.so.12'))
+        self.assertEqual(src.st_ino, dst.st_ino)
+
+    def test_rebuilt_installation(self):
+        path = stage.stage(self.stage_dir, 'mpich', self.info)
+        with open(os.path.join(self.prefix, 'lib', 'libmpi.so.12'),
+                  'ab') as f:
+            f.write(b'rebuilt')
+        # A stale copy is not used
+        self.assertIsNone(stage.staged_prefix(self.stage_dir, 'mpich',
+                                              self.info))
+        self.assertNotEqual(path, stage.stage(self.stage_dir, 'mpich',
+                                              self.info))
+
+    def test_no_digest(self):
+        # Looking for the staged copy reads no file contents
+        stage.stage(self.stage_dir, 'mpich', self.info)
+        saved = fingerprint.file_digest
+
+        def file_digest(path):
+            raise AssertionError("{} is read".format(path))
+        fingerprint.file_digest = file_digest
+        try:
+            self.assertIsNotNone(stage.staged_prefix(self.stage_dir, 'mpich',
+                                                     self.info))
+        finally:
+            fingerprint.file_digest = saved
+
+    def test_system_prefix(self):
+        info = dict(self.info, prefix='/usr')
+        self.assertRaises(stage.StageError, stage.stage,
+                          self.stage_dir, 'sys', info)
@@ -0,0 +1,59 @@
+# coding: utf-8
+
+import os
+import os.path
+import shutil
+from subprocess import PIPE
+from subprocess import Popen
+import sys
+import tempfile
+import unittest
+
+
+ProjDir = os.path.abspath(
+    os.path.join(os.path.dirname(__file__), '..'))
+
+
+class TestStartup(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.env = os.environ.copy()
+        self.env['MPIENV_ROOT'] = os.path.join(self.tmpdir, 'root')
+        self.env.pop('MPIENV_VERSIONS_DIR', None)
+        self.env['PYTHONPATH'] = ProjDir
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, args):
+        p = Popen([sys.executable] + args, stdout=PIPE, stderr=PIPE,
+                  env=self.env)
+        out, err = p.communicate()
+        self.assertEqual(0, p.returncode, err)
+        return out.decode(), err.decode()
+
+    def test_slim_imports(self):
+        # Importing common must not pull in modules only a few
+        # commands need.
+        heavy = ['distutils', 'glob', 'json', 'shutil', 'subprocess']
+        out, _ = self._run([
+            '-c',
+            'import sys; import common; '
+            'print(",".join(m for m in {!r} if m in sys.modules))'.format(
+                heavy)])
+        self.assertEqual("", out.strip())
+
+    def test_list_empty_writes_nothing(self):
+        out, err = self._run([os.path.join(ProjDir, 'bin', 'list.py')])
+        self.assertEqual("", out)
+        self.assertEqual("", err)
+        self.assertFalse(os.path.exists(self.env['MPIENV_ROOT']))
+
+    def test_mpi4py_writes_nothing(self):
+        # `mpienv exec` looks up mpi4py without installing it
+        self._run([
+            '-c',
+            'import common; from mpienv.py import MPI4Py; '
+            'm = MPI4Py(common.manager, "mpi"); '
+            'assert not m.is_installed()'])
+        self.assertFalse(os.path.exists(self.env['MPIENV_ROOT']))